@@ -3,6 +3,7 @@ from media_tree.admin.actions.utils import get_actions_context
 from media_tree.admin.actions.forms import FileNodeActionsWithUserForm, MoveSelectedForm, CopySelectedForm, ChangeMetadataForSelectedForm
 from media_tree.forms import MetadataForm
 from media_tree.utils.filenode import get_nested_filenode_list
+from media_tree.utils.db import get_common_values
 from django import forms
 from django.contrib import messages
 from django.utils.translation import ungettext, ugettext as _
@@ -34,16 +35,19 @@ def filenode_admin_action(modeladmin, request, queryset, form_class, extra_conte
             form = form_class(queryset, request.user, request.POST)
         if form.is_valid():
             form.save()
-            redirect_node = form.cleaned_data.get('target_node', None)
-            if not redirect_node:
-                redirect_node = get_current_node(form)
-            messages.success(request, message=ungettext(success_messages[0], success_messages[1], form.success_count) % {
-                'count': form.success_count, 
-                'verbose_name': FileNode._meta.verbose_name, 
-                'verbose_name_plural': FileNode._meta.verbose_name_plural
-            })
-            
-            return HttpResponseRedirect(reverse('admin:media_tree_filenode_changelist'))
+            # Forms may add errors while saving, in which case they are displayed
+            # again with the errors
+            if not form.errors:
+                redirect_node = form.cleaned_data.get('target_node', None)
+                if not redirect_node:
+                    redirect_node = get_current_node(form)
+                messages.success(request, message=ungettext(success_messages[0], success_messages[1], form.success_count) % {
+                    'count': form.success_count, 
+                    'verbose_name': FileNode._meta.verbose_name, 
+                    'verbose_name_plural': FileNode._meta.verbose_name_plural
+                })
+                
+                return HttpResponseRedirect(reverse('admin:media_tree_filenode_changelist'))
             #return HttpResponseRedirect(reverse('admin:media_tree_filenode_folder_expand', args=(redirect_node.pk,)))
             #return HttpResponseRedirect(redirect_node.get_admin_url())
 
@@ -111,17 +115,10 @@ def change_metadata_for_selected(modeladmin, request, queryset):
     # TODO Use AdminDateTimeWidget etc
     # TODO Should be able to leave required fields blank if confirmation not checked
     
-    # Compare all nodes in queryset in order to display initial values
-    # in form that have an identical value for all nodes 
-    initial = {}
-    for node in queryset:
-        for field in node._meta.fields:
-            if field.editable:
-                value = getattr(node, field.name)
-                if not field.name in initial:
-                    initial[field.name] = value
-                elif value != initial[field.name]:
-                    initial[field.name] = None
+    # Display initial values in form that are identical for all nodes,
+    # which are determined by a single aggregate query
+    initial = get_common_values(queryset, [field for field in FileNode._meta.fields
+        if field.editable and not field.primary_key])
 
     success_messages = ['%(count)i %(verbose_name)s changed.', '%(count)i %(verbose_name_plural)s changed.']
     extra_context = ({
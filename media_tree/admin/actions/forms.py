@@ -2,12 +2,13 @@ from media_tree.models import FileNode
 from media_tree.fields import FileNodeChoiceField
 from media_tree.forms import MetadataForm
 from media_tree.utils import get_media_storage
+from media_tree.utils.bulk import move_node_trees, copy_node_trees, update_metadata
+from media_tree.utils.thumbnails import clear_manifest
 from django import forms
 from django.forms.util import ErrorList
 from django.utils.translation import ugettext as _
 from django.contrib.admin import helpers
-from django.core.files.uploadedfile import UploadedFile
-from django.db.models import FileField
+from django.core.exceptions import NON_FIELD_ERRORS
 from mptt.exceptions import InvalidMove
 
 # TODO: mptt currently ignores order_insertion_by when calling insert_at or move_to. Bug report pending.
@@ -67,26 +68,11 @@ class MoveSelectedForm(FileNodeActionsWithUserForm):
     action_name = 'move_selected'
     enable_target_node_field = True
 
-    def move_node(self, node, target):
-        try:
-            # Reload object because tree attributes may be out of date
-            node = node.__class__.objects.get(pk=node.pk)
-            descendant_count = node.get_descendants().count()
-
-            if node.parent != target:
-                node.parent = target
-                node.attach_user(self.user, change=True)
-                node.save()
-                self.success_count += 1 + descendant_count
-            return node
-        except InvalidMove as e:
-            self.errors[NON_FIELD_ERRORS] = ErrorList(e)
-            raise
-
     def save(self):
         """
         Attempts to move the nodes using the selected target and
-        position.
+        position. All selected subtrees are moved at once (see
+        :func:`~media_tree.utils.bulk.move_node_trees`).
 
         If an invalid move is attempted, the related error message will
         be added to the form's non-field errors and the error will be
@@ -94,8 +80,13 @@ class MoveSelectedForm(FileNodeActionsWithUserForm):
         redisplay the form with the error, should it occur.
         """
         self.success_count = 0
-        for node in self.get_selected_nodes():
-            self.move_node(node, self.cleaned_data['target_node'])
+        try:
+            nodes = move_node_trees(self.get_selected_nodes(), self.cleaned_data['target_node'], self.user)
+        except InvalidMove as e:
+            self.errors[NON_FIELD_ERRORS] = ErrorList(e.args)
+            raise
+        for node in nodes:
+            self.success_count += node.get_descendant_count() + 1
 
 
 class CopySelectedForm(FileNodeActionsWithUserForm):
@@ -103,42 +94,14 @@ class CopySelectedForm(FileNodeActionsWithUserForm):
     action_name = 'copy_selected'
     enable_target_node_field = True
 
-    def copy_node(self, node, target):
-
-        def clone_node(from_node):
-            copy_additional_fields = ('node_type',)
-            args = dict([(fld.name, getattr(from_node, fld.name))
-                for fld in from_node._meta.fields
-                    if fld.name in copy_additional_fields or fld.editable  \
-                    and fld != from_node._meta.auto_field  \
-                    and not isinstance(fld, FileField)])
-            return from_node.__class__(**args)
-
-        def make_uploaded_files(node, from_node):
-            for fld in node._meta.fields:
-                if isinstance(fld, FileField):
-                    # Creating an UploadedFile from the original file results in the file being copied on disk on save()
-                    existing_file = getattr(from_node, fld.name)
-                    uploaded_file = UploadedFile(existing_file, existing_file.name, None, from_node.size)
-                    setattr(node, fld.name, uploaded_file)
-
-        new_node = clone_node(node)
-        make_uploaded_files(new_node, node)
-        new_node.parent = target
-        new_node.attach_user(self.user, change=True)
-        new_node.save()
-        if new_node.node_type == FileNode.FOLDER:
-            self.copy_nodes_rec(node.get_children(), new_node)
-        return new_node
-
-    def copy_nodes_rec(self, nodes, target):
-        for node in nodes:
-            self.copy_node(node, target)
-            self.success_count += 1
-
     def save(self):
-        self.success_count = 0
-        self.copy_nodes_rec(self.get_selected_nodes(), self.cleaned_data['target_node'])
+        """
+        Copies the selected nodes to the selected target. All selected
+        subtrees are inserted at once (see
+        :func:`~media_tree.utils.bulk.copy_node_trees`).
+        """
+        self.success_count = len(copy_node_trees(self.get_selected_nodes(),
+            self.cleaned_data['target_node'], self.user))
 
 
 class ChangeMetadataForSelectedForm(FileNodeActionsWithUserForm):
@@ -164,26 +127,23 @@ class ChangeMetadataForSelectedForm(FileNodeActionsWithUserForm):
                         if not validator in self.fields[key].validators:
                             self.fields[key].validators.append(validator)
 
-    def update_node(self, node, metadata):
-        changed = False
-        for key in metadata:
-            if getattr(node, key) != metadata[key]:
-                setattr(node, key, metadata[key])
-                changed = True
-        node.attach_user(self.user, change=True)
-        node.save()
-        return changed
-
-    def save_nodes_rec(self, nodes):
-        for node in nodes:
-            if self.update_node(node, self.confirmed_data):
-                self.success_count += 1
-            if self.cleaned_data['recursive'] and node.is_folder():
-                self.save_nodes_rec(node.get_children())
-
     def save(self):
-        self.success_count = 0
-        self.save_nodes_rec(self.get_selected_nodes())
+        """
+        Sets the confirmed fields for the selected nodes, and for all their
+        descendants if ``recursive`` is checked, using a single ``UPDATE``
+        statement (see :func:`~media_tree.utils.bulk.update_metadata`), and
+        counts the nodes that were changed.
+        """
+        metadata = dict(self.confirmed_data)
+        moved_count = 0
+        if 'parent' in metadata:
+            # Changing the parent moves the nodes, which cannot be done by an
+            # update. Moved nodes have changed, but are counted only once.
+            for node in move_node_trees(self.get_selected_nodes(), metadata.pop('parent'), self.user):
+                if not [name for name in metadata if getattr(node, name) != metadata[name]]:
+                    moved_count += 1
+        self.success_count = moved_count + update_metadata(self.get_selected_nodes(), metadata,
+            self.user, self.cleaned_data['recursive'])
 
 
 class StorageFilesForm(FileNodeActionsForm):
@@ -225,3 +185,7 @@ class DeleteCacheFilesForm(DeleteStorageFilesForm):
 
     action_name = 'clear_cache'
     selected_files_label = _('Cache files')
+
+    def save(self):
+        super(DeleteCacheFilesForm, self).save()
+        clear_manifest()
@@ -1,4 +1,4 @@
-from media_tree.utils.maintenance import get_broken_media, get_cache_files
+from media_tree.utils.maintenance import get_broken_media, get_cache_files, update_aggregates
 from media_tree.utils import get_media_storage
 from media_tree.models import FileNode
 from media_tree.admin.actions.utils import get_actions_context
@@ -73,9 +73,11 @@ delete_orphaned_files.allow_empty_queryset = True
 
 def rebuild_tree(modeladmin, request, queryset=None):
     """
-    Rebuilds whole tree in database using `parent` link.
+    Rebuilds whole tree in database using `parent` link, and recomputes the
+    stored folder aggregates.
     """
     tree = FileNode.tree.rebuild()
+    update_aggregates()
     messages.success(request, message=_('The node tree was rebuilt.'))
     return HttpResponseRedirect('')
 rebuild_tree.short_description = _('Repair node tree')
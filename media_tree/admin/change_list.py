@@ -1,5 +1,8 @@
 import django
 from media_tree.models import FileNode
+from media_tree.media_backends import get_media_backend
+from media_tree.utils.thumbnails import prefetch_thumbnails
+from media_tree import settings as app_settings
 from media_tree.admin.utils import get_current_request, is_search_request,  \
     get_request_attr
     
@@ -52,6 +55,10 @@ class MediaTreeChangeList(MPTTChangeList):
             else:
                 qs = qs.filter(parent=self.parent_folder)
 
+        if 'modified_by' in self.list_display:
+            # The admin only follows non-nullable foreign keys by default
+            qs = qs.select_related('modified_by')
+
         if request is not None and self.is_filtered(request):
             return qs.order_by('name')
         else:
@@ -81,5 +88,42 @@ class MediaTreeChangeList(MPTTChangeList):
                 else:
                     item.reduce_levels = reduce_levels
                     item.level = max(0, item.level - reduce_levels)
+        self.annotate_results(request)
+
+    def annotate_results(self, request):
+        """
+        Annotates all nodes on the current page with data that the row methods
+        of the ``FileNodeAdmin`` would otherwise have to query separately for
+        each row, so that rendering a page costs a constant number of queries:
+
+        * ``child_count``: The number of children of a folder, retrieved for all
+          folders in a single grouped query.
+        * ``thumbnail_backend``: The media backend used for rendering the
+          preview, which is only looked up once per media type.
+        * ``prefetched_thumbnails``: The thumbnail manifest entries for the
+          previews of all nodes on the page, loaded in a single query.
+
+        Subtree sizes and metadata flags do not need to be annotated since they
+        are stored with each folder.
+        """
+        folder_pks = [item.pk for item in self.result_list if item.node_type == FileNode.FOLDER]
+        child_counts = {}
+        if folder_pks:
+            children = FileNode.objects.filter(parent__in=folder_pks).order_by()
+            for row in children.values('parent').annotate(count=models.Count('pk')):
+                child_counts[row['parent']] = row['count']
+        thumbnail_backends = {}
+        for item in self.result_list:
+            if item.node_type == FileNode.FOLDER:
+                item.child_count = child_counts.get(item.pk, 0)
+            if not item.media_type in thumbnail_backends:
+                thumbnail_backends[item.media_type] = get_media_backend(
+                    handles_media_types=(item.media_type,), supports_thumbnails=True)
+            item.thumbnail_backend = thumbnail_backends[item.media_type]
+        thumb_size_key = get_request_attr(request, 'thumbnail_size') or 'default'
+        prefetched = prefetch_thumbnails([item.get_preview_file() for item in self.result_list if item.thumbnail_backend],
+            {'size': app_settings.MEDIA_TREE_ADMIN_THUMBNAIL_SIZES[thumb_size_key]})
+        for item in self.result_list:
+            item.prefetched_thumbnails = prefetched
         
 
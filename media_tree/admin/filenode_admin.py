@@ -32,6 +32,7 @@ from media_tree.admin.change_list import MediaTreeChangeList
 from media_tree.admin.utils import get_current_request, set_current_request,  \
     get_request_attr, set_request_attr, is_search_request
 from media_tree.media_backends import get_media_backend
+from media_tree.utils.thumbnails import get_thumbnail
 
 try:
     from mptt.admin import MPTTModelAdmin
@@ -246,7 +247,12 @@ class FileNodeAdmin(MPTTModelAdmin):
         else:
             qs_params = None
         if node.is_folder():
-            empty = ' empty' if node.get_children().count() == 0 else ''
+            if hasattr(node, 'child_count'):
+                # annotated by MediaTreeChangeList
+                child_count = node.child_count
+            else:
+                child_count = node.get_children().count()
+            empty = ' empty' if child_count == 0 else ''
             return '<a href="%s" class="folder-toggle%s" rel="%s"><span>%s</span></a>' %  \
                 (node.get_admin_url(qs_params), empty, rel, '+')
         else:
@@ -257,7 +263,11 @@ class FileNodeAdmin(MPTTModelAdmin):
     def admin_preview(self, node, icons_only=False):
         request = get_current_request()
         template = 'admin/media_tree/filenode/includes/preview.html'
-        thumbnail_backend = get_media_backend(handles_media_types=(node.media_type,), supports_thumbnails=True)
+        if hasattr(node, 'thumbnail_backend'):
+            # annotated by MediaTreeChangeList
+            thumbnail_backend = node.thumbnail_backend
+        else:
+            thumbnail_backend = get_media_backend(handles_media_types=(node.media_type,), supports_thumbnails=True)
         if not thumbnail_backend:
             icons_only = True
             template = 'media_tree/filenode/includes/icon.html'
@@ -272,7 +282,8 @@ class FileNodeAdmin(MPTTModelAdmin):
         if not icons_only:
             thumb_size_key = get_request_attr(request, 'thumbnail_size') or 'default'
             context['thumbnail_size'] = app_settings.MEDIA_TREE_ADMIN_THUMBNAIL_SIZES[thumb_size_key]
-            thumb = thumbnail_backend.get_thumbnail(context['preview_file'], {'size': context['thumbnail_size']})
+            thumb = get_thumbnail(context['preview_file'], {'size': context['thumbnail_size']}, thumbnail_backend,
+                getattr(node, 'prefetched_thumbnails', None))
             context['thumb'] = thumb
 
         preview = render_to_string(template, context)
@@ -314,12 +325,8 @@ class FileNodeAdmin(MPTTModelAdmin):
 
     def size_formatted(self, node, with_descendants=True):
         if node.node_type == FileNode.FOLDER:
-            if with_descendants:
-                descendants = node.get_descendants()
-                if descendants.count() > 0:
-                    size = descendants.aggregate(models.Sum('size'))['size__sum']
-                else:
-                    size = None
+            if with_descendants and node.file_count:
+                size = node.total_size
             else:
                 size = None
         else:
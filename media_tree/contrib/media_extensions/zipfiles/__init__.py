@@ -4,7 +4,21 @@ zipfiles
 
 The *zipfiles* extension adds support for ZIP archives to the ``FileNodeAdmin``.
 If it is installed, you can select files and folders in the admin and
-download them as a ZIP archive. 
+download them as a ZIP archive. Archives are streamed to the client while they
+are generated, so downloading large folders does not require keeping the
+archive in memory. Files that are already compressed (see
+``MEDIA_TREE_ZIPFILES_STORED_EXTENSIONS``) are stored without compression.
+
+You can also extract selected ZIP archives into a folder, which creates a
+folder for every directory and a file for every file in the archive. Entries
+that are symbolic links or whose paths point outside the archive are skipped.
+
+Generated archives are cached in ``MEDIA_TREE_ZIPFILES_CACHE_ROOT``, so that
+downloading the same selection again does not require compressing all files
+again. Cached archives are only served through the admin, which checks the
+permissions of the user, so this directory must not be publicly accessible. Whenever one of the contained nodes changes, a new archive is generated.
+The least recently downloaded archives are deleted when the cache exceeds
+``MEDIA_TREE_ZIPFILES_CACHE_MAX_BYTES``.
 
 To install it, add the extension module to your ``INSTALLED_APPS`` setting::   
 
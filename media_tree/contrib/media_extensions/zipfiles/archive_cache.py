@@ -0,0 +1,171 @@
+"""
+Caching of generated ZIP archives in ``MEDIA_TREE_ZIPFILES_CACHE_ROOT``.
+
+Archives are stored under a name derived from the primary keys and
+modification dates of all nodes they contain, as well as the options they were
+generated with. Since changing, adding or removing a node changes this name,
+cached archives never need to be invalidated explicitly: Outdated archives are
+simply not requested anymore, and are eventually evicted when the total size
+of the cache exceeds ``MEDIA_TREE_ZIPFILES_CACHE_MAX_BYTES``.
+
+Archives may contain files of unpublished nodes, so they are not stored in the
+media storage, whose files are publicly accessible, but only served by the
+admin view after checking the permissions of the user.
+"""
+from media_tree.contrib.media_extensions.zipfiles import settings as app_settings
+from media_tree.contrib.media_extensions.zipfiles.zip_operations import iter_compressed_nodes
+from media_tree.utils.maintenance import iter_storage_files, iter_evicted_cache_files
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+import hashlib
+import os
+import tempfile
+import threading
+
+# Needs to be incremented when the way archives are generated changes
+ARCHIVE_FORMAT_VERSION = 1
+
+__storages = {}
+__storages_lock = threading.Lock()
+
+
+def is_cache_enabled():
+    return bool(app_settings.MEDIA_TREE_ZIPFILES_CACHE_MAX_BYTES)
+
+
+def get_cache_storage():
+    """
+    Returns a storage for the cache directory ``MEDIA_TREE_ZIPFILES_CACHE_ROOT``.
+    The storage is only instantiated once per process.
+    """
+    location = app_settings.MEDIA_TREE_ZIPFILES_CACHE_ROOT
+    try:
+        return __storages[location]
+    except KeyError:
+        with __storages_lock:
+            if not location in __storages:
+                __storages[location] = FileSystemStorage(location=location)
+            return __storages[location]
+
+
+def get_archive_key(nodes):
+    """
+    Returns a SHA-1 hash of the sorted ``(pk, modified)`` pairs of ``nodes``
+    and all their descendants, and of the options archives are generated with.
+    """
+    members = set()
+    for node in nodes:
+        for pk, modified in node.get_descendants(include_self=True).values_list('pk', 'modified'):
+            members.add((pk, modified.isoformat() if modified else ''))
+    items = ['%i:%s' % member for member in sorted(members)]
+    items.append('v%i' % ARCHIVE_FORMAT_VERSION)
+    items.append(','.join(sorted(app_settings.MEDIA_TREE_ZIPFILES_STORED_EXTENSIONS)))
+    return hashlib.sha1('&'.join(items).encode('utf-8')).hexdigest()
+
+
+def get_cached_archive_name(nodes):
+    """
+    Returns the name that the archive of ``nodes`` is cached under in the
+    cache storage.
+    """
+    return '%s.zip' % get_archive_key(nodes)
+
+
+def touch_archive(storage, storage_name):
+    """
+    Updates the access time of a cached archive, so that the least recently
+    downloaded archives are evicted first.
+    """
+    try:
+        os.utime(storage.path(storage_name), None)
+    except (NotImplementedError, OSError):
+        pass
+
+
+def iter_archive_file(storage, storage_name, chunk_size=None):
+    """
+    Yields the contents of a cached archive in chunks.
+    """
+    chunk_size = chunk_size or app_settings.MEDIA_TREE_ZIPFILES_CHUNK_SIZE
+    archive = storage.open(storage_name, 'rb')
+    try:
+        while True:
+            data = archive.read(chunk_size)
+            if not data:
+                break
+            yield data
+    finally:
+        archive.close()
+
+
+def iter_cached_archive(nodes, storage_name):
+    """
+    Yields the chunks of a new archive of ``nodes``, while writing them to a
+    temporary file. When the archive is complete, outdated archives are evicted
+    to make room for it, and it is saved to storage as ``storage_name``.
+    Archives larger than ``MEDIA_TREE_ZIPFILES_CACHE_MAX_BYTES`` are not cached.
+    If the iteration is aborted, for instance because the client disconnected,
+    nothing is cached.
+    """
+    temp_file = tempfile.TemporaryFile()
+    try:
+        for chunk in iter_compressed_nodes(nodes):
+            temp_file.write(chunk)
+            yield chunk
+        size = temp_file.tell()
+        max_bytes = app_settings.MEDIA_TREE_ZIPFILES_CACHE_MAX_BYTES or 0
+        storage = get_cache_storage()
+        if size <= max_bytes and not storage.exists(storage_name):
+            # Evicting before saving, so the new archive is never evicted
+            evict_archives(max_bytes - size)
+            temp_file.seek(0)
+            saved_name = storage.save(storage_name, File(temp_file))
+            if saved_name != storage_name:
+                # The same archive was cached concurrently
+                storage.delete(saved_name)
+    finally:
+        temp_file.close()
+
+
+def iter_archive(nodes):
+    """
+    Yields the chunks of an archive of ``nodes``, read from the cache if it
+    was generated before, or generated and cached otherwise. Returns a tuple
+    of the iterator and the size of the archive, which is ``None`` if it is not
+    known in advance.
+    """
+    if not is_cache_enabled():
+        return (iter_compressed_nodes(nodes), None)
+    storage = get_cache_storage()
+    storage_name = get_cached_archive_name(nodes)
+    if storage.exists(storage_name):
+        touch_archive(storage, storage_name)
+        return (iter_archive_file(storage, storage_name), storage.size(storage_name))
+    return (iter_cached_archive(nodes, storage_name), None)
+
+
+def iter_archive_cache_files():
+    storage = get_cache_storage()
+    if os.path.isdir(storage.location):
+        for storage_name in iter_storage_files(storage, ''):
+            yield storage_name
+
+
+def evict_archives(max_bytes=None):
+    """
+    Deletes the least recently used cached archives until their total size is
+    at most ``max_bytes``, or ``MEDIA_TREE_ZIPFILES_CACHE_MAX_BYTES``. Returns
+    the number of deleted archives.
+    """
+    if max_bytes is None:
+        max_bytes = app_settings.MEDIA_TREE_ZIPFILES_CACHE_MAX_BYTES or 0
+    storage = get_cache_storage()
+    count = 0
+    for storage_name, size in iter_evicted_cache_files(max_bytes=max_bytes,
+        iter_files=iter_archive_cache_files, storage=storage):
+            try:
+                storage.delete(storage_name)
+                count += 1
+            except OSError:
+                pass
+    return count
@@ -0,0 +1,38 @@
+from media_tree.admin.actions.forms import FileNodeActionsWithUserForm
+from media_tree.contrib.media_extensions.zipfiles.zip_operations import is_archive, extract_archive, ArchiveTooLargeError
+from django import forms
+from django.core.exceptions import NON_FIELD_ERRORS
+from django.forms.util import ErrorList
+from django.utils.translation import ugettext as _
+import zipfile
+
+
+class ExtractSelectedArchivesForm(FileNodeActionsWithUserForm):
+
+    action_name = 'extract_selected_archives'
+    enable_target_node_field = True
+
+    def clean(self):
+        cleaned_data = super(ExtractSelectedArchivesForm, self).clean()
+        if not [node for node in self.get_selected_nodes() if is_archive(node)]:
+            raise forms.ValidationError(_('None of the selected objects is a ZIP archive.'))
+        return cleaned_data
+
+    def save(self):
+        """
+        Extracts all selected archives. Archives that are invalid or exceed the
+        configured limits are skipped, and the errors are added to the form's
+        non-field errors.
+        """
+        self.success_count = 0
+        errors = []
+        for node in self.get_selected_nodes():
+            if is_archive(node):
+                try:
+                    self.success_count += len(extract_archive(node, self.cleaned_data['target_node'], self.user))
+                except ArchiveTooLargeError as e:
+                    errors.extend(e.args)
+                except zipfile.BadZipfile:
+                    errors.append(_('%s is not a valid ZIP archive.') % node.name)
+        if errors:
+            self.errors[NON_FIELD_ERRORS] = ErrorList(errors)
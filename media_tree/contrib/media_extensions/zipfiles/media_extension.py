@@ -1,11 +1,8 @@
-from media_tree.contrib.media_extensions.zipfiles import zip_operations as operations
+from media_tree.contrib.media_extensions.zipfiles.archive_cache import iter_archive
 from media_tree import extension
-from cStringIO import StringIO
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.utils.translation import ugettext, ugettext_lazy as _
 
-# TODO: Implement extract_selected_archives, which unzips the selected archives into
-# a selectable or new destination folder
 class ZipFileAdminExtender(extension.AdminExtender):
     
     def download_selected_as_archive(modeladmin, request, queryset):
@@ -15,18 +12,30 @@ class ZipFileAdminExtender(extension.AdminExtender):
             file_name = ugettext('Archive')
         file_ext = 'zip'
         
-        response = HttpResponse(mimetype='application/zip')
+        # Unless the archive is cached, it is generated while it is sent, so
+        # its length is unknown
+        chunks, size = iter_archive(queryset)
+        response = StreamingHttpResponse(chunks, content_type='application/zip')
         response['Content-Disposition'] = 'attachment; filename=%s.%s' % (
             file_name, file_ext)
-        buffer = StringIO()
-        operations.compress_nodes(buffer, queryset)
-        buffer.flush()
-        response.write(buffer.getvalue())
-        response['Content-Length'] = len(response.content);
-        buffer.close()
+        if size is not None:
+            response['Content-Length'] = size
         return response
     download_selected_as_archive.short_description = _('Download selected %(verbose_name_plural)s as archive')
+
+    def extract_selected_archives(modeladmin, request, queryset):
+        # Imported here since media extensions are loaded while models are imported
+        from media_tree.admin.actions.core_actions import filenode_admin_action
+        from media_tree.contrib.media_extensions.zipfiles.forms import ExtractSelectedArchivesForm
+        success_messages = ['%(count)i %(verbose_name)s extracted.', '%(count)i %(verbose_name_plural)s extracted.']
+        extra_context = ({
+            'title': ugettext('Extract archives'),
+            'submit_label': ugettext('Extract'),
+        })
+        return filenode_admin_action(modeladmin, request, queryset, ExtractSelectedArchivesForm,
+            extra_context, success_messages)
+    extract_selected_archives.short_description = _('Extract selected archives')
     
-    actions = [download_selected_as_archive]
+    actions = [download_selected_as_archive, extract_selected_archives]
 
 extension.register(ZipFileAdminExtender)
@@ -0,0 +1,48 @@
+from django.conf import settings
+import os
+import tempfile
+
+MEDIA_TREE_ZIPFILES_STORED_EXTENSIONS = getattr(settings, 'MEDIA_TREE_ZIPFILES_STORED_EXTENSIONS', (
+    '7z', 'aac', 'bz2', 'docx', 'flac', 'flv', 'gif', 'gz', 'jpeg', 'jpg', 'key',
+    'm4a', 'm4v', 'mkv', 'mov', 'mp3', 'mp4', 'mpeg', 'mpg', 'numbers', 'odg',
+    'odp', 'ods', 'odt', 'ogg', 'pages', 'png', 'pptx', 'rar', 'webm', 'wma',
+    'wmv', 'xlsx', 'zip'))
+"""
+File extensions of files that are already compressed. These files are added to
+archives without compression (``ZIP_STORED``), since compressing them again
+would not reduce their size, but cost CPU time.
+"""
+
+MEDIA_TREE_ZIPFILES_CHUNK_SIZE = getattr(settings, 'MEDIA_TREE_ZIPFILES_CHUNK_SIZE', 64 * 1024)
+"""
+Number of bytes that are read from storage and sent to the client at a time
+when streaming archives.
+"""
+
+MEDIA_TREE_ZIPFILES_CACHE_ROOT = getattr(settings, 'MEDIA_TREE_ZIPFILES_CACHE_ROOT',
+    os.path.join(tempfile.gettempdir(), 'media_tree_archive_cache'))
+"""
+The absolute path of the local directory where generated archives are cached.
+Archives may contain files of unpublished nodes, so this directory must not be
+served by the web server, and must not be located under your ``MEDIA_ROOT``.
+"""
+
+MEDIA_TREE_ZIPFILES_CACHE_MAX_BYTES = getattr(settings, 'MEDIA_TREE_ZIPFILES_CACHE_MAX_BYTES', 1024 ** 3)
+"""
+The maximum total size of cached archives. When a new archive is cached, the
+least recently used archives are deleted until the cache fits into this size.
+Set to ``0`` or ``None`` to disable caching of archives.
+"""
+
+MEDIA_TREE_ZIPFILES_EXTRACT_MAX_BYTES = getattr(settings, 'MEDIA_TREE_ZIPFILES_EXTRACT_MAX_BYTES', 1024 ** 3)
+"""
+The maximum total uncompressed size of the files extracted from an archive.
+Archives exceeding it are not extracted, and extraction is aborted if the
+entries contain more data than declared. Set to ``None`` to disable the limit.
+"""
+
+MEDIA_TREE_ZIPFILES_EXTRACT_MAX_ENTRIES = getattr(settings, 'MEDIA_TREE_ZIPFILES_EXTRACT_MAX_ENTRIES', 10000)
+"""
+The maximum number of entries of an archive that is extracted. Set to ``None``
+to disable the limit.
+"""
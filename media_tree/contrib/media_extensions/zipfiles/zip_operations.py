@@ -1,17 +1,357 @@
+"""
+Streaming creation of ZIP archives from ``FileNode`` objects, and extraction
+of ZIP archives into new ``FileNode`` objects.
+
+``zipfile.ZipFile`` needs a seekable file to write archives to, since it
+updates the header of each member after writing its data. Instead, the
+:class:`ZipStream` writer sets the "data descriptor" flag and appends the CRC
+and sizes after each member's data, so archives can be generated as a stream of
+chunks and sent to the client while files are read from storage. ZIP64
+extensions are used for members and archives exceeding 4 GB or 65535 members.
+"""
+from media_tree.contrib.media_extensions.zipfiles import settings as app_settings
+from media_tree.utils.bulk import probe_files, insert_node_trees
+from media_tree.utils.storage import save_node_file, delete_stored_files
+from django.template.defaultfilters import filesizeformat
+from django.utils.translation import ugettext as _
+try:
+    from django.utils.encoding import force_unicode
+except ImportError:
+    from django.utils.encoding import force_text as force_unicode
+import posixpath
+import re
+import stat
+import struct
+import tempfile
 import zipfile
-import os
+import zlib
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP32_COUNT_LIMIT = 0xFFFF
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+# Unix, so that the external attributes are interpreted as file permissions
+VERSION_MADE_BY = (3 << 8) | VERSION_ZIP64
+EXTERNAL_ATTR = (0o100644 << 16)
+
+STRUCT_LOCAL_HEADER = struct.Struct('<4sHHHHHLLLHH')
+STRUCT_DATA_DESCRIPTOR = struct.Struct('<4sLLL')
+STRUCT_DATA_DESCRIPTOR_ZIP64 = struct.Struct('<4sLQQ')
+STRUCT_CENTRAL_HEADER = struct.Struct('<4sHHHHHHLLLHHHHHLL')
+STRUCT_END_RECORD = struct.Struct('<4sHHHHLLH')
+STRUCT_END_RECORD_ZIP64 = struct.Struct('<4sQHHLLQQQQ')
+STRUCT_END_LOCATOR_ZIP64 = struct.Struct('<4sLQL')
+
+RE_DRIVE = re.compile(r'^[A-Za-z]:')
+# Metadata added by the OS X archive utility, which is of no use in the media tree
+IGNORED_DIRS = ('__MACOSX',)
+
+
+class ArchiveTooLargeError(IOError):
+    """
+    Raised when an archive exceeds ``MEDIA_TREE_ZIPFILES_EXTRACT_MAX_BYTES`` or
+    ``MEDIA_TREE_ZIPFILES_EXTRACT_MAX_ENTRIES``.
+    """
+    pass
+
+
+def get_dos_date_time(date_time):
+    if date_time is None or date_time.year < 1980:
+        return (0, (1 << 5) | 1)
+    return ((date_time.hour << 11) | (date_time.minute << 5) | (date_time.second // 2),
+        ((date_time.year - 1980) << 9) | (date_time.month << 5) | date_time.day)
+
+
+class ZipStream(object):
+    """
+    Writes a ZIP archive as a stream of chunks. Call :meth:`add_file` for each
+    member and :meth:`close` when done, both of which return an iterator of
+    chunks of archive data.
+    """
+
+    def __init__(self, chunk_size=None):
+        self.chunk_size = chunk_size or app_settings.MEDIA_TREE_ZIPFILES_CHUNK_SIZE
+        self.offset = 0
+        self.members = []
+
+    def _write(self, data):
+        self.offset += len(data)
+        return data
+
+    def add_file(self, arcname, fileobj, size=None, date_time=None, compress=True):
+        """
+        Yields the chunks for adding the contents of ``fileobj`` as ``arcname``,
+        reading it in chunks. ``size`` is the expected size of the file, which
+        determines whether ZIP64 extensions are needed for the member.
+        """
+        name = arcname.encode('utf-8')
+        compression = ZIP_DEFLATED if compress else ZIP_STORED
+        # Deflating incompressible data may produce slightly more bytes
+        zip64 = size is None or size >= ZIP32_LIMIT - (ZIP32_LIMIT >> 8)
+        time, date = get_dos_date_time(date_time)
+        flags = FLAG_DATA_DESCRIPTOR | FLAG_UTF8
+        header_offset = self.offset
+
+        extra = b''
+        if zip64:
+            extra = struct.pack('<HHQQ', 1, 16, 0, 0)
+        yield self._write(STRUCT_LOCAL_HEADER.pack(b'PK\x03\x04',
+            VERSION_ZIP64 if zip64 else VERSION_DEFAULT, flags, compression,
+            time, date, 0, ZIP32_LIMIT if zip64 else 0, ZIP32_LIMIT if zip64 else 0,
+            len(name), len(extra)) + name + extra)
+
+        crc = 0
+        file_size = compressed_size = 0
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15) if compress else None
+        while True:
+            data = fileobj.read(self.chunk_size)
+            if not data:
+                break
+            file_size += len(data)
+            crc = zlib.crc32(data, crc)
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                compressed_size += len(data)
+                yield self._write(data)
+        if compressor:
+            data = compressor.flush()
+            compressed_size += len(data)
+            yield self._write(data)
+        crc = crc & 0xFFFFFFFF
+
+        if zip64:
+            yield self._write(STRUCT_DATA_DESCRIPTOR_ZIP64.pack(b'PK\x07\x08',
+                crc, compressed_size, file_size))
+        elif file_size >= ZIP32_LIMIT or compressed_size >= ZIP32_LIMIT:
+            raise ValueError('%s is larger than its expected size' % arcname)
+        else:
+            yield self._write(STRUCT_DATA_DESCRIPTOR.pack(b'PK\x07\x08',
+                crc, compressed_size, file_size))
+
+        self.members.append((name, flags, compression, time, date, crc,
+            compressed_size, file_size, header_offset, zip64))
+
+    def close(self):
+        """
+        Yields the chunks of the central directory, which completes the archive.
+        """
+        central_directory_offset = self.offset
+        for name, flags, compression, time, date, crc, compressed_size, file_size, header_offset, zip64 in self.members:
+            extra_values = []
+            if file_size >= ZIP32_LIMIT:
+                extra_values.append(file_size)
+                file_size = ZIP32_LIMIT
+            if compressed_size >= ZIP32_LIMIT:
+                extra_values.append(compressed_size)
+                compressed_size = ZIP32_LIMIT
+            if header_offset >= ZIP32_LIMIT:
+                extra_values.append(header_offset)
+                header_offset = ZIP32_LIMIT
+            extra = b''
+            if extra_values:
+                extra = struct.pack('<HH%dQ' % len(extra_values), 1, 8 * len(extra_values), *extra_values)
+            yield self._write(STRUCT_CENTRAL_HEADER.pack(b'PK\x01\x02',
+                VERSION_MADE_BY, VERSION_ZIP64 if zip64 or extra_values else VERSION_DEFAULT,
+                flags, compression, time, date, crc, compressed_size, file_size,
+                len(name), len(extra), 0, 0, 0, EXTERNAL_ATTR, header_offset) + name + extra)
 
-def write_nodes_recursive(archive, nodes, parent_path=''):
+        central_directory_size = self.offset - central_directory_offset
+        count = len(self.members)
+        if count >= ZIP32_COUNT_LIMIT or central_directory_offset >= ZIP32_LIMIT  \
+            or central_directory_size >= ZIP32_LIMIT:
+                end_record_offset = self.offset
+                yield self._write(STRUCT_END_RECORD_ZIP64.pack(b'PK\x06\x06',
+                    STRUCT_END_RECORD_ZIP64.size - 12, VERSION_MADE_BY, VERSION_ZIP64, 0, 0,
+                    count, count, central_directory_size, central_directory_offset))
+                yield self._write(STRUCT_END_LOCATOR_ZIP64.pack(b'PK\x06\x07',
+                    0, end_record_offset, 1))
+                count = min(count, ZIP32_COUNT_LIMIT)
+                central_directory_size = min(central_directory_size, ZIP32_LIMIT)
+                central_directory_offset = min(central_directory_offset, ZIP32_LIMIT)
+        yield self._write(STRUCT_END_RECORD.pack(b'PK\x05\x06', 0, 0,
+            count, count, central_directory_size, central_directory_offset, 0))
+
+
+def iter_archive_members(nodes):
+    """
+    Yields an ``(arcname, node)`` tuple for every file in ``nodes`` and their
+    descendants. The descendants of each selected folder are fetched in a
+    single query, and their archive names are built from the names of their
+    ancestors.
+    """
+    seen = set()
     for node in nodes:
-        arcname = os.path.join(parent_path, node.name)
+        if node.pk in seen:
+            continue
         if node.is_file():
-            archive.write(node.file.path, arcname)
+            seen.add(node.pk)
+            yield (node.name, node)
         elif node.is_folder():
-            write_nodes_recursive(archive, node.get_children(), arcname)
+            arcnames = {node.pk: node.name}
+            for descendant in node.get_descendants():
+                arcname = posixpath.join(arcnames[descendant.parent_id], descendant.name)
+                if descendant.is_folder():
+                    arcnames[descendant.pk] = arcname
+                elif not descendant.pk in seen:
+                    seen.add(descendant.pk)
+                    yield (arcname, descendant)
+
+
+def is_compressed(node):
+    return (node.extension or '').lower() in app_settings.MEDIA_TREE_ZIPFILES_STORED_EXTENSIONS
+
+
+def iter_compressed_nodes(nodes, chunk_size=None):
+    """
+    Yields the chunks of a ZIP archive containing ``nodes`` and their
+    descendants. Files are read from their storage in chunks, so neither the
+    files nor the archive are ever loaded into memory completely.
+    """
+    stream = ZipStream(chunk_size)
+    for arcname, node in iter_archive_members(nodes):
+        fileobj = node.file.storage.open(node.file.name, 'rb')
+        try:
+            for chunk in stream.add_file(arcname, fileobj, size=node.size,
+                date_time=node.modified, compress=not is_compressed(node)):
+                    yield chunk
+        finally:
+            fileobj.close()
+    for chunk in stream.close():
+        yield chunk
+
 
 def compress_nodes(file, nodes):
-    archive = zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED)
-    write_nodes_recursive(archive, nodes)
-    archive.close()
-    return archive
+    """
+    Writes a ZIP archive containing ``nodes`` and their descendants to
+    ``file``, which does not need to be seekable.
+    """
+    for chunk in iter_compressed_nodes(nodes):
+        file.write(chunk)
+
+
+def get_entry_path(info):
+    """
+    Returns a list of the path components of an archive entry, or ``None`` if
+    the entry should not be extracted because it is a symbolic link or its
+    path is absolute or points outside the extraction directory.
+    """
+    name = force_unicode(info.filename).replace('\\', '/')
+    if name.startswith('/') or RE_DRIVE.match(name):
+        return None
+    if stat.S_ISLNK(info.external_attr >> 16):
+        return None
+    parts = [part for part in name.split('/') if part not in ('', '.')]
+    if not parts or '..' in parts or parts[0] in IGNORED_DIRS:
+        return None
+    return parts
+
+
+def is_archive(node):
+    return node.is_file() and node.extension == 'zip'
+
+
+def __get_too_large_error(node, max_bytes):
+    return ArchiveTooLargeError(_('%(name)s exceeds the maximum extracted size of %(size)s.') % {
+        'name': node.name, 'size': filesizeformat(max_bytes)})
+
+
+def __copy_entry(node, entry, fileobj, max_bytes):
+    """
+    Copies an archive entry to ``fileobj`` in chunks and returns the number of
+    bytes copied. Raises ``ArchiveTooLargeError`` as soon as more than
+    ``max_bytes`` have been read, regardless of the size declared in the
+    archive.
+    """
+    size = 0
+    while True:
+        data = entry.read(app_settings.MEDIA_TREE_ZIPFILES_CHUNK_SIZE)
+        if not data:
+            return size
+        size += len(data)
+        if max_bytes is not None and size > max_bytes:
+            raise __get_too_large_error(node, app_settings.MEDIA_TREE_ZIPFILES_EXTRACT_MAX_BYTES)
+        fileobj.write(data)
+
+
+def extract_archive(node, target=None, user=None):
+    """
+    Extracts the ZIP archive of ``node`` into the folder ``target``, or the
+    top level if ``target`` is ``None``, creating a folder node for every
+    directory and a file node for every file in the archive. Entries are
+    streamed to storage one by one, their media types and dimensions are
+    determined concurrently, and all new nodes are inserted at once. Returns
+    a list of the new nodes.
+
+    Raises ``ArchiveTooLargeError`` if the archive exceeds
+    ``MEDIA_TREE_ZIPFILES_EXTRACT_MAX_ENTRIES`` or
+    ``MEDIA_TREE_ZIPFILES_EXTRACT_MAX_BYTES``, and ``zipfile.BadZipfile`` if
+    it is not a valid archive. Files that were already stored are deleted if
+    the archive cannot be extracted.
+    """
+    from media_tree.models import FileNode
+    max_bytes = app_settings.MEDIA_TREE_ZIPFILES_EXTRACT_MAX_BYTES
+    max_entries = app_settings.MEDIA_TREE_ZIPFILES_EXTRACT_MAX_ENTRIES
+    trees = []
+    folders = {}
+    files = []
+    stored_names = []
+
+    try:
+        archive_file = node.file.storage.open(node.file.name, 'rb')
+        try:
+            archive = zipfile.ZipFile(archive_file)
+            infolist = archive.infolist()
+            if max_entries is not None and len(infolist) > max_entries:
+                raise ArchiveTooLargeError(_('%(name)s contains more than %(count)i entries.') % {
+                    'name': node.name, 'count': max_entries})
+            # The declared sizes are checked up front, and the bytes that are
+            # actually read are checked while extracting
+            if max_bytes is not None and sum([info.file_size for info in infolist]) > max_bytes:
+                raise __get_too_large_error(node, max_bytes)
+            extracted_size = 0
+            for info in infolist:
+                parts = get_entry_path(info)
+                if parts is None:
+                    continue
+                is_dir = info.filename.endswith('/')
+                children = trees
+                for i in range(len(parts) if is_dir else len(parts) - 1):
+                    key = tuple(parts[:i + 1])
+                    if not key in folders:
+                        folders[key] = []
+                        children.append((FileNode(node_type=FileNode.FOLDER, name=parts[i]), folders[key]))
+                    children = folders[key]
+                if is_dir:
+                    continue
+
+                new_node = FileNode(node_type=FileNode.FILE, name=parts[-1])
+                temp_file = tempfile.TemporaryFile()
+                try:
+                    entry = archive.open(info)
+                    try:
+                        new_node.size = __copy_entry(node, entry, temp_file,
+                            max_bytes - extracted_size if max_bytes is not None else None)
+                    finally:
+                        entry.close()
+                    extracted_size += new_node.size
+                    stored_names.append(save_node_file(new_node, temp_file, parts[-1]))
+                finally:
+                    temp_file.close()
+                children.append((new_node, []))
+                files.append(new_node)
+        finally:
+            archive_file.close()
 
+        probe_files(files)
+        return insert_node_trees(target, trees, user)
+    except:
+        delete_stored_files(FileNode._meta.get_field('file').storage, stored_names)
+        raise
@@ -1,5 +1,6 @@
 from media_tree.models import FileNode
 from media_tree import settings as app_settings
+from media_tree.utils.probe import probe_image, DecompressionBombError
 from django import forms
 from django.utils.translation import ugettext_lazy as _
 from django.template.defaultfilters import filesizeformat
@@ -52,7 +53,7 @@ class FolderForm(FileNodeForm):
         qs = FileNode.objects.filter(parent=self.cleaned_data['parent'])
         if self.instance:
             qs = qs.exclude(pk=self.instance.pk)
-        if qs.filter(name__exact=self.cleaned_data['name']).count() > 0:
+        if qs.filter(name__exact=self.cleaned_data['name']).exists():
             raise forms.ValidationError(_('A %s with this name already exists.') % FileNode._meta.verbose_name)
         return self.cleaned_data['name']
 
@@ -92,11 +93,19 @@ class FileForm(FileNodeForm):
 
     @staticmethod
     def upload_clean(uploaded_file):
-        if not os.path.splitext(uploaded_file.name)[1].lstrip('.').lower() in app_settings.MEDIA_TREE_ALLOWED_FILE_TYPES:
+        extension = os.path.splitext(uploaded_file.name)[1].lstrip('.').lower()
+        if not extension in app_settings.MEDIA_TREE_ALLOWED_FILE_TYPES:
             raise forms.ValidationError(_('This file type is not allowed.'))
         max_size = app_settings.MEDIA_TREE_FILE_SIZE_LIMIT;
         if max_size and uploaded_file.size > max_size:
             raise forms.ValidationError(_('Maximum file size is %s.') % filesizeformat(max_size))
+        try:
+            probe_image(uploaded_file, extension)
+        except DecompressionBombError:
+            raise forms.ValidationError(_('Maximum image size is %i pixels.') % app_settings.MEDIA_TREE_MAX_IMAGE_PIXELS)
+        except IOError:
+            # Not an image
+            pass
         return uploaded_file
 
     def clean_file(self):
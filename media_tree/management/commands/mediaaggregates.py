@@ -0,0 +1,10 @@
+from media_tree.utils.maintenance import update_aggregates
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+
+    help = 'Recomputes the stored folder aggregates (total size, file count, files without metadata) of all media_tree nodes.'
+
+    def handle(self, *args, **options):
+        updated_count = update_aggregates()
+        self.stdout.write("Updated %i folders\n" % updated_count)
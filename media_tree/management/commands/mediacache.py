@@ -1,26 +1,75 @@
-from media_tree.utils.maintenance import get_cache_files
+from media_tree.utils.maintenance import iter_cache_files, iter_evicted_cache_files
 from media_tree.utils import get_media_storage
+from media_tree.utils.storage import get_storage_path
+from media_tree.utils.thumbnails import clear_manifest, MANIFEST_CHUNK_SIZE
 from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
 from optparse import make_option
+import re
+
+RE_BYTES = re.compile(r'^(\d+)([kmgt]?)b?$', re.IGNORECASE)
+BYTE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+def parse_bytes(value):
+    match = RE_BYTES.match(value.strip())
+    if not match:
+        raise CommandError('Invalid number of bytes: %s' % value)
+    return int(match.group(1)) * BYTE_UNITS[match.group(2).lower()]
 
 class Command(BaseCommand):
 
-    help = 'Lists (and optionally deletes) all media_tree cache files.'
+    help = 'Lists (and optionally deletes) all media_tree cache files, '  \
+        + 'or only the files that need to be evicted to keep the cache within the given bounds.'
 
     option_list = BaseCommand.option_list + (
         make_option('--delete',
             action='store_true',
             dest='delete',
             default=False,
-            help='Delete all cache files'),
+            help='Delete all cache files, or the files that need to be evicted'),
+        make_option('--max-bytes',
+            dest='max_bytes',
+            default=None,
+            help='Evict the least recently used files exceeding this total size (e.g. 500M, 2G)'),
+        make_option('--older-than',
+            type='float',
+            dest='older_than',
+            default=None,
+            help='Evict files that were not accessed for this number of days'),
         )
 
     def handle(self, *args, **options):
-        cache_files = get_cache_files()
         storage = get_media_storage()
-        for path in cache_files:
+        evict = options['max_bytes'] is not None or options['older_than'] is not None
+        if evict:
+            max_bytes = parse_bytes(options['max_bytes']) if options['max_bytes'] is not None else None
+            older_than = options['older_than'] * 86400 if options['older_than'] is not None else None
+            cache_files = iter_evicted_cache_files(max_bytes=max_bytes, older_than=older_than)
+        else:
+            cache_files = ((path, None) for path in iter_cache_files())
+
+        file_count = total_size = 0
+        deleted_urls = []
+        for path, size in cache_files:
+            file_count += 1
+            total_size += size or 0
             if options['delete']:
+                if evict:
+                    deleted_urls.append(storage.url(path))
                 storage.delete(path)
-                self.stdout.write("Deleted %s\n" % storage.path(path))
+                self.stdout.write("Deleted %s\n" % get_storage_path(storage, path))
+                if len(deleted_urls) >= MANIFEST_CHUNK_SIZE:
+                    clear_manifest(urls=deleted_urls)
+                    deleted_urls = []
+            else:
+                self.stdout.write("%s\n" % get_storage_path(storage, path))
+        if options['delete'] and file_count:
+            # Only the manifest entries of evicted thumbnails are deleted, or
+            # the whole manifest if all cache files were deleted
+            if evict:
+                clear_manifest(urls=deleted_urls)
             else:
-                self.stdout.write("%s\n" % storage.path(path))
+                clear_manifest()
+        if total_size and int(options.get('verbosity', 1)) >= 1:
+            self.stderr.write("%s %i files, %s\n" % ('Evicted' if options['delete'] else 'Would evict',
+                file_count, filesizeformat(total_size)))
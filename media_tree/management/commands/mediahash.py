@@ -0,0 +1,77 @@
+from media_tree.models import FileNode
+from media_tree.utils.storage import get_sha256
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+class Command(BaseCommand):
+
+    help = 'Computes the SHA-256 digests of all media_tree files that do not have one yet, '  \
+        + 'and reports files with identical contents.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--jobs',
+            type='int',
+            dest='jobs',
+            default=1,
+            help='Number of threads for reading files'),
+        make_option('--batch-size',
+            type='int',
+            dest='batch_size',
+            default=100,
+            help='Number of nodes that are fetched and processed at a time'),
+        )
+
+    def handle(self, *args, **options):
+        if options['jobs'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--jobs and --batch-size must be positive numbers.')
+        verbosity = int(options.get('verbosity', 1))
+        nodes = FileNode.objects.filter(node_type=FileNode.FILE, sha256__isnull=True)  \
+            .exclude(file='').order_by('pk')
+        pool = ThreadPool(options['jobs']) if options['jobs'] > 1 else None
+        last_pk = None
+        hashed_count = error_count = 0
+        try:
+            while True:
+                batch = nodes
+                if last_pk is not None:
+                    batch = batch.filter(pk__gt=last_pk)
+                batch = list(batch[:options['batch_size']])
+                if not batch:
+                    break
+                if pool:
+                    results = pool.map(self.hash_node, batch)
+                else:
+                    results = [self.hash_node(node) for node in batch]
+                for node, sha256 in zip(batch, results):
+                    if sha256:
+                        FileNode.objects.filter(pk=node.pk).update(sha256=sha256)
+                        hashed_count += 1
+                    else:
+                        error_count += 1
+                        self.stderr.write("Could not read %s\n" % node.file.name)
+                last_pk = batch[-1].pk
+                if verbosity >= 1:
+                    self.stderr.write("Hashed %i files\n" % hashed_count)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        duplicates = FileNode.objects.filter(sha256__isnull=False).values('sha256')  \
+            .annotate(count=Count('pk')).filter(count__gt=1)
+        duplicate_count = sum([row['count'] - 1 for row in duplicates])
+        self.stdout.write("Hashed %i files, %i duplicate files found\n" % (hashed_count, duplicate_count))
+        if error_count:
+            self.stdout.write("%i files could not be read\n" % error_count)
+
+    def hash_node(self, node):
+        try:
+            node.file.open('rb')
+            try:
+                return get_sha256(node.file)
+            finally:
+                node.file.close()
+        except (IOError, OSError):
+            return None
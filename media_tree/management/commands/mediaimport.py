@@ -0,0 +1,126 @@
+from media_tree.models import FileNode
+from media_tree.utils.bulk import probe_path, insert_node_trees
+from media_tree.utils.db import discard_connections
+from media_tree.utils.storage import save_node_file
+from django.core.management.base import BaseCommand, CommandError
+try:
+    from django.utils.encoding import force_unicode
+except ImportError:
+    from django.utils.encoding import force_text as force_unicode
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+import multiprocessing
+import os
+
+class Command(BaseCommand):
+
+    args = '<directory>'
+
+    help = 'Imports all files and subdirectories of a directory into the media tree. '  \
+        + 'Files that already exist in the target folder are skipped, so an interrupted import can be resumed.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--parent',
+            dest='parent',
+            default=None,
+            help='Path of the existing folder to import into (default: top level)'),
+        make_option('--jobs',
+            type='int',
+            dest='jobs',
+            default=None,
+            help='Number of worker processes for probing and threads for copying files (default: number of CPUs)'),
+        make_option('--batch-size',
+            type='int',
+            dest='batch_size',
+            default=500,
+            help='Number of files that are probed, copied and inserted at a time'),
+        )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Please specify the directory to import.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive number.')
+        root = os.path.abspath(force_unicode(args[0]))
+        if not os.path.isdir(root):
+            raise CommandError('%s is not a directory.' % root)
+        parent = None
+        if options['parent']:
+            try:
+                parent = FileNode.folders.get(path=options['parent'])
+            except FileNode.DoesNotExist:
+                raise CommandError('Folder %s does not exist.' % options['parent'])
+
+        self.batch_size = options['batch_size']
+        self.verbosity = int(options.get('verbosity', 1))
+        jobs = options['jobs'] or multiprocessing.cpu_count()
+        self.probe_pool = multiprocessing.Pool(jobs, initializer=discard_connections)
+        self.copy_pool = ThreadPool(jobs)
+        self.file_count = self.folder_count = 0
+        try:
+            stack = [(root, parent.pk if parent else None)]
+            while stack:
+                path, folder_pk = stack.pop()
+                folder = FileNode.objects.get(pk=folder_pk) if folder_pk else None
+                subdirs = self.import_dir(path, folder)
+                stack.extend(reversed(subdirs))
+        finally:
+            for pool in (self.probe_pool, self.copy_pool):
+                pool.close()
+                pool.join()
+        self.stdout.write("Imported %i files and %i folders\n" % (self.file_count, self.folder_count))
+
+    def import_dir(self, path, folder):
+        """
+        Imports the files of a directory into ``folder``, and creates folders
+        for its subdirectories. Returns a list of ``(path, folder_pk)`` tuples
+        for the subdirectories.
+        """
+        existing = {}
+        for name, pk, node_type in FileNode.objects.filter(parent=folder).values_list('name', 'pk', 'node_type'):
+            existing[name] = (pk, node_type)
+
+        new_folders = []
+        subdirs = []
+        file_names = []
+        for name in sorted(os.listdir(path)):
+            entry_path = os.path.join(path, name)
+            if os.path.islink(entry_path):
+                continue
+            if os.path.isdir(entry_path):
+                if existing.get(name, (None, None))[1] == FileNode.FOLDER:
+                    subdirs.append((entry_path, existing[name][0]))
+                else:
+                    node = FileNode(node_type=FileNode.FOLDER, name=name)
+                    new_folders.append(node)
+                    subdirs.append((entry_path, node))
+            elif os.path.isfile(entry_path) and not name in existing:
+                file_names.append(name)
+
+        for i in range(0, max(len(file_names), 1), self.batch_size):
+            batch = [os.path.join(path, name) for name in file_names[i:i + self.batch_size]]
+            nodes = self.copy_pool.map(self.store_file, zip(batch, self.probe_pool.map(probe_path, batch)))
+            if i == 0:
+                nodes = new_folders + nodes
+            if nodes:
+                insert_node_trees(folder, [(node, []) for node in nodes])
+                self.file_count += len(batch)
+                if self.verbosity >= 1 and batch:
+                    self.stderr.write("Imported %i files up to %s\n" % (self.file_count, batch[-1]))
+        self.folder_count += len(new_folders)
+
+        # New folders were assigned primary keys when they were inserted
+        return [(subdir_path, node if not isinstance(node, FileNode) else node.pk)
+            for subdir_path, node in subdirs]
+
+    def store_file(self, args):
+        path, (size, extension, media_type, width, height) = args
+        name = os.path.basename(path)
+        node = FileNode(node_type=FileNode.FILE, name=name, size=size, extension=extension,
+            media_type=media_type, width=width, height=height)
+        source = open(path, 'rb')
+        try:
+            save_node_file(node, source, name)
+        finally:
+            source.close()
+        return node
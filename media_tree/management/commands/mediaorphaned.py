@@ -1,7 +1,14 @@
-from media_tree.utils.maintenance import get_orphaned_files
+from media_tree.utils.maintenance import iter_orphaned_files
 from media_tree.utils import get_media_storage
+from media_tree.utils.storage import get_storage_path
 from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+from django.utils.encoding import smart_str
+from multiprocessing.pool import ThreadPool
 from optparse import make_option
+import csv
+import itertools
+import json
 
 class Command(BaseCommand):
 
@@ -14,14 +21,108 @@ class Command(BaseCommand):
             dest='delete',
             default=False,
             help='Delete all orphaned files from storage'),
+        make_option('--jobs',
+            type='int',
+            dest='jobs',
+            default=1,
+            help='Number of threads for retrieving file sizes and deleting files'),
+        make_option('--batch-size',
+            type='int',
+            dest='batch_size',
+            default=100,
+            help='Number of files that are processed at a time'),
+        make_option('--resume-from',
+            dest='resume_from',
+            default=None,
+            help='Skip all files up to and including this storage name'),
+        make_option('--format',
+            dest='format',
+            type='choice',
+            choices=('text', 'json', 'csv'),
+            default='text',
+            help='Output format: text, json or csv'),
         )
 
     def handle(self, *args, **options):
-        orphaned_files = get_orphaned_files()
-        storage = get_media_storage()
-        for path in orphaned_files:
-            if options['delete']:
-                storage.delete(path)
-                self.stdout.write("Deleted %s\n" % storage.path(path))
+        if options['jobs'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--jobs and --batch-size must be positive numbers.')
+        self.storage = get_media_storage()
+        self.delete = options['delete']
+        self.format = options['format']
+        verbosity = int(options.get('verbosity', 1))
+
+        pool = ThreadPool(options['jobs']) if options['jobs'] > 1 else None
+        orphaned_files = iter_orphaned_files(start_after=options['resume_from'])
+        file_count = total_size = error_count = 0
+        self.write_header()
+        try:
+            while True:
+                batch = list(itertools.islice(orphaned_files, options['batch_size']))
+                if not batch:
+                    break
+                if pool:
+                    results = pool.map(self.process_file, batch)
+                else:
+                    results = [self.process_file(storage_name) for storage_name in batch]
+                for storage_name, size, status in results:
+                    self.write_result(storage_name, size, status, first=not file_count)
+                    file_count += 1
+                    total_size += size or 0
+                    if status == 'error':
+                        error_count += 1
+                if verbosity >= 1:
+                    self.stderr.write("Processed %i files (continue with --resume-from=%s)\n" % (
+                        file_count, batch[-1]))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        self.write_footer()
+
+        if verbosity >= 1:
+            if self.delete:
+                self.stderr.write("Deleted %i orphaned files, %s freed\n" % (
+                    file_count - error_count, filesizeformat(total_size)))
+                if error_count:
+                    self.stderr.write("%i files could not be deleted\n" % error_count)
             else:
-                self.stdout.write("%s\n" % storage.path(path))
+                self.stderr.write("Found %i orphaned files, %s reclaimable\n" % (
+                    file_count, filesizeformat(total_size)))
+
+    def process_file(self, storage_name):
+        try:
+            size = self.storage.size(storage_name)
+        except (OSError, NotImplementedError):
+            size = None
+        status = 'orphaned'
+        if self.delete:
+            try:
+                self.storage.delete(storage_name)
+                status = 'deleted'
+            except OSError:
+                status = 'error'
+        return (storage_name, size, status)
+
+    def write_header(self):
+        if self.format == 'json':
+            self.stdout.write("[\n")
+        elif self.format == 'csv':
+            self.csv_writer = csv.writer(self.stdout, lineterminator='\n')
+            self.csv_writer.writerow(['name', 'size', 'status'])
+
+    def write_result(self, storage_name, size, status, first):
+        if self.format == 'json':
+            self.stdout.write("%s%s\n" % ('' if first else ',', json.dumps({
+                'name': storage_name, 'size': size, 'status': status})))
+        elif self.format == 'csv':
+            self.csv_writer.writerow([smart_str(storage_name), '' if size is None else size, status])
+        elif status == 'deleted':
+            self.stdout.write("Deleted %s\n" % get_storage_path(self.storage, storage_name))
+        elif status == 'error':
+            self.stdout.write("Could not delete %s\n" % get_storage_path(self.storage, storage_name))
+        else:
+            self.stdout.write("%s\n" % get_storage_path(self.storage, storage_name))
+
+    def write_footer(self):
+        if self.format == 'json':
+            self.stdout.write("]\n")
@@ -0,0 +1,71 @@
+from media_tree.models import FileNode
+from media_tree.utils.thumbnails import get_thumbnail_source, generate_thumbnails
+from media_tree.utils.db import discard_connections
+from media_tree import media_types, settings as app_settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from optparse import make_option
+import multiprocessing
+
+class Command(BaseCommand):
+
+    help = 'Lists (and optionally generates) thumbnails in all configured sizes for all media_tree images.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--warm',
+            action='store_true',
+            dest='warm',
+            default=False,
+            help='Generate all thumbnails that do not exist yet'),
+        make_option('--jobs',
+            type='int',
+            dest='jobs',
+            default=None,
+            help='Number of worker processes (default: MEDIA_TREE_THUMBNAIL_PROCESSES)'),
+        make_option('--batch-size',
+            type='int',
+            dest='batch_size',
+            default=100,
+            help='Number of nodes that are fetched and processed at a time'),
+        make_option('--resume-from',
+            type='int',
+            dest='resume_from',
+            default=None,
+            help='Skip all nodes with a primary key lower than this value'),
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive number.')
+        nodes = FileNode.objects.filter(Q(media_type=media_types.SUPPORTED_IMAGE)
+            | Q(preview_file__gt='')).order_by('pk')
+        last_pk = None
+        if options['resume_from'] is not None:
+            last_pk = options['resume_from'] - 1
+        pool = None
+        if options['warm']:
+            pool = multiprocessing.Pool(options['jobs'] or app_settings.MEDIA_TREE_THUMBNAIL_PROCESSES,
+                initializer=discard_connections)
+        try:
+            while True:
+                batch = nodes
+                if last_pk is not None:
+                    batch = batch.filter(pk__gt=last_pk)
+                batch = list(batch[:options['batch_size']])
+                if not batch:
+                    break
+                sources = [get_thumbnail_source(node) for node in batch]
+                if pool:
+                    counts = pool.map(generate_thumbnails, [source for source in sources if source])
+                    last_pk = batch[-1].pk
+                    self.stdout.write("Generated %i thumbnails for nodes up to %i (continue with --resume-from=%i)\n" % (
+                        sum(counts), last_pk, last_pk + 1))
+                else:
+                    for source in sources:
+                        if source:
+                            self.stdout.write("%s\n" % source[1])
+                    last_pk = batch[-1].pk
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
@@ -2,38 +2,69 @@ from media_tree import settings as app_settings
 from media_tree.utils import get_module_attr
 from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
+from django.test.signals import setting_changed
 import os
 
 
 class ThumbnailError(Exception):
     pass
     
+__backends = {}
+
 def get_media_backend(fail_silently=True, handles_media_types=None, 
     handles_file_extensions=None, supports_thumbnails=None):
         """
         Returns the MediaBackend subclass that is configured for use with 
         media_tree.
+
+        The result is memoized for each combination of arguments and the 
+        current value of ``MEDIA_TREE_MEDIA_BACKENDS``. Call 
+        :func:`reset_media_backends` to clear the memoized results.
         """
-        backends = app_settings.MEDIA_TREE_MEDIA_BACKENDS
-        if not len(backends):
-            if not fail_silently:
+        backends = tuple(app_settings.MEDIA_TREE_MEDIA_BACKENDS)
+        key = (backends,
+            frozenset(handles_media_types) if handles_media_types else None,
+            frozenset(handles_file_extensions) if handles_file_extensions else None,
+            bool(supports_thumbnails))
+        if not key in __backends:
+            __backends[key] = find_media_backend(backends, handles_media_types,
+                handles_file_extensions, supports_thumbnails)
+        backend = __backends[key]
+
+        if backend is False and not fail_silently:
+            if not len(backends):
                 raise ImproperlyConfigured('There is no media backend configured.'  \
                     + ' Please define `MEDIA_TREE_MEDIA_BACKENDS` in your settings.')
-            else:
-                return False
-        
+            raise ImproperlyConfigured('There is no media backend configured to handle'  \
+                ' the specified file types.')
+        return backend
+
+
+def find_media_backend(backends, handles_media_types=None, 
+    handles_file_extensions=None, supports_thumbnails=None):
+        """
+        Traverses ``backends`` and returns the first one supporting what's 
+        requested, or ``False`` if there is none.
+        """
         for path in backends:
-            # Traverse backends until there is one supporting what's requested:
             backend = get_module_attr(path)
             if (not handles_media_types or backend.handles_media_types(handles_media_types))  \
                 and (not handles_file_extensions or backend.handles_file_extensions(handles_file_extensions))  \
                 and (not supports_thumbnails or backend.supports_thumbnails()):
                     return backend
-    
-        if not fail_silently:
-            raise ImproperlyConfigured('There is no media backend configured to handle'  \
-                ' the specified file types.')
         return False
+
+
+def reset_media_backends(**kwargs):
+    """
+    Clears the memoized results of :func:`get_media_backend`, for instance
+    after changing ``media_tree.settings.MEDIA_TREE_MEDIA_BACKENDS`` in tests. 
+    This is also called whenever a setting is changed using 
+    ``override_settings``.
+    """
+    __backends.clear()
+
+setting_changed.connect(reset_media_backends)
     
     
 class MediaBackend:
@@ -59,6 +90,16 @@ class MediaBackend:
     def get_thumbnail(source, options):
         raise NotImplementedError('Media backends need to implement the `get_thumbnail()` method.')
 
+    @classmethod
+    def get_thumbnails(cls, sources, options):
+        """
+        Returns a list of thumbnails of all ``sources`` in the same order. 
+        Existing thumbnails are looked up in the thumbnail manifest in bulk, and 
+        missing thumbnails are generated concurrently using ``get_thumbnail()``.
+        """
+        from media_tree.utils.thumbnails import get_thumbnails
+        return get_thumbnails(sources, options, cls)
+
     @staticmethod
     def get_valid_thumbnail_options():
         raise NotImplementedError('Media backends need to implement the `get_valid_thumbnail_options()` method.')
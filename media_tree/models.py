@@ -1,10 +1,14 @@
 #encoding=utf-8
 
 from media_tree import settings as app_settings, media_types
-from media_tree.utils import multi_splitext, join_formatted
+from media_tree.utils import multi_splitext, join_formatted, get_unique_numbered_name, get_numbered_name_prefix
 from media_tree.utils.staticfiles import get_icon_finders
 from media_tree.utils import get_media_storage
 from media_tree.utils.filenode import get_file_link
+from media_tree.utils.db import atomic, quote_name, get_concat_sql, get_char_length_sql, execute_sql
+from media_tree.utils.thumbnails import pregenerate_thumbnails, clear_manifest
+from media_tree.utils.probe import probe_image
+from media_tree.utils.storage import get_sha256, store_content, release_content
 
 try:
     from mptt.models import MPTTModel as ModelBase
@@ -30,14 +34,12 @@ except ImportError:
     from django.utils.encoding import force_text as force_unicode
 from django.conf import settings
 from django.utils.formats import get_format
-from django.db import models
+from django.db import models, IntegrityError
 from django.core.exceptions import ValidationError
 from django import forms
 
-from PIL import Image
 import os
 import mimetypes
-import uuid
 
 try:
     from south.modelsinspector import add_introspection_rules
@@ -51,6 +53,27 @@ STATIC_SUBDIR = app_settings.MEDIA_TREE_STATIC_SUBDIR
 MEDIA_TYPE_NAMES = app_settings.MEDIA_TREE_CONTENT_TYPES
 ICON_FINDERS = get_icon_finders(app_settings.MEDIA_TREE_ICON_FINDERS)
 
+UNIQUE_NAME_ATTEMPTS = 3
+
+AGGREGATE_FIELDS = ('total_size', 'file_count', 'missing_metadata_count')
+
+# Longer paths would exceed the maximum key length of indexes on MySQL
+PATH_MAX_LENGTH = 255
+
+
+def get_child_path(parent_path, name):
+    """
+    Returns the path of a node named ``name`` whose parent has the path
+    ``parent_path``, or ``None`` if the path is too long to be stored, or if
+    the path of the parent is ``None`` for that reason.
+    """
+    if parent_path is None:
+        return None
+    path = '%s/%s' % (parent_path, name)
+    if len(path) > PATH_MAX_LENGTH:
+        return None
+    return path
+
 
 # http://adam.gomaa.us/blog/2008/aug/11/the-python-property-builtin/
 def Property(func):
@@ -64,6 +87,11 @@ class FileNodeManager(models.Manager):
     retrieve ``FileNode`` objects by their full node path,
     which consists of the names of its parents and itself,
     e.g. ``"path/to/folder/readme.txt"``.
+
+    Since the full path of each node is stored in the indexed ``path`` field,
+    these lookups do not require joining the table for every path segment.
+    Only paths exceeding ``PATH_MAX_LENGTH`` characters are not stored, and
+    are looked up by joining the table instead.
     """
 
     def __init__(self, filter_args={}):
@@ -74,7 +102,14 @@ class FileNodeManager(models.Manager):
         return super(FileNodeManager, self).get_query_set().filter(**self.filter_args)
 
     def get_filter_args_with_path(self, for_self, **kwargs):
-        names = kwargs['path'].strip('/').split('/')
+        path = kwargs.pop('path').strip('/')
+        if len(path) <= PATH_MAX_LENGTH:
+            if for_self:
+                kwargs['path'] = path
+            else:
+                kwargs['parent__path'] = path
+            return kwargs
+        names = path.split('/')
         names.reverse()
         parent_arg = '%s'
         new_kwargs = {}
@@ -84,7 +119,6 @@ class FileNodeManager(models.Manager):
             new_kwargs[parent_arg % 'name'] = name
         new_kwargs[parent_arg % 'level'] = 0
         new_kwargs.update(kwargs)
-        new_kwargs.pop('path')
         return new_kwargs
 
     def filter(self, *args, **kwargs):
@@ -279,6 +313,8 @@ class FileNode(ModelBase):
     """ The mime type of the media file """
     name = models.CharField(_('name'), max_length=255, null=True)
     """ Name of the file or folder """
+    path = models.CharField(_('path'), max_length=PATH_MAX_LENGTH, null=True, editable=False, db_index=True)
+    """ Full path of the node, i.e. the names of its ancestors and itself, separated by slashes, or ``None`` if it is too long to be stored """
     title = models.CharField(_('title'), max_length=255, default='', null=True, blank=True)
     """ Title for the file """
     description = models.TextField(_('description'), default='', null=True, blank=True)
@@ -309,6 +345,14 @@ class FileNode(ModelBase):
     """ File extension, lowercase """
     size = models.IntegerField(_('size'), null=True, editable=False)
     """ File size in bytes """
+    sha256 = models.CharField(_('SHA-256'), max_length=64, null=True, editable=False, db_index=True)
+    """ SHA-256 digest of the file contents """
+    total_size = models.BigIntegerField(_('total size'), default=0, editable=False)
+    """ Total size in bytes of all files in the node's subtree, including the node itself """
+    file_count = models.IntegerField(_('file count'), default=0, editable=False)
+    """ Number of files in the node's subtree, including the node itself """
+    missing_metadata_count = models.IntegerField(_('files without metadata'), default=0, editable=False)
+    """ Number of files in the node's subtree, including the node itself, for which no minimal metadata was entered """
     # TODO: Refactor PIL stuff, width|height as extension?
     width = models.IntegerField(_('width'), null=True, blank=True, help_text=_('Detected automatically for supported images'))
     """ For images: width in pixels """
@@ -342,6 +386,7 @@ class FileNode(ModelBase):
 
     class Meta:
         ordering = ['tree_id', 'lft']
+        unique_together = (('parent', 'name'),)
         verbose_name = _('media object')
         verbose_name_plural = _('media objects')
         permissions = (
@@ -351,6 +396,44 @@ class FileNode(ModelBase):
     class MPTTMeta:
         order_insertion_by = ['name']
 
+    def __init__(self, *args, **kwargs):
+        super(FileNode, self).__init__(*args, **kwargs)
+        self.store_saved_values()
+
+    def get_field_values(self):
+        """Returns a dict of the current values of all loaded fields, keyed by
+        attribute name. Fields that were deferred and not loaded yet are
+        omitted, and files are represented by their names.
+        """
+        values = {}
+        for field in self._meta.fields:
+            if field.primary_key or not field.attname in self.__dict__:
+                continue
+            value = self.__dict__[field.attname]
+            if isinstance(field, models.FileField):
+                value = getattr(value, 'name', value)
+            elif isinstance(value, list):
+                value = list(value)
+            values[field.attname] = value
+        return values
+
+    def store_saved_values(self):
+        """Stores the current field values as the values of the saved
+        instance, which :func:`save` compares the current values to. This is
+        called when the node is loaded or saved.
+        """
+        self._saved_values = self.get_field_values() if self.pk else {}
+
+    def get_changed_fields(self):
+        """Returns the names of the fields whose values differ from the values
+        the node was loaded with, as well as of the fields that are updated on
+        every save, such as :attr:`modified`.
+        """
+        values = self.get_field_values()
+        return [field.name for field in self._meta.fields if not field.primary_key and (
+            getattr(field, 'auto_now', False) or (field.attname in values
+                and self._saved_values.get(field.attname) != values[field.attname]))]
+
     @staticmethod
     def get_top_node():
         """Returns a symbolic node representing the root of all nodes. This node
@@ -491,19 +574,105 @@ class FileNode(ModelBase):
 
     def has_metadata_including_descendants(self):
         if self.node_type == FileNode.FOLDER:
-            count = self.get_descendants().filter(has_metadata=False).count()
-            return count == 0
+            return not self.missing_metadata_count
         else:
             return self.has_metadata
     has_metadata_including_descendants.short_description = _('Metadata')
     has_metadata_including_descendants.boolean = True
 
     def get_path(self):
+        if self.path is not None:
+            return self.path
         path = ''
         for name in [node.name for node in self.get_ancestors()]:
             path = '%s%s/' % (path, name)
         return '%s%s' % (path, self.name)
 
+    def make_path(self):
+        """Returns the path of the node as determined by its current parent
+        and name, which is stored in the :attr:`path` field on save, or
+        ``None`` if it exceeds ``PATH_MAX_LENGTH`` characters.
+        """
+        if self.parent:
+            return get_child_path(self.parent.get_path(), self.name)
+        return self.name
+
+    def update_descendant_paths(self, old_path):
+        """Replaces ``old_path`` with the current path in the paths of all
+        descendants, using a single UPDATE statement. This is called when a
+        folder is renamed or moved. Paths that become too long are set to
+        ``None``. If the paths of descendants were too long to be stored
+        before, they are rebuilt using :func:`rebuild_descendant_paths`.
+        """
+        opts = self._mptt_meta
+        if old_path is not None:
+            path_column = quote_name(self._meta.get_field('path').column)
+            path_sql = get_concat_sql('%s', 'SUBSTR(%s, %%s)' % path_column)
+            sql = 'UPDATE %s SET %s = CASE WHEN %s <= %%s THEN %s END WHERE %s = %%s AND %s > %%s AND %s < %%s' % (
+                quote_name(self._meta.db_table),
+                path_column,
+                get_char_length_sql(path_sql),
+                path_sql,
+                quote_name(self._meta.get_field(opts.tree_id_attr).column),
+                quote_name(self._meta.get_field(opts.left_attr).column),
+                quote_name(self._meta.get_field(opts.right_attr).column))
+            execute_sql(sql, (self.path, len(old_path) + 1, PATH_MAX_LENGTH,
+                self.path, len(old_path) + 1,
+                getattr(self, opts.tree_id_attr), getattr(self, opts.left_attr),
+                getattr(self, opts.right_attr)))
+        if self.path is not None and self.get_descendants().filter(path__isnull=True).exists():
+            self.rebuild_descendant_paths()
+
+    def rebuild_descendant_paths(self):
+        """Computes the paths of all descendants from their names, and stores
+        the paths that changed. This is only needed if the paths of descendants
+        were too long to be stored, since they cannot be derived from the
+        stored paths then. Returns the number of updated nodes.
+        """
+        paths = {self.pk: self.path}
+        updated_count = 0
+        # Descendants are ordered by tree, so parents are visited before their children
+        for pk, parent_id, name, path in self.get_descendants().values_list('pk', 'parent', 'name', 'path'):
+            paths[pk] = get_child_path(paths[parent_id], name)
+            if paths[pk] != path:
+                FileNode.objects.filter(pk=pk).update(path=paths[pk])
+                updated_count += 1
+        return updated_count
+
+    def get_aggregates(self):
+        """Returns a tuple of the node's :attr:`total_size`, :attr:`file_count`
+        and :attr:`missing_metadata_count`, which is what the node contributes to
+        the aggregates of its ancestors.
+        """
+        return (self.total_size or 0, self.file_count or 0, self.missing_metadata_count or 0)
+
+    def update_ancestor_aggregates(self, total_size=0, file_count=0, missing_metadata_count=0):
+        """Adds the given (positive or negative) values to the aggregate fields
+        of all ancestors of the node, using a single UPDATE statement. The
+        :attr:`has_metadata` flag of the ancestors is updated accordingly.
+        """
+        if not self.parent_id or not (total_size or file_count or missing_metadata_count):
+            return 0
+        opts = self._mptt_meta
+        columns = dict([(name, quote_name(self._meta.get_field(name).column)) for name in (
+            'has_metadata', 'total_size', 'file_count', 'missing_metadata_count',
+            opts.tree_id_attr, opts.left_attr, opts.right_attr)])
+        # has_metadata is assigned first since MySQL evaluates assignments from
+        # left to right, using values that were already updated
+        sql = 'UPDATE %s SET %s = CASE WHEN %s + %%s = 0 THEN %%s ELSE %%s END, '  \
+            '%s = %s + %%s, %s = %s + %%s, %s = %s + %%s '  \
+            'WHERE %s = %%s AND %s < %%s AND %s > %%s' % (
+                quote_name(self._meta.db_table),
+                columns['has_metadata'], columns['missing_metadata_count'],
+                columns['total_size'], columns['total_size'],
+                columns['file_count'], columns['file_count'],
+                columns['missing_metadata_count'], columns['missing_metadata_count'],
+                columns[opts.tree_id_attr], columns[opts.left_attr], columns[opts.right_attr])
+        return execute_sql(sql, (missing_metadata_count, True, False,
+            total_size, file_count, missing_metadata_count,
+            getattr(self, opts.tree_id_attr), getattr(self, opts.left_attr),
+            getattr(self, opts.right_attr)))
+
     def get_admin_url(self, query_params=None, use_path=False):
         """Returns the URL for viewing a FileNode in the admin."""
 
@@ -575,15 +744,14 @@ class FileNode(ModelBase):
     resolution_formatted.admin_order_field = 'width'
 
     def make_name_unique_numbered(self, name, ext=''):
-        # If file with same name exists in folder:
-        qs = FileNode.objects.filter(parent=self.parent)
+        # If file with same name exists in folder, rename using a number. All
+        # sibling names that may conflict are fetched with a single query.
+        qs = FileNode.objects.filter(parent=self.parent_id)
         if self.pk:
             qs = qs.exclude(pk=self.pk)
-        number = 1
-        while qs.filter(name__exact=self.name).count() > 0:
-            number += 1
-            # rename using a number
-            self.name = app_settings.MEDIA_TREE_NAME_UNIQUE_NUMBERED_FORMAT % {'name': name, 'number': number, 'ext': ext}
+        names = set([sibling_name.lower() for sibling_name in qs.filter(models.Q(name__iexact=self.name)
+            | models.Q(name__istartswith=get_numbered_name_prefix(name, ext))).values_list('name', flat=True)])
+        self.name = get_unique_numbered_name(self.name, name, ext, names)
 
     def prevent_save(self):
         self.save_prevented = True
@@ -593,36 +761,49 @@ class FileNode(ModelBase):
         if getattr(self, 'save_prevented', False):
             raise ValidationError('Saving was presented for this FileNode object.')
 
+        # The values the node was loaded with are compared to its current
+        # values, so that the saved instance does not need to be fetched
+        saved_values = self._saved_values if self.pk else {}
+        saved_instance = None
+        file_changed = False
+        unique_name_args = None
+        moved = bool(saved_values) and saved_values.get('parent_id', self.parent_id) != self.parent_id
+        if moved:
+            # Reload object because tree attributes and aggregates may be out of date
+            saved_instance = FileNode.objects.get(pk=self.pk)
+
         if self.node_type == FileNode.FOLDER:
             self.media_type = FileNode.FOLDER
-            # Admin asserts that folder name is unique under parent. For other inserts:
-            self.make_name_unique_numbered(self.name)
+            if not saved_values or moved or saved_values.get('name', self.name) != self.name:
+                # Admin asserts that folder name is unique under parent. For other inserts:
+                unique_name_args = (self.name, '')
+                self.make_name_unique_numbered(*unique_name_args)
+                if saved_values:
+                    # Aggregates are maintained when descendants are saved, so the values
+                    # of this instance may be out of date. They are only written when
+                    # the folder is renamed or moved.
+                    if saved_instance:
+                        aggregates = saved_instance.get_aggregates()
+                    else:
+                        aggregates = FileNode.objects.filter(pk=self.pk).values_list(*AGGREGATE_FIELDS)[0]
+                    self.total_size, self.file_count, self.missing_metadata_count = aggregates
         else:
-            # TODO: If file was not changed, this field will nevertheless be changed to
-            # the name of the renamed file on disk. Do not do this unless a new file is being saved.
-            file_changed = True
-            if self.pk:
-                try:
-                    saved_instance = FileNode.objects.get(pk=self.pk)
-                    if saved_instance.file == self.file:
-                        file_changed = False
-                except FileNode.DoesNotExist:
-                    pass
+            file_changed = not saved_values or not self.file._committed  \
+                or saved_values.get('file', self.file.name) != self.file.name
             if file_changed:
                 self.name = os.path.basename(self.file.name)
                 # using os.path.splitext(), foo.tar.gz would become foo.tar_2.gz instead of foo_2.tar.gz
                 split = multi_splitext(self.name)
-                self.make_name_unique_numbered(split[0], split[1])
+                unique_name_args = (split[0], split[1])
+                self.make_name_unique_numbered(*unique_name_args)
 
                 # Determine various file parameters
                 self.size = self.file.size
+                self.sha256 = get_sha256(self.file)
                 self.extension = split[2].lstrip('.').lower()
                 self.width, self.height = (None, None)
 
                 self.file.name = self.name
-                # TODO: A hash (created by storage class!) would be great because it would obscure file
-                # names, but it would be inconvenient for downloadable files
-                # self.file.name = str(uuid.uuid4()) + '.' + self.extension
 
                 # Determine whether file is a supported image:
                 try:
@@ -633,19 +814,115 @@ class FileNode(ModelBase):
                 if not self.media_type:
                     self.media_type = FileNode.mimetype_to_media_type(self.name)
 
+                if app_settings.MEDIA_TREE_CONTENT_ADDRESSED_STORAGE and not self.file._committed:
+                    # Identical uploads reference the same file in storage, which
+                    # is only stored if it does not exist yet
+                    self.file.name = store_content(self.file.storage, self.file.file,
+                        self.sha256, self.extension)
+                    self.file._committed = True
+            elif moved or saved_values.get('name', self.name) != self.name:
+                # Files that are moved or renamed need a unique name among their
+                # new siblings as well
+                split = multi_splitext(self.name)
+                unique_name_args = (split[0], split[1])
+                self.make_name_unique_numbered(*unique_name_args)
+
         self.slug = slugify(self.name)
         self.has_metadata = self.check_minimal_metadata()
-
-        super(FileNode, self).save(*args, **kwargs)
+        if self.node_type == FileNode.FILE:
+            self.total_size, self.file_count, self.missing_metadata_count = (
+                self.size or 0, 1, 0 if self.has_metadata else 1)
+
+        renamed = bool(saved_values) and saved_values.get('name', self.name) != self.name
+        old_path = saved_values.get('path')
+        if not saved_values or moved or renamed or self.path is None:
+            self.path = self.make_path()
+
+        if saved_values and not moved and not renamed and not args and not 'update_fields' in kwargs  \
+                and not kwargs.get('force_insert'):
+            # Only changed columns are written. Since nodes are ordered by name,
+            # the tree is only updated when nodes are renamed or moved.
+            kwargs['update_fields'] = self.get_changed_fields()
+
+        opts = self._mptt_meta
+        tree_attrs = (opts.tree_id_attr, opts.left_attr, opts.right_attr, opts.level_attr)
+        if moved or renamed:
+            # mptt moves the node among its siblings using the tree attributes
+            # in memory, and the descendants are found by them as well
+            if not saved_instance:
+                saved_instance = FileNode.objects.get(pk=self.pk)
+            for attr in tree_attrs:
+                setattr(self, attr, getattr(saved_instance, attr))
+        tree_values = [(attr, getattr(self, attr)) for attr in tree_attrs]
+        # The aggregates of the former and new ancestors and the paths of the
+        # descendants are updated in the same transaction as the node
+        with atomic():
+            for attempt in range(UNIQUE_NAME_ATTEMPTS):
+                try:
+                    with atomic():
+                        if moved:
+                            saved_instance.update_ancestor_aggregates(
+                                *[-value for value in saved_instance.get_aggregates()])
+                            # mptt writes the new parent before the name, so the
+                            # old name may conflict with a sibling in the new parent
+                            FileNode.objects.filter(pk=self.pk).update(parent=self.parent, name=self.name)
+                        super(FileNode, self).save(*args, **kwargs)
+                    break
+                except IntegrityError:
+                    if not unique_name_args or attempt == UNIQUE_NAME_ATTEMPTS - 1:
+                        raise
+                    # A sibling with the same name was saved concurrently. The
+                    # attempt was rolled back, but the tree attributes may have
+                    # been changed in memory already.
+                    for attr, value in tree_values:
+                        setattr(self, attr, value)
+                    self.make_name_unique_numbered(*unique_name_args)
+                    self.slug = slugify(self.name)
+                    self.path = self.make_path()
+
+            if not saved_values or moved:
+                self.update_ancestor_aggregates(*self.get_aggregates())
+            elif self.node_type == FileNode.FILE:
+                # What a folder contributes to its ancestors does not change when it is saved
+                self.update_ancestor_aggregates(*[new - (saved_values.get(name, new) or 0) for name, new in
+                    zip(AGGREGATE_FIELDS, self.get_aggregates())])
+
+            if saved_values and self.node_type == FileNode.FOLDER and old_path != self.path:
+                self.update_descendant_paths(old_path)
+
+        saved_file_name = saved_values.get('file')
+        if file_changed and saved_file_name and saved_file_name != self.file.name:
+            release_content(self.file.storage, saved_file_name)
+
+        self.store_saved_values()
+
+        if file_changed and app_settings.MEDIA_TREE_PREGENERATE_THUMBNAILS:
+            pregenerate_thumbnails(self)
+
+    def delete(self, *args, **kwargs):
+        # Descendants are deleted along with the node, so the files of the
+        # whole subtree are collected first
+        file_names = set([name for name in (self.file.name, self.preview_file.name) if name])
+        with atomic():
+            try:
+                # Reload object because tree attributes and aggregates may be out of date
+                saved_instance = FileNode.objects.get(pk=self.pk)
+                saved_instance.update_ancestor_aggregates(*[-value for value in saved_instance.get_aggregates()])
+                for names in saved_instance.get_descendants(include_self=True).values_list('file', 'preview_file'):
+                    file_names.update([name for name in names if name])
+            except FileNode.DoesNotExist:
+                pass
+            super(FileNode, self).delete(*args, **kwargs)
+        file_names = list(file_names)
+        clear_manifest(file_names)
+        for name in file_names:
+            # Content-addressed files are deleted with the last node referencing them
+            release_content(self.file.storage, name)
 
     # TODO: Move to extension
     def pre_save_image(self):
-        if self.extension in app_settings.MEDIA_TREE_VECTOR_EXTENSIONS:
-            self.media_type = media_types.VECTOR_IMAGE
-        else:
-            self.saved_image = Image.open(self.file)
-            self.media_type = media_types.SUPPORTED_IMAGE
-            self.width, self.height = self.saved_image.size
+        # Only the header of the file is read
+        self.media_type, self.width, self.height = probe_image(self.file, self.extension)
 
     def file_path(self):
         return self.file.path if self.file else ''
@@ -741,6 +1018,37 @@ class FileNode(ModelBase):
         else:
             return self.get_metadata_display()
 
+
+class CachedThumbnail(models.Model):
+    """
+    An entry of the thumbnail manifest, which stores the URL and dimensions of
+    thumbnails that were generated by the media backend, so that thumbnails can
+    be displayed without accessing the storage. Entries are looked up by the
+    name of the source file, a version identifying the state of the source file
+    and a hash of the thumbnail options. See :mod:`media_tree.utils.thumbnails`.
+    """
+
+    source_name = models.CharField(_('source name'), max_length=255)
+    """ Storage name of the source file """
+    source_version = models.CharField(_('source version'), max_length=64, blank=True, default='')
+    """ Identifies the state of the source file when the thumbnail was generated """
+    options_hash = models.CharField(_('options hash'), max_length=40)
+    """ SHA-1 hash of the normalized thumbnail options """
+    url = models.CharField(_('URL'), max_length=1000)
+    """ URL of the thumbnail """
+    width = models.IntegerField(_('width'), null=True, blank=True)
+    """ Width of the thumbnail in pixels """
+    height = models.IntegerField(_('height'), null=True, blank=True)
+    """ Height of the thumbnail in pixels """
+
+    class Meta:
+        unique_together = (('source_name', 'options_hash'),)
+        verbose_name = _('cached thumbnail')
+        verbose_name_plural = _('cached thumbnails')
+
+    def __unicode__(self):
+        return self.url
+
 # Legacy mptt support
 if ModelBase == models.Model:
     FileNode._mptt_meta = FileNode._meta
@@ -74,6 +74,18 @@ MEDIA_TREE_UPLOAD_SUBDIR = getattr(settings, 'MEDIA_TREE_UPLOAD_SUBDIR',
 The name of the folder under your ``MEDIA_ROOT`` where media files are stored.
 """
 
+MEDIA_TREE_CONTENT_ADDRESSED_STORAGE = getattr(settings,
+    'MEDIA_TREE_CONTENT_ADDRESSED_STORAGE', False)
+"""
+Default: ``False``
+
+If ``True``, uploaded files are stored under a name derived from the SHA-256
+digest of their contents, e.g. ``upload/3a/7b/3a7bd3e2...jpg``, instead of
+their original name. Identical uploads then reference a single file in
+storage, which is deleted when the last node referencing it is deleted. Note
+that the original file name is then not visible in download URLs.
+"""
+
 MEDIA_TREE_PREVIEW_SUBDIR = getattr(settings, 'MEDIA_TREE_PREVIEW_SUBDIR',
     'upload/_preview')
 """
@@ -174,6 +186,17 @@ Default: 1 GB
 Maximum file size for uploaded files.
 """
 
+MEDIA_TREE_MAX_IMAGE_PIXELS = getattr(settings, 'MEDIA_TREE_MAX_IMAGE_PIXELS',
+    89478485) # about 0.25 GB for 24-bit images
+"""
+Default: ``89478485``
+
+Maximum number of pixels of images. Since decoding an image requires memory
+proportional to its dimensions, images exceeding this limit are rejected on
+upload, and not treated as supported images otherwise. Set to ``None`` to
+disable the limit.
+"""
+
 MEDIA_TREE_GLOBAL_THUMBNAIL_OPTIONS = getattr(settings,
     'MEDIA_TREE_GLOBAL_THUMBNAIL_OPTIONS', {})
 """
@@ -181,6 +204,66 @@ A dictionary of options that should be applied by default when generating
 thumbnails. You might use this, for instance, to sharpen all thumbnails.
 """
 
+MEDIA_TREE_PREGENERATE_THUMBNAILS = getattr(settings,
+    'MEDIA_TREE_PREGENERATE_THUMBNAILS', False)
+"""
+Default: ``False``
+
+If ``True``, thumbnails in all sizes defined by ``MEDIA_TREE_ADMIN_THUMBNAIL_SIZES``
+and ``MEDIA_TREE_THUMBNAIL_SIZES`` are generated in a pool of background threads
+and stored in the thumbnail manifest whenever a web image is uploaded, instead
+of being generated when they are first displayed. The response to the upload
+does not wait for them.
+"""
+
+MEDIA_TREE_PREGENERATE_THREADS = getattr(settings,
+    'MEDIA_TREE_PREGENERATE_THREADS', 2)
+"""
+Default: ``2``
+
+Number of background threads per web process used for pre-generating
+thumbnails of uploaded images.
+"""
+
+MEDIA_TREE_THUMBNAIL_PROCESSES = getattr(settings,
+    'MEDIA_TREE_THUMBNAIL_PROCESSES', None)
+"""
+Default: ``None``
+
+Number of worker processes used for pre-generating thumbnails with
+``manage.py mediathumbs --warm`` if ``--jobs`` is not given. ``None`` means
+that the number of CPUs is used.
+"""
+
+MEDIA_TREE_THUMBNAIL_THREADS = getattr(settings,
+    'MEDIA_TREE_THUMBNAIL_THREADS', 4)
+"""
+Default: ``4``
+
+Maximum number of threads used for generating missing thumbnails concurrently
+when thumbnails of several images are requested at once, for instance by the
+``thumbnails`` template tag.
+"""
+
+MEDIA_TREE_PROBE_THREADS = getattr(settings,
+    'MEDIA_TREE_PROBE_THREADS', 4)
+"""
+Default: ``4``
+
+Number of threads used for determining the media type and dimensions of files
+concurrently when many nodes are created at once, for instance when extracting
+archives.
+"""
+
+MEDIA_TREE_COPY_THREADS = getattr(settings,
+    'MEDIA_TREE_COPY_THREADS', 4)
+"""
+Default: ``4``
+
+Number of threads used for copying files concurrently when nodes are copied,
+if the storage does not support copying files by creating links.
+"""
+
 MEDIA_TREE_METADATA_FORMATS = getattr(settings, 'MEDIA_TREE_METADATA_FORMATS', {
     'title': '<strong>%s</strong>'
 })
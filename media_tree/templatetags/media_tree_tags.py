@@ -1,6 +1,7 @@
 from media_tree.models import FileNode
 from media_tree.utils.filenode import get_file_link
 from django import template
+import types
 
 register = template.Library()
 
@@ -22,9 +23,16 @@ def file_links(items, opts=None):
 	"""
 	Turns a (optionally nested) list of FileNode objects into a list of 
 	strings, linking to the associated files.
+
+	If ``items`` is a generator of ``(depth, node)`` tuples as returned by 
+	:func:`~media_tree.utils.filenode.iter_filenode_list`, a generator of 
+	``(depth, link)`` tuples is returned instead, so the nodes are only 
+	fetched while the template is iterating over them.
 	"""
-	result = []
 	kwargs = get_kwargs_for_file_link(opts)
+	if isinstance(items, types.GeneratorType):
+		return iter_file_links(items, kwargs)
+	result = []
 	for item in items:
 		if isinstance(item, FileNode):
 			result.append(get_file_link(item, **kwargs))
@@ -34,6 +42,12 @@ def file_links(items, opts=None):
 
 register.filter(file_links)
 
+def iter_file_links(items, kwargs):
+	for depth, item in items:
+		if isinstance(item, FileNode):
+			item = get_file_link(item, **kwargs)
+		yield (depth, item)
+
 def file_link(node, opts=None):
 	"""
 	Turns a FileNode object into a string, linking to the associated file.
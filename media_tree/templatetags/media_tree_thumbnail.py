@@ -17,6 +17,7 @@ library as follows::
 from media_tree import settings as app_settings
 from media_tree.models import FileNode
 from media_tree.media_backends import get_media_backend
+from media_tree.utils.thumbnails import get_thumbnail
 from media_tree import media_types
 from django.conf import settings
 from django import template
@@ -108,6 +109,63 @@ def thumbnail_size(parser, token):
 register.tag(thumbnail_size)
 
 
+def compile_size(parser, size):
+    """
+    Compiles the size argument of the thumbnail tags. Static sizes, i.e. sizes
+    in the ``[width]x[height]`` format or quoted names of sizes configured in
+    ``MEDIA_TREE_THUMBNAIL_SIZES``, are resolved once at compile time. Any
+    other argument is compiled as a variable, which is resolved on every render.
+    """
+    literal = size
+    if len(size) > 1 and size[0] == size[-1] and size[0] in ('"', "'"):
+        literal = size[1:-1]
+    match = RE_SIZE.match(literal)
+    if match:
+        return (int(match.group(1)), int(match.group(2)))
+    if literal != size and literal in THUMBNAIL_SIZES:
+        return THUMBNAIL_SIZES[literal]
+    return parser.compile_filter(size)
+
+
+def resolve_size(size):
+    """
+    Returns a size as a tuple of two integers if ``size`` is a string in the
+    ``[width]x[height]`` format or the name of a configured size. Other values
+    are returned unchanged.
+    """
+    if isinstance(size, basestring):
+        m = RE_SIZE.match(size)
+        if m:
+            return (int(m.group(1)), int(m.group(2)))
+        if size in THUMBNAIL_SIZES:
+            return THUMBNAIL_SIZES[size]
+        raise ValueError("'%s' is not a valid size." % size)
+    return size
+
+
+def resolve_options(opts, context):
+    resolved = {}
+    for key, value in opts.items():
+        if hasattr(value, 'resolve'):
+            value = value.resolve(context)
+        resolved[str(key)] = value
+    resolved['size'] = resolve_size(resolved['size'])
+    return resolved
+
+
+def compile_options(parser, tag, size, args):
+    opts = {'size': compile_size(parser, size)}
+    for arg, value in split_args(args).items():
+        if arg in VALID_OPTIONS:
+            if value and value is not True:
+                value = parser.compile_filter(value)
+            opts[arg] = value
+        else:
+            raise TemplateSyntaxError("'%s' tag received a bad argument: "
+                                      "'%s'" % (tag, arg))
+    return opts
+
+
 def split_args(args):
     """
     Split a list of argument strings into a dictionary where each key is an
@@ -149,36 +207,22 @@ class ThumbnailNode(Node):
                 raise VariableDoesNotExist("Variable '%s' does not exist." %
                         self.source_var)
             return self.bail_out(context)
-        # Resolve the thumbnail option values.
+        # Resolve the thumbnail option values. Size variable can be either a
+        # tuple/list of two integers or a valid string, only the string is
+        # checked.
         try:
-            opts = {}
-            for key, value in self.opts.iteritems():
-                if hasattr(value, 'resolve'):
-                    value = value.resolve(context)
-                opts[str(key)] = value
+            opts = resolve_options(self.opts, context)
+        except ValueError as e:
+            if raise_errors:
+                raise TemplateSyntaxError(e)
+            return self.bail_out(context)
         except:
             if raise_errors:
                 raise
             return self.bail_out(context)
-            
-        # Size variable can be either a tuple/list of two integers or a
-        # valid string, only the string is checked.
-        size = opts['size']
-        if isinstance(size, basestring):
-            m = RE_SIZE.match(size)
-            if m:
-                opts['size'] = (int(m.group(1)), int(m.group(2)))
-            else:
-                if THUMBNAIL_SIZES.has_key(size):
-                    opts['size'] = THUMBNAIL_SIZES[size]
-                else:
-                    if raise_errors:
-                        raise TemplateSyntaxError("Variable '%s' was resolved "
-                                "but '%s' is not a valid size." %
-                                (self.size_var, size))
-                    return self.bail_out(context)
+
         try:
-            thumbnail = MEDIA_BACKEND.get_thumbnail(source, opts)
+            thumbnail = get_thumbnail(source, opts, MEDIA_BACKEND)
         except:
             if raise_thumb_errors:
                 raise
@@ -270,29 +314,89 @@ def thumbnail(parser, token):
             "'{%% %s source size [option1 option2 ...] as variable %%}'" %
             (tag, tag))
 
-    opts = {}
-
     # The first argument is the source file.
     source_var = parser.compile_filter(args[1])
 
-    # The second argument is the requested size. If it's the static "10x10"
-    # format, wrap it in quotes so that it is compiled correctly.
-    size = args[2]
-    match = RE_SIZE.match(size)
-    if match:
-        size = '"%s"' % size
-    opts['size'] = parser.compile_filter(size)
-
-    # All further arguments are options.
-    args_list = split_args(args[3:]).items()
-    for arg, value in args_list:
-        if arg in VALID_OPTIONS:
-            if value and value is not True:
-                value = parser.compile_filter(value)
-            opts[arg] = value
-        else:
-            raise TemplateSyntaxError("'%s' tag received a bad argument: "
-                                      "'%s'" % (tag, arg))
+    # The second argument is the requested size, all further arguments are
+    # options.
+    opts = compile_options(parser, tag, args[2], args[3:])
     return ThumbnailNode(source_var, opts=opts, context_name=context_name)
 
 register.tag(thumbnail)
+
+
+class ThumbnailsNode(Node):
+    def __init__(self, sources_var, opts, context_name):
+        self.sources_var = sources_var
+        self.opts = opts
+        self.context_name = context_name
+
+    def render(self, context):
+        raise_errors = getattr(settings, 'TEMPLATE_DEBUG', False)
+        raise_thumb_errors = getattr(settings, 'THUMBNAIL_DEBUG', False)
+        context[self.context_name] = []
+        try:
+            sources = [source.file if isinstance(source, FileNode) else source
+                for source in self.sources_var.resolve(context) or ()]
+        except VariableDoesNotExist:
+            if raise_errors:
+                raise VariableDoesNotExist("Variable '%s' does not exist." %
+                        self.sources_var)
+            return ''
+        try:
+            opts = resolve_options(self.opts, context)
+        except ValueError as e:
+            if raise_errors:
+                raise TemplateSyntaxError(e)
+            return ''
+        except:
+            if raise_errors:
+                raise
+            return ''
+
+        try:
+            context[self.context_name] = MEDIA_BACKEND.get_thumbnails(sources, opts)
+        except:
+            if raise_thumb_errors:
+                raise
+        return ''
+
+
+def thumbnails(parser, token):
+    """
+    Creates thumbnails of a list of ``FileNode`` objects or files and places a
+    list containing the thumbnails in the context, in the same order as the
+    sources.
+
+    Basic tag syntax::
+
+        {% thumbnails [source_list] [size] [options] as [variable] %}
+
+    ``size`` and ``options`` work like those of :func:`thumbnail`. Unlike
+    using :func:`thumbnail` in a loop, all existing thumbnails are looked up at
+    once, and missing thumbnails are generated concurrently, see
+    ``MediaBackend.get_thumbnails()``. The list will contain ``None`` for
+    images that no thumbnail could be created for.
+
+    Example usage::
+
+        {% thumbnails node_list "small" as thumbs %}
+        {% for thumb in thumbs %}
+            <img src="{{ thumb.url }}" width="{{ thumb.width }}" height="{{ thumb.height }}" />
+        {% endfor %}
+
+    """
+    args = token.split_contents()
+    tag = args[0]
+
+    if len(args) < 5 or args[-2] != 'as':
+        raise TemplateSyntaxError("Invalid syntax. Expected "
+            "'{%% %s source_list size [option1 option2 ...] as variable %%}'" % tag)
+    context_name = args[-1]
+    args = args[:-2]
+
+    sources_var = parser.compile_filter(args[1])
+    opts = compile_options(parser, tag, args[2], args[3:])
+    return ThumbnailsNode(sources_var, opts=opts, context_name=context_name)
+
+register.tag(thumbnails)
@@ -0,0 +1,14 @@
+import django
+
+if django.VERSION < (1, 6):
+    # Test discovery was introduced in Django 1.6, previous versions only run
+    # the tests found in this module
+    from media_tree.tests.test_paths import *
+    from media_tree.tests.test_aggregates import *
+    from media_tree.tests.test_thumbnails import *
+    from media_tree.tests.test_maintenance import *
+    from media_tree.tests.test_zipfiles import *
+    from media_tree.tests.test_probe import *
+    from media_tree.tests.test_storage import *
+    from media_tree.tests.test_names import *
+    from media_tree.tests.test_bulk import *
@@ -0,0 +1,96 @@
+from media_tree.models import FileNode, PATH_MAX_LENGTH
+from media_tree.utils.maintenance import update_aggregates
+from django.core.files.base import ContentFile
+from django.template.defaultfilters import slugify
+from django.test import TestCase
+import shutil
+import tempfile
+
+
+class MediaTreeTestCase(TestCase):
+    """
+    Stores media files in a temporary directory, and provides methods for
+    creating nodes and for checking the integrity of the whole tree.
+    """
+
+    def setUp(self):
+        self.storage = FileNode.STORAGE
+        self.original_location = self.storage.location
+        self.media_root = tempfile.mkdtemp()
+        self.storage.location = self.media_root
+
+    def tearDown(self):
+        self.storage.location = self.original_location
+        shutil.rmtree(self.media_root)
+
+    def reload(self, node):
+        return FileNode.objects.get(pk=node.pk)
+
+    def create_folder(self, name, parent=None):
+        # Reload parent because tree attributes may be out of date
+        node = FileNode(node_type=FileNode.FOLDER, name=name,
+            parent=self.reload(parent) if parent else None)
+        node.save()
+        return node
+
+    def create_file(self, name, parent=None, content=b'Lorem ipsum dolor sit amet', **kwargs):
+        node = FileNode(node_type=FileNode.FILE, file=ContentFile(content, name=name),
+            parent=self.reload(parent) if parent else None, **kwargs)
+        node.save()
+        return node
+
+    def assertTreeIntegrity(self):
+        """
+        Asserts that the tree fields of all nodes are consistent with their
+        parents, that siblings are ordered by name, that the stored paths match
+        the names of the nodes and their ancestors, and that the aggregates of
+        all nodes are up to date.
+        """
+        opts = FileNode._mptt_meta
+        tree_id_attr, left_attr, right_attr, level_attr = (
+            opts.tree_id_attr, opts.left_attr, opts.right_attr, opts.level_attr)
+        nodes = list(FileNode.objects.order_by(tree_id_attr, left_attr))
+        nodes_by_pk = dict([(node.pk, node) for node in nodes])
+        trees = {}
+        children = {}
+        paths = {}
+        for node in nodes:
+            trees.setdefault(getattr(node, tree_id_attr), []).append(node)
+            children.setdefault(node.parent_id, []).append(node)
+
+            if node.parent_id is None:
+                self.assertEqual(getattr(node, left_attr), 1)
+                self.assertEqual(getattr(node, level_attr), 0)
+                paths[node.pk] = node.name
+            else:
+                parent = nodes_by_pk[node.parent_id]
+                self.assertEqual(parent.node_type, FileNode.FOLDER)
+                self.assertEqual(getattr(node, tree_id_attr), getattr(parent, tree_id_attr))
+                self.assertTrue(getattr(parent, left_attr) < getattr(node, left_attr))
+                self.assertTrue(getattr(node, right_attr) < getattr(parent, right_attr))
+                self.assertEqual(getattr(node, level_attr), getattr(parent, level_attr) + 1)
+                paths[node.pk] = '%s/%s' % (paths[parent.pk], node.name)
+            self.assertEqual(node.path, paths[node.pk] if len(paths[node.pk]) <= PATH_MAX_LENGTH else None)
+            self.assertEqual(node.slug, slugify(node.name))
+
+            if node.node_type == FileNode.FILE:
+                self.assertEqual(getattr(node, right_attr), getattr(node, left_attr) + 1)
+                self.assertEqual(node.get_aggregates(),
+                    (node.size or 0, 1, 0 if node.has_metadata else 1))
+
+        for tree_id, tree_nodes in trees.items():
+            values = []
+            for node in tree_nodes:
+                values.extend((getattr(node, left_attr), getattr(node, right_attr)))
+            self.assertEqual(sorted(values), list(range(1, len(tree_nodes) * 2 + 1)))
+
+        for parent_id, siblings in children.items():
+            if parent_id is None:
+                siblings = sorted(siblings, key=lambda node: getattr(node, tree_id_attr))
+            else:
+                siblings = sorted(siblings, key=lambda node: getattr(node, left_attr))
+            names = [node.name for node in siblings]
+            self.assertEqual(names, sorted(names))
+            self.assertEqual(len(names), len(set(names)))
+
+        self.assertEqual(update_aggregates(), 0)
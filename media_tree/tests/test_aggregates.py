@@ -0,0 +1,73 @@
+from media_tree.admin.filenode_admin import FileNodeAdmin
+from media_tree.models import FileNode
+from media_tree.tests.base import MediaTreeTestCase
+from django.contrib import admin
+from django.template.defaultfilters import filesizeformat
+
+
+class AggregatesTest(MediaTreeTestCase):
+    """
+    Audio files are used since text files do not require metadata.
+    """
+
+    def setUp(self):
+        super(AggregatesTest, self).setUp()
+        self.folder = self.create_folder('folder')
+        self.subfolder = self.create_folder('subfolder', self.folder)
+        self.other = self.create_folder('other')
+        self.first = self.create_file('first.mp3', self.subfolder, content=b'a' * 10)
+        self.second = self.create_file('second.mp3', self.subfolder, content=b'b' * 20, title='Second')
+
+    def test_create(self):
+        self.assertEqual(self.reload(self.folder).get_aggregates(), (30, 2, 1))
+        self.assertEqual(self.reload(self.subfolder).get_aggregates(), (30, 2, 1))
+        self.assertEqual(self.reload(self.other).get_aggregates(), (0, 0, 0))
+        self.assertFalse(self.reload(self.folder).has_metadata)
+        self.assertTreeIntegrity()
+
+    def test_change_metadata(self):
+        first = self.reload(self.first)
+        first.title = 'First'
+        first.save()
+        self.assertEqual(self.reload(self.folder).get_aggregates(), (30, 2, 0))
+        self.assertTrue(self.reload(self.folder).has_metadata)
+        self.assertTreeIntegrity()
+
+    def test_move(self):
+        subfolder = self.reload(self.subfolder)
+        subfolder.parent = self.reload(self.other)
+        subfolder.save()
+        self.assertEqual(self.reload(self.folder).get_aggregates(), (0, 0, 0))
+        self.assertEqual(self.reload(self.other).get_aggregates(), (30, 2, 1))
+        self.assertTreeIntegrity()
+
+        second = self.reload(self.second)
+        second.parent = self.reload(self.folder)
+        second.save()
+        self.assertEqual(self.reload(self.folder).get_aggregates(), (20, 1, 0))
+        self.assertEqual(self.reload(self.other).get_aggregates(), (10, 1, 1))
+        self.assertTreeIntegrity()
+
+    def test_rename_folder(self):
+        # Aggregates of the loaded instance are out of date and must not be written
+        subfolder = FileNode.objects.get(pk=self.subfolder.pk)
+        self.create_file('third.mp3', subfolder, content=b'c' * 5)
+        subfolder.name = 'renamed'
+        subfolder.save()
+        self.assertEqual(self.reload(self.subfolder).get_aggregates(), (35, 3, 2))
+        self.assertEqual(self.reload(self.folder).get_aggregates(), (35, 3, 2))
+        self.assertTreeIntegrity()
+
+    def test_delete(self):
+        self.reload(self.first).delete()
+        self.assertEqual(self.reload(self.folder).get_aggregates(), (20, 1, 0))
+        self.assertTreeIntegrity()
+        self.reload(self.subfolder).delete()
+        self.assertEqual(self.reload(self.folder).get_aggregates(), (0, 0, 0))
+        self.assertTreeIntegrity()
+
+    def test_size_display(self):
+        model_admin = FileNodeAdmin(FileNode, admin.site)
+        self.assertEqual(model_admin.size_formatted(self.reload(self.folder)), '<span class="filesize">%s</span>' % filesizeformat(30))
+        self.assertEqual(model_admin.size_formatted(self.reload(self.folder), with_descendants=False), '')
+        self.assertEqual(model_admin.size_formatted(self.reload(self.other)), '')
@@ -0,0 +1,58 @@
+from media_tree import settings as app_settings, media_types
+from media_tree.media_backends import MediaBackend, get_media_backend, reset_media_backends
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+
+
+class ImageBackend(MediaBackend):
+    """
+    Counts how often it is asked whether it handles media types.
+    """
+
+    SUPPORTED_MEDIA_TYPES = (media_types.SUPPORTED_IMAGE,)
+    lookups = 0
+
+    @classmethod
+    def handles_media_types(cls, media_types):
+        ImageBackend.lookups += 1
+        return set(media_types) <= set(cls.SUPPORTED_MEDIA_TYPES)
+
+
+class VectorImageBackend(MediaBackend):
+
+    SUPPORTED_MEDIA_TYPES = (media_types.VECTOR_IMAGE,)
+
+
+class MediaBackendTest(TestCase):
+
+    def setUp(self):
+        self.original_backends = app_settings.MEDIA_TREE_MEDIA_BACKENDS
+        app_settings.MEDIA_TREE_MEDIA_BACKENDS = ('media_tree.tests.test_backends.ImageBackend',
+            'media_tree.tests.test_backends.VectorImageBackend')
+        reset_media_backends()
+        ImageBackend.lookups = 0
+
+    def tearDown(self):
+        app_settings.MEDIA_TREE_MEDIA_BACKENDS = self.original_backends
+        reset_media_backends()
+
+    def test_memoized(self):
+        for i in range(3):
+            self.assertEqual(get_media_backend(handles_media_types=(media_types.VECTOR_IMAGE,)), VectorImageBackend)
+        self.assertEqual(ImageBackend.lookups, 1)
+        self.assertEqual(get_media_backend(handles_media_types=(media_types.SUPPORTED_IMAGE,)), ImageBackend)
+        self.assertEqual(ImageBackend.lookups, 2)
+
+    def test_reset(self):
+        get_media_backend(handles_media_types=(media_types.VECTOR_IMAGE,))
+        reset_media_backends()
+        get_media_backend(handles_media_types=(media_types.VECTOR_IMAGE,))
+        self.assertEqual(ImageBackend.lookups, 2)
+
+    def test_changed_setting(self):
+        # Results are memoized for the configured backends
+        self.assertEqual(get_media_backend(handles_media_types=(media_types.VECTOR_IMAGE,)), VectorImageBackend)
+        app_settings.MEDIA_TREE_MEDIA_BACKENDS = ('media_tree.tests.test_backends.ImageBackend',)
+        self.assertEqual(get_media_backend(handles_media_types=(media_types.VECTOR_IMAGE,)), False)
+        self.assertRaises(ImproperlyConfigured, get_media_backend, fail_silently=False,
+            handles_media_types=(media_types.VECTOR_IMAGE,))
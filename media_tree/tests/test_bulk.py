@@ -0,0 +1,142 @@
+from media_tree.models import FileNode
+from media_tree.tests.base import MediaTreeTestCase
+from media_tree.utils.bulk import move_node_trees, copy_node_trees, insert_node_trees, update_metadata
+from mptt.exceptions import InvalidMove
+import os
+
+
+class MoveNodeTreesTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(MoveNodeTreesTest, self).setUp()
+        self.source = self.create_folder('source')
+        self.target = self.create_folder('target')
+        self.create_folder('b', self.target)
+        self.create_file('d.txt', self.target)
+        self.a = self.create_folder('a', self.source)
+        self.c = self.create_file('c.txt', self.source, content=b'c' * 10)
+        self.e = self.create_file('e.txt', self.a)
+        self.d = self.create_file('d.txt', self.source)
+
+    def get_child_names(self, parent):
+        return list(FileNode.objects.filter(parent=parent).order_by('tree_id', 'lft').values_list('name', flat=True))
+
+    def test_move_sorted(self):
+        move_node_trees([self.c, self.e, self.a], self.target)
+        self.assertEqual(self.get_child_names(self.target), ['a', 'b', 'c.txt', 'd.txt'])
+        self.assertEqual(self.get_child_names(self.a), ['e.txt'])
+        self.assertEqual(self.reload(self.target).file_count, 3)
+        self.assertEqual(self.reload(self.source).file_count, 1)
+        self.assertTreeIntegrity()
+
+    def test_move_name_conflict(self):
+        # The name of the moved node is changed along with its parent
+        nodes = move_node_trees([self.d], self.target)
+        self.assertEqual(nodes[0].name, 'd_2.txt')
+        self.assertEqual(self.get_child_names(self.target), ['b', 'd.txt', 'd_2.txt'])
+        self.assertEqual(self.reload(self.d).path, 'target/d_2.txt')
+        self.assertTreeIntegrity()
+
+    def test_move_to_top_level(self):
+        move_node_trees([self.e, self.c], None)
+        self.assertEqual(self.get_child_names(None), ['c.txt', 'e.txt', 'source', 'target'])
+        self.assertEqual(self.get_child_names(self.a), [])
+        self.assertTreeIntegrity()
+
+    def test_invalid_move(self):
+        self.assertRaises(InvalidMove, move_node_trees, [self.source], self.a)
+        self.assertTreeIntegrity()
+
+
+class CopyNodeTreesTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(CopyNodeTreesTest, self).setUp()
+        self.source = self.create_folder('source')
+        self.target = self.create_folder('target')
+        self.create_file('b.txt', self.target)
+        self.a = self.create_folder('a', self.source)
+        self.c = self.create_file('c.txt', self.source, content=b'c' * 10)
+        self.create_file('e.txt', self.a)
+
+    def get_stored_files(self):
+        stored = []
+        for root, dirs, files in os.walk(self.media_root):
+            stored.extend([os.path.join(root, name) for name in files])
+        return sorted(stored)
+
+    def test_copy(self):
+        nodes = copy_node_trees([self.c, self.a], self.target)
+        self.assertEqual(len(nodes), 3)
+        self.assertEqual(list(FileNode.objects.filter(parent=self.target).order_by('lft').values_list('name', flat=True)),
+            ['a', 'b.txt', 'c.txt'])
+        copy = FileNode.objects.get(path='target/c.txt')
+        self.assertNotEqual(copy.file.name, self.c.file.name)
+        self.assertEqual(copy.file.read(), b'c' * 10)
+        self.assertEqual(self.reload(self.target).file_count, 3)
+        self.assertTreeIntegrity()
+
+    def test_copy_failure(self):
+        stored = self.get_stored_files()
+        # The target does not exist anymore, so inserting the copies fails
+        FileNode.objects.filter(pk=self.target.pk).delete()
+        self.assertRaises(FileNode.DoesNotExist, copy_node_trees, [self.source], self.target)
+        self.assertEqual(self.get_stored_files(), stored)
+
+
+class InsertNodeTreesTest(MediaTreeTestCase):
+
+    def test_insert_sorted(self):
+        target = self.create_folder('target')
+        self.create_folder('b', target)
+        self.create_folder('d', target)
+        insert_node_trees(target, [
+            (FileNode(node_type=FileNode.FOLDER, name='e'), []),
+            (FileNode(node_type=FileNode.FOLDER, name='c'), [
+                (FileNode(node_type=FileNode.FOLDER, name='z'), []),
+                (FileNode(node_type=FileNode.FOLDER, name='y'), [])]),
+            (FileNode(node_type=FileNode.FOLDER, name='a'), []),
+            (FileNode(node_type=FileNode.FOLDER, name='b'), []),
+        ])
+        self.assertEqual(list(FileNode.objects.filter(parent=target).order_by('lft').values_list('name', flat=True)),
+            ['a', 'b', 'b_2', 'c', 'd', 'e'])
+        self.assertEqual(FileNode.objects.get(path='target/c/y').level, 2)
+        self.assertTreeIntegrity()
+
+    def test_insert_differing_in_case(self):
+        target = self.create_folder('target')
+        self.create_folder('b', target)
+        insert_node_trees(target, [(FileNode(node_type=FileNode.FOLDER, name='B'), [])])
+        self.assertEqual(list(FileNode.objects.filter(parent=target).order_by('lft').values_list('name', flat=True)),
+            ['B_2', 'b'])
+        self.assertTreeIntegrity()
+
+    def test_insert_top_level(self):
+        self.create_folder('b')
+        self.create_folder('d')
+        insert_node_trees(None, [(FileNode(node_type=FileNode.FOLDER, name='c'), []),
+            (FileNode(node_type=FileNode.FOLDER, name='e'), []),
+            (FileNode(node_type=FileNode.FOLDER, name='a'), [])])
+        self.assertEqual(list(FileNode.objects.filter(parent=None).order_by('tree_id').values_list('name', flat=True)),
+            ['a', 'b', 'c', 'd', 'e'])
+        self.assertTreeIntegrity()
+
+
+class UpdateMetadataTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(UpdateMetadataTest, self).setUp()
+        self.folder = self.create_folder('folder')
+        self.a = self.create_file('a.txt', self.folder)
+        self.b = self.create_file('b.txt', self.folder)
+        self.a.title = 'Title'
+        self.a.save()
+
+    def test_count_changed(self):
+        # Only nodes whose values differ are counted
+        self.assertEqual(update_metadata([self.a, self.b], {'title': 'Title'}), 1)
+        self.assertEqual(self.reload(self.b).title, 'Title')
+        self.assertEqual(update_metadata([self.a, self.b], {'title': 'Title'}), 0)
+        self.assertEqual(update_metadata([self.folder], {'title': ''}, recursive=True), 2)
+        self.assertEqual(self.reload(self.a).title, '')
+        self.assertTreeIntegrity()
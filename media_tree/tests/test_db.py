@@ -0,0 +1,34 @@
+from media_tree.models import FileNode
+from media_tree.tests.base import MediaTreeTestCase
+from media_tree.utils.db import get_common_values
+
+
+class CommonValuesTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(CommonValuesTest, self).setUp()
+        self.folder = self.create_folder('folder')
+        self.create_file('first.txt', self.folder, title='Title', description='First', is_default=True)
+        self.create_file('second.txt', self.folder, title='Title', description='Second', is_default=True)
+        self.fields = [FileNode._meta.get_field(name) for name in (
+            'title', 'description', 'is_default', 'parent', 'author')]
+
+    def get_common_values(self, queryset):
+        with self.assertNumQueries(1):
+            return get_common_values(queryset, self.fields)
+
+    def test_common_values(self):
+        self.assertEqual(self.get_common_values(FileNode.files.all()), {
+            'title': 'Title', 'description': None, 'is_default': True,
+            'parent': self.folder.pk, 'author': ''})
+
+    def test_null_values(self):
+        # Values are only common if none of them is NULL
+        FileNode.objects.filter(name='first.txt').update(title=None, author='Author')
+        self.assertEqual(self.get_common_values(FileNode.files.all())['title'], None)
+        self.assertEqual(self.get_common_values(FileNode.files.all())['author'], None)
+        self.assertEqual(self.get_common_values(FileNode.files.filter(name='first.txt'))['author'], 'Author')
+
+    def test_no_objects(self):
+        self.assertEqual(get_common_values(FileNode.objects.none(), self.fields), dict(
+            [(field.name, None) for field in self.fields]))
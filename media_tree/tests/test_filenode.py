@@ -0,0 +1,73 @@
+from media_tree import media_types
+from media_tree.models import FileNode
+from media_tree.tests.base import MediaTreeTestCase
+from media_tree.utils.filenode import get_nested_filenode_list, get_merged_filenode_list,  \
+    iter_filenode_list, LIST_OPEN, LIST_CLOSE
+
+
+def get_name(node):
+    return node.name
+
+
+class FileNodeListTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(FileNodeListTest, self).setUp()
+        self.folder = self.create_folder('folder')
+        self.subfolder = self.create_folder('subfolder', self.folder)
+        self.create_folder('empty', self.folder)
+        self.create_file('a.mp3', self.folder)
+        self.create_file('b.txt', self.folder)
+        self.create_file('c.mp3', self.subfolder)
+        self.create_file('top.txt')
+
+    def get_top_level_nodes(self):
+        return FileNode.objects.filter(parent=None).order_by('tree_id')
+
+    def test_nested(self):
+        # The descendants of all folders are loaded with a single query
+        with self.assertNumQueries(2):
+            nodes = get_nested_filenode_list(self.get_top_level_nodes(), processors=[get_name])
+        self.assertEqual(nodes, ['folder', ['a.mp3', 'b.txt', 'empty', 'subfolder', ['c.mp3']], 'top.txt'])
+
+    def test_nested_filtered(self):
+        nodes = get_nested_filenode_list(self.get_top_level_nodes(), processors=[get_name],
+            filter_media_types=[media_types.AUDIO])
+        self.assertEqual(nodes, ['folder', ['a.mp3', 'subfolder', ['c.mp3']]])
+
+    def test_merged_max_depth(self):
+        nodes = get_merged_filenode_list(self.get_top_level_nodes(), processors=[get_name], max_depth=2)
+        self.assertEqual(nodes, ['folder', 'a.mp3', 'b.txt', 'empty', 'subfolder', 'top.txt'])
+
+
+class IterFileNodeListTest(FileNodeListTest):
+
+    def test_nested(self):
+        nodes = list(iter_filenode_list(self.get_top_level_nodes(), processors=[get_name], list_markers=True))
+        self.assertEqual(nodes, [(1, 'folder'), (2, LIST_OPEN), (2, 'a.mp3'), (2, 'b.txt'), (2, 'empty'),
+            (2, 'subfolder'), (3, LIST_OPEN), (3, 'c.mp3'), (3, LIST_CLOSE), (2, LIST_CLOSE), (1, 'top.txt')])
+
+    def test_nested_filtered(self):
+        nodes = list(iter_filenode_list(self.get_top_level_nodes(), processors=[get_name],
+            filter_media_types=[media_types.AUDIO]))
+        self.assertEqual(nodes, [(1, 'folder'), (2, 'a.mp3'), (2, 'subfolder'), (3, 'c.mp3')])
+
+    def test_merged_max_depth(self):
+        nodes = list(iter_filenode_list(self.get_top_level_nodes(), processors=[get_name],
+            nested=False, max_depth=2))
+        self.assertEqual([name for depth, name in nodes], ['folder', 'a.mp3', 'b.txt', 'empty', 'subfolder', 'top.txt'])
+
+    def test_chunks(self):
+        # The five descendants of the folder are fetched in chunks of two nodes
+        folder = self.reload(self.folder)
+        with self.assertNumQueries(3):
+            nodes = list(iter_filenode_list([folder], chunk_size=2))
+        self.assertEqual(len(nodes), 6)
+
+    def test_max_nodes(self):
+        # No further chunks are fetched once the maximum number of nodes is reached
+        folder = self.reload(self.folder)
+        with self.assertNumQueries(1):
+            nodes = list(iter_filenode_list([folder], processors=[get_name],
+                list_markers=True, max_nodes=2, chunk_size=2))
+        self.assertEqual(nodes, [(1, 'folder'), (2, LIST_OPEN), (2, 'a.mp3'), (2, LIST_CLOSE)])
@@ -0,0 +1,59 @@
+from media_tree.models import FileNode
+from media_tree.tests.base import MediaTreeTestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils.six import StringIO
+import os
+import shutil
+import tempfile
+
+
+class ImportCommandTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(ImportCommandTest, self).setUp()
+        self.source = tempfile.mkdtemp()
+        self.write_file('a.txt', b'a' * 10)
+        self.write_file('sub/b.txt', b'b' * 20)
+        self.write_file('sub/deeper/c.txt', b'c')
+        self.target = self.create_folder('target')
+
+    def tearDown(self):
+        shutil.rmtree(self.source)
+        super(ImportCommandTest, self).tearDown()
+
+    def write_file(self, name, content):
+        path = os.path.join(self.source, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def call_command(self, *args, **options):
+        stdout = StringIO()
+        call_command('mediaimport', *args, stdout=stdout, stderr=StringIO(), jobs=1, batch_size=1, **options)
+        return stdout.getvalue()
+
+    def get_paths(self):
+        return sorted(FileNode.objects.values_list('path', flat=True))
+
+    def test_import(self):
+        self.assertEqual(self.call_command(self.source, parent='target'), 'Imported 3 files and 2 folders\n')
+        self.assertEqual(self.get_paths(), ['target', 'target/a.txt', 'target/sub',
+            'target/sub/b.txt', 'target/sub/deeper', 'target/sub/deeper/c.txt'])
+        node = FileNode.objects.get(path='target/sub/b.txt')
+        self.assertEqual(node.size, 20)
+        self.assertEqual(node.file.read(), b'b' * 20)
+        self.assertEqual(self.reload(self.target).get_aggregates()[:2], (31, 3))
+        self.assertTreeIntegrity()
+
+    def test_resume(self):
+        # Existing files are skipped and existing folders are reused
+        self.call_command(self.source, parent='target')
+        self.write_file('sub/d.txt', b'd')
+        self.assertEqual(self.call_command(self.source, parent='target'), 'Imported 1 files and 0 folders\n')
+        self.assertEqual(FileNode.objects.filter(path__startswith='target/sub/').count(), 4)
+        self.assertTreeIntegrity()
+
+    def test_missing_parent(self):
+        self.assertRaises(CommandError, self.call_command, self.source, parent='missing')
@@ -0,0 +1,94 @@
+from media_tree import settings as app_settings
+from media_tree.tests.base import MediaTreeTestCase
+from media_tree.utils.maintenance import iter_evicted_cache_files, EVICTION_RESOLUTION,  \
+    iter_storage_files, get_file_names_in_db, get_broken_media
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.utils.six import StringIO
+import csv
+import os
+
+
+class EvictionTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(EvictionTest, self).setUp()
+        self.cache_storage = FileSystemStorage(location=self.media_root)
+        self.names = []
+        start = (1400000000 // EVICTION_RESOLUTION) * EVICTION_RESOLUTION
+        for i in range(5):
+            name = self.cache_storage.save('cache/%i.bin' % i, ContentFile(b'x' * 10))
+            timestamp = start + i * 60
+            os.utime(self.cache_storage.path(name), (timestamp, timestamp))
+            self.names.append(name)
+
+    def iter_evicted(self, **kwargs):
+        return sorted([name for name, size in iter_evicted_cache_files(
+            iter_files=lambda: iter(self.names), storage=self.cache_storage, **kwargs)])
+
+    def test_evict_within_interval(self):
+        # All files were accessed within the same hour, but only the least
+        # recently used files exceeding the limit are evicted
+        self.assertEqual(self.iter_evicted(max_bytes=25), self.names[:3])
+        self.assertEqual(self.iter_evicted(max_bytes=30), self.names[:2])
+        self.assertEqual(self.iter_evicted(max_bytes=50), [])
+        self.assertEqual(self.iter_evicted(max_bytes=0), self.names)
+
+    def test_evict_older_than(self):
+        self.assertEqual(self.iter_evicted(older_than=0), self.names)
+
+
+class MediaScanTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(MediaScanTest, self).setUp()
+        self.first = self.create_file('first.txt')
+        self.second = self.create_file('second.txt')
+        self.missing = self.create_file('missing.txt')
+        self.storage.delete(self.missing.file.name)
+        self.orphaned = self.storage.save('upload/sub/orphaned.txt', ContentFile(b'x'))
+
+    def test_storage_files(self):
+        names = list(iter_storage_files(self.storage, 'upload'))
+        self.assertEqual(names, sorted([self.first.file.name, self.second.file.name, self.orphaned]))
+        # The walk can be resumed after any file
+        for i, name in enumerate(names):
+            self.assertEqual(list(iter_storage_files(self.storage, 'upload', start_after=name)), names[i + 1:])
+        self.assertEqual(list(iter_storage_files(self.storage, 'upload', exclude_dirs=('upload/sub',))),
+            sorted([self.first.file.name, self.second.file.name]))
+
+    def test_file_names_in_db(self):
+        self.assertEqual(get_file_names_in_db(chunk_size=2),
+            set([self.first.file.name, self.second.file.name, self.missing.file.name]))
+
+    def test_broken_media(self):
+        broken_nodes, orphaned_files = get_broken_media()
+        self.assertEqual(broken_nodes, [self.missing])
+        self.assertEqual(orphaned_files, [self.orphaned])
+
+
+class OrphanedFilesCommandTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(OrphanedFilesCommandTest, self).setUp()
+        self.create_file('used.txt')
+        self.orphaned = self.storage.save('%s/orphaned, "1".txt' % app_settings.MEDIA_TREE_UPLOAD_SUBDIR.strip('/'),
+            ContentFile(b'x' * 10))
+
+    def call_command(self, **options):
+        stdout = StringIO()
+        call_command('mediaorphaned', stdout=stdout, stderr=StringIO(), **options)
+        return stdout.getvalue()
+
+    def test_text(self):
+        self.assertEqual(self.call_command().splitlines(), [self.storage.path(self.orphaned)])
+
+    def test_csv(self):
+        rows = list(csv.reader(StringIO(self.call_command(format='csv'))))
+        self.assertEqual(rows, [['name', 'size', 'status'], [self.orphaned, '10', 'orphaned']])
+
+    def test_delete(self):
+        self.call_command(delete=True)
+        self.assertFalse(self.storage.exists(self.orphaned))
+        self.assertEqual(self.call_command(), '')
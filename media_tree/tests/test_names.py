@@ -0,0 +1,44 @@
+from media_tree.tests.base import MediaTreeTestCase
+
+
+class UniqueNameTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(UniqueNameTest, self).setUp()
+        self.first = self.create_folder('first')
+        self.second = self.create_folder('second')
+        self.file = self.create_file('readme.txt', self.first)
+        self.other_file = self.create_file('readme.txt', self.second)
+
+    def test_create(self):
+        self.assertEqual(self.create_file('readme.txt', self.first).name, 'readme_2.txt')
+        self.assertEqual(self.create_folder('first').name, 'first_2')
+        self.assertTreeIntegrity()
+
+    def test_create_differing_in_case(self):
+        # Names that only differ in case are not accepted by the unique index on MySQL
+        self.assertEqual(self.create_file('README.txt', self.first).name, 'README_2.txt')
+        self.assertTreeIntegrity()
+
+    def test_move_file(self):
+        node = self.reload(self.file)
+        node.parent = self.reload(self.second)
+        node.save()
+        self.assertNotEqual(self.reload(node).name, 'readme.txt')
+        self.assertEqual(self.reload(self.other_file).name, 'readme.txt')
+        self.assertTreeIntegrity()
+
+    def test_rename_file(self):
+        node = self.create_file('other.txt', self.first)
+        node.name = 'readme.txt'
+        node.save()
+        self.assertNotEqual(self.reload(node).name, 'readme.txt')
+        self.assertTreeIntegrity()
+
+    def test_move_folder(self):
+        self.create_folder('first', self.second)
+        node = self.reload(self.first)
+        node.parent = self.reload(self.second)
+        node.save()
+        self.assertNotEqual(self.reload(node).name, 'first')
+        self.assertTreeIntegrity()
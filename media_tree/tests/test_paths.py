@@ -0,0 +1,67 @@
+from media_tree.models import FileNode, PATH_MAX_LENGTH
+from media_tree.tests.base import MediaTreeTestCase
+
+
+class PathTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(PathTest, self).setUp()
+        self.folder = self.create_folder('folder')
+        self.subfolder = self.create_folder('subfolder', self.folder)
+        self.file = self.create_file('readme.txt', self.subfolder)
+
+    def test_lookup_by_path(self):
+        self.assertEqual(self.file.path, 'folder/subfolder/readme.txt')
+        self.assertEqual(FileNode.objects.get(path='folder/subfolder/readme.txt'), self.file)
+        self.assertEqual(FileNode.objects.get(path='/folder/subfolder/'), self.subfolder)
+        self.assertEqual(list(FileNode.objects.filter(path='folder/subfolder')), [self.file])
+        self.assertEqual(list(FileNode.objects.exclude(path='folder')), [self.folder, self.file])
+        self.assertTreeIntegrity()
+
+    def test_rename_folder(self):
+        self.folder.name = 'renamed'
+        self.folder.save()
+        self.assertEqual(self.reload(self.file).path, 'renamed/subfolder/readme.txt')
+        self.assertEqual(FileNode.objects.get(path='renamed/subfolder/readme.txt'), self.file)
+        self.assertRaises(FileNode.DoesNotExist, FileNode.objects.get, path='folder/subfolder/readme.txt')
+        self.assertTreeIntegrity()
+
+    def test_move_folder(self):
+        other = self.create_folder('other')
+        subfolder = self.reload(self.subfolder)
+        subfolder.parent = other
+        subfolder.save()
+        self.assertEqual(self.reload(self.file).path, 'other/subfolder/readme.txt')
+        self.assertTreeIntegrity()
+
+    def test_long_paths(self):
+        long_name = 'x' * 120
+        first = self.create_folder(long_name)
+        second = self.create_folder(long_name, first)
+        third = self.create_file('%s.txt' % long_name, second)
+        path = '/'.join((long_name, long_name, '%s.txt' % long_name))
+        self.assertTrue(len(path) > PATH_MAX_LENGTH)
+        self.assertEqual(self.reload(second).path, '/'.join((long_name, long_name)))
+        # Paths that are too long to be stored are looked up by name
+        self.assertEqual(self.reload(third).path, None)
+        self.assertEqual(self.reload(third).get_path(), path)
+        self.assertEqual(FileNode.objects.get(path=path), third)
+        self.assertEqual(list(FileNode.objects.filter(path='/'.join((long_name, long_name)))), [third])
+        self.assertTreeIntegrity()
+
+        # Moving a folder into a long path removes the paths that do not fit
+        folder = self.reload(self.folder)
+        folder.parent = self.reload(second)
+        folder.save()
+        self.assertEqual(self.reload(folder).path, '/'.join((long_name, long_name, 'folder')))
+        self.assertEqual(self.reload(self.file).path, None)
+        self.assertEqual(FileNode.objects.get(path=self.reload(self.file).get_path()), self.file)
+        self.assertTreeIntegrity()
+
+        # Renaming an ancestor stores the paths that fit now
+        first = self.reload(first)
+        first.name = 'short'
+        first.save()
+        self.assertEqual(self.reload(third).path, '/'.join(('short', long_name, '%s.txt' % long_name)))
+        self.assertEqual(self.reload(self.file).path, '/'.join(('short', long_name, 'folder/subfolder/readme.txt')))
+        self.assertTreeIntegrity()
@@ -0,0 +1,66 @@
+from media_tree import settings as app_settings, media_types
+from media_tree.tests.base import MediaTreeTestCase
+from media_tree.utils.probe import get_image_size, probe_image, is_image_extension, DecompressionBombError
+import struct
+import zlib
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+def get_png(width, height):
+    def chunk(chunk_type, data):
+        return struct.pack('>I', len(data)) + chunk_type + data  \
+            + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xFFFFFFFF)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))  \
+        + chunk(b'IEND', b'')
+
+
+def get_bmp(width, height, dib_header_size=40):
+    if dib_header_size == 12:
+        dib_header = struct.pack('<IHHHH', 12, width, height, 1, 24)
+    else:
+        dib_header = struct.pack('<IiiHH', dib_header_size, width, height, 1, 24)
+        dib_header += b'\x00' * (dib_header_size - len(dib_header))
+    return b'BM' + struct.pack('<IHHI', 14 + len(dib_header), 0, 0, 14 + len(dib_header)) + dib_header
+
+
+class ProbeTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(ProbeTest, self).setUp()
+        self.original_max_pixels = app_settings.MEDIA_TREE_MAX_IMAGE_PIXELS
+
+    def tearDown(self):
+        app_settings.MEDIA_TREE_MAX_IMAGE_PIXELS = self.original_max_pixels
+        super(ProbeTest, self).tearDown()
+
+    def test_image_size(self):
+        self.assertEqual(get_image_size(BytesIO(get_png(300, 200))), ('PNG', 300, 200))
+        self.assertEqual(get_image_size(BytesIO(get_bmp(30, -20))), ('BMP', 30, 20))
+        self.assertEqual(get_image_size(BytesIO(get_bmp(30, 20, 12))), ('BMP', 30, 20))
+        self.assertEqual(get_image_size(BytesIO(b'GIF89a\x0a\x00\x14\x00')), ('GIF', 10, 20))
+
+    def test_invalid_bmp(self):
+        self.assertEqual(get_image_size(BytesIO(b'BM is not a bitmap, but a text file.')), None)
+        self.assertEqual(get_image_size(BytesIO(get_bmp(30, 20, 30))), None)
+        self.assertEqual(get_image_size(BytesIO(get_bmp(0, 20))), None)
+
+    def test_extensions(self):
+        self.assertTrue(is_image_extension('jpg'))
+        self.assertTrue(is_image_extension('PNG'))
+        self.assertFalse(is_image_extension('txt'))
+        self.assertRaises(IOError, probe_image, BytesIO(get_png(300, 200)), 'txt')
+        self.assertEqual(probe_image(BytesIO(get_png(300, 200)), 'png'), (media_types.SUPPORTED_IMAGE, 300, 200))
+
+    def test_text_file(self):
+        node = self.create_file('notes.txt', content=b'BMW and other brands')
+        self.assertNotEqual(self.reload(node).media_type, media_types.SUPPORTED_IMAGE)
+        self.assertEqual(self.reload(node).width, None)
+
+    def test_decompression_bomb(self):
+        app_settings.MEDIA_TREE_MAX_IMAGE_PIXELS = 10000
+        self.assertRaises(DecompressionBombError, probe_image, BytesIO(get_png(1000, 1000)), 'png')
+        node = self.create_file('bomb.png', content=get_png(1000, 1000))
+        self.assertNotEqual(self.reload(node).media_type, media_types.SUPPORTED_IMAGE)
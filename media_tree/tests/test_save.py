@@ -0,0 +1,46 @@
+from media_tree.models import FileNode
+from media_tree.tests.base import MediaTreeTestCase
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class ChangedFieldsTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(ChangedFieldsTest, self).setUp()
+        self.folder = self.create_folder('folder')
+        self.node = self.create_file('first.txt', self.folder)
+
+    def get_updates(self, queries):
+        return [query['sql'] for query in queries if 'UPDATE ' in query['sql']]
+
+    def test_changed_fields(self):
+        node = self.reload(self.node)
+        self.assertEqual(node.get_changed_fields(), ['modified'])
+        node.title = 'First'
+        self.assertEqual(node.get_changed_fields(), ['title', 'modified'])
+        node.save()
+        self.assertEqual(node.get_changed_fields(), ['modified'])
+
+    def test_save_changed_fields(self):
+        # Only the changed columns are written, so concurrent changes of
+        # other columns are kept
+        node = self.reload(self.node)
+        FileNode.objects.filter(pk=node.pk).update(description='Description')
+        node.title = 'First'
+        with CaptureQueriesContext(connection) as context:
+            node.save()
+        updates = self.get_updates(context.captured_queries)
+        self.assertEqual(len(updates), 1)
+        self.assertFalse('"description"' in updates[0])
+        node = self.reload(node)
+        self.assertEqual((node.title, node.description), ('First', 'Description'))
+        self.assertTreeIntegrity()
+
+    def test_save_renamed(self):
+        # Renamed nodes are moved among their siblings, so all columns are written
+        node = self.reload(self.node)
+        node.name = 'renamed.txt'
+        node.save()
+        self.assertEqual(self.reload(node).path, 'folder/renamed.txt')
+        self.assertTreeIntegrity()
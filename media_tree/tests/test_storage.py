@@ -0,0 +1,82 @@
+from media_tree import settings as app_settings
+from media_tree.models import FileNode
+from media_tree.tests.base import MediaTreeTestCase
+from media_tree.utils import get_media_storage
+from media_tree.utils.storage import get_storage_path
+from django.core.files.storage import Storage, FileSystemStorage
+from django.test import TestCase
+import threading
+
+
+class ContentAddressedStorageTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(ContentAddressedStorageTest, self).setUp()
+        self.original_content_addressed = app_settings.MEDIA_TREE_CONTENT_ADDRESSED_STORAGE
+        app_settings.MEDIA_TREE_CONTENT_ADDRESSED_STORAGE = True
+        self.folder = self.create_folder('folder')
+        self.subfolder = self.create_folder('subfolder', self.folder)
+        self.first = self.create_file('first.txt', self.subfolder, content=b'first')
+        self.second = self.create_file('second.txt', self.subfolder, content=b'second')
+        self.shared = self.create_file('shared.txt', content=b'second')
+
+    def tearDown(self):
+        app_settings.MEDIA_TREE_CONTENT_ADDRESSED_STORAGE = self.original_content_addressed
+        super(ContentAddressedStorageTest, self).tearDown()
+
+    def test_identical_files(self):
+        self.assertEqual(self.second.file.name, self.shared.file.name)
+        self.assertNotEqual(self.first.file.name, self.second.file.name)
+
+    def test_delete_file(self):
+        self.reload(self.second).delete()
+        self.assertTrue(self.storage.exists(self.shared.file.name))
+        self.reload(self.shared).delete()
+        self.assertFalse(self.storage.exists(self.shared.file.name))
+
+    def test_delete_folder(self):
+        # Files of descendants are released as well
+        self.reload(self.folder).delete()
+        self.assertFalse(self.storage.exists(self.first.file.name))
+        self.assertTrue(self.storage.exists(self.shared.file.name))
+        self.assertEqual(list(FileNode.objects.all()), [self.shared])
+        self.assertTreeIntegrity()
+
+
+class OtherStorage(FileSystemStorage):
+    pass
+
+
+class MediaStorageTest(TestCase):
+
+    def test_shared(self):
+        storages = []
+        threads = [threading.Thread(target=lambda: storages.append(get_media_storage())) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        storages.append(get_media_storage())
+        self.assertEqual(len(set([id(storage) for storage in storages])), 1)
+
+    def test_setting(self):
+        # Each configured storage class is instantiated once
+        self.assertTrue(get_media_storage() is FileNode.STORAGE)
+        original_storage = app_settings.MEDIA_TREE_STORAGE
+        app_settings.MEDIA_TREE_STORAGE = 'media_tree.tests.test_storage.OtherStorage'
+        try:
+            storage = get_media_storage()
+            self.assertTrue(isinstance(storage, OtherStorage))
+            self.assertTrue(get_media_storage() is storage)
+        finally:
+            app_settings.MEDIA_TREE_STORAGE = original_storage
+        self.assertTrue(get_media_storage() is FileNode.STORAGE)
+
+class StoragePathTest(MediaTreeTestCase):
+
+    def test_local_storage(self):
+        self.assertEqual(get_storage_path(self.storage, 'upload/first.txt'), self.storage.path('upload/first.txt'))
+
+    def test_remote_storage(self):
+        # Storages that do not store files locally do not implement path()
+        self.assertEqual(get_storage_path(Storage(), 'upload/first.txt'), 'upload/first.txt')
@@ -0,0 +1,60 @@
+from media_tree.media_backends import ThumbnailError
+from media_tree.models import CachedThumbnail
+from media_tree.tests.base import MediaTreeTestCase
+from media_tree.utils.thumbnails import get_source_version, get_options_hash, get_thumbnails
+
+
+class Thumbnail(object):
+
+    def __init__(self, source):
+        self.url = '/thumbnails/%s' % source.name
+        self.width, self.height = (100, 100)
+
+
+class ThumbnailBackend(object):
+    """
+    Creates thumbnails of all files except those named ``broken``.
+    """
+
+    @staticmethod
+    def get_thumbnail(source, options):
+        if 'broken' in source.name:
+            raise ThumbnailError('Cannot read %s' % source.name)
+        return Thumbnail(source)
+
+
+class SourceVersionTest(MediaTreeTestCase):
+
+    def test_file_version(self):
+        node = self.create_file('first.txt')
+        version = get_source_version(self.reload(node).file)
+        self.assertEqual(version, node.sha256)
+        # Changing metadata does not invalidate thumbnails of the file
+        node = self.reload(node)
+        node.title = 'First'
+        node.save()
+        self.assertEqual(get_source_version(self.reload(node).file), version)
+
+    def test_preview_file_version(self):
+        # Preview files are identified by their storage name, so the storage is not accessed
+        node = self.create_file('first.txt')
+        node.preview_file = self.create_file('preview.txt').file.name
+        node.save()
+        self.assertEqual(get_source_version(self.reload(node).preview_file), '')
+
+    def test_options_hash(self):
+        self.assertEqual(get_options_hash({'size': (100, 100)}), get_options_hash({'size': [100, 100]}))
+        self.assertNotEqual(get_options_hash({'size': (100, 100)}), get_options_hash({'size': (100, 50)}))
+
+
+class GetThumbnailsTest(MediaTreeTestCase):
+
+    def test_broken_source(self):
+        # A gallery with a broken image still displays the other thumbnails
+        nodes = [self.create_file(name) for name in ('first.txt', 'broken.txt', 'second.txt')]
+        thumbnails = get_thumbnails([node.file for node in nodes], {'size': (100, 100)}, ThumbnailBackend)
+        first, broken, second = [node.file.name for node in nodes]
+        self.assertEqual([getattr(thumbnail, 'url', None) for thumbnail in thumbnails],
+            ['/thumbnails/%s' % first, None, '/thumbnails/%s' % second])
+        self.assertEqual(sorted(CachedThumbnail.objects.values_list('source_name', flat=True)),
+            sorted([first, second]))
@@ -0,0 +1,128 @@
+from media_tree.models import FileNode
+from media_tree.tests.base import MediaTreeTestCase
+from media_tree.contrib.media_extensions.zipfiles import settings as zipfiles_settings
+from media_tree.contrib.media_extensions.zipfiles.archive_cache import iter_archive
+from media_tree.contrib.media_extensions.zipfiles.zip_operations import extract_archive, ArchiveTooLargeError,  \
+    ZipStream, compress_nodes
+import os
+import shutil
+import tempfile
+import zipfile
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+class ZipStreamTest(MediaTreeTestCase):
+
+    def test_stream(self):
+        stream = ZipStream(chunk_size=7)
+        buf = BytesIO()
+        for name, content, compress in (('first.txt', b'a' * 100, True),
+                ('folder/second.jpg', b'b' * 30, False), ('empty.txt', b'', True)):
+            for chunk in stream.add_file(name, BytesIO(content), size=len(content), compress=compress):
+                buf.write(chunk)
+        for chunk in stream.close():
+            buf.write(chunk)
+        archive = zipfile.ZipFile(BytesIO(buf.getvalue()))
+        self.assertEqual(archive.testzip(), None)
+        self.assertEqual(archive.namelist(), ['first.txt', 'folder/second.jpg', 'empty.txt'])
+        self.assertEqual(archive.read('first.txt'), b'a' * 100)
+        self.assertEqual(archive.getinfo('folder/second.jpg').compress_type, zipfile.ZIP_STORED)
+
+    def test_zip64_member(self):
+        # Members of unknown size use ZIP64 data descriptors
+        stream = ZipStream()
+        data = b''.join(stream.add_file('first.txt', BytesIO(b'a' * 10)))
+        data += b''.join(stream.close())
+        self.assertEqual(zipfile.ZipFile(BytesIO(data)).read('first.txt'), b'a' * 10)
+
+    def test_compress_nodes(self):
+        folder = self.create_folder('folder')
+        self.create_file('first.txt', folder, content=b'first')
+        self.create_file('second.txt', self.create_folder('subfolder', folder), content=b'second')
+        buf = BytesIO()
+        compress_nodes(buf, [self.reload(folder)])
+        archive = zipfile.ZipFile(BytesIO(buf.getvalue()))
+        self.assertEqual(sorted(archive.namelist()), ['folder/first.txt', 'folder/subfolder/second.txt'])
+        self.assertEqual(archive.read('folder/subfolder/second.txt'), b'second')
+
+
+class ArchiveCacheTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(ArchiveCacheTest, self).setUp()
+        self.original_cache_root = zipfiles_settings.MEDIA_TREE_ZIPFILES_CACHE_ROOT
+        self.cache_root = zipfiles_settings.MEDIA_TREE_ZIPFILES_CACHE_ROOT = tempfile.mkdtemp()
+        self.folder = self.create_folder('folder')
+        self.create_file('first.txt', self.folder, content=b'first')
+
+    def tearDown(self):
+        zipfiles_settings.MEDIA_TREE_ZIPFILES_CACHE_ROOT = self.original_cache_root
+        shutil.rmtree(self.cache_root)
+        super(ArchiveCacheTest, self).tearDown()
+
+    def test_cached_archive(self):
+        chunks, size = iter_archive([self.reload(self.folder)])
+        data = b''.join(chunks)
+        self.assertEqual(size, None)
+        chunks, size = iter_archive([self.reload(self.folder)])
+        self.assertEqual(b''.join(chunks), data)
+        self.assertEqual(size, len(data))
+        # Archives may contain unpublished files, so they are not cached in the public media storage
+        self.assertEqual(len(os.listdir(self.cache_root)), 1)
+        for root, dirs, files in os.walk(self.media_root):
+            self.assertEqual([name for name in files if name.endswith('.zip')], [])
+
+
+class ExtractArchiveTest(MediaTreeTestCase):
+
+    def setUp(self):
+        super(ExtractArchiveTest, self).setUp()
+        self.original_limits = (zipfiles_settings.MEDIA_TREE_ZIPFILES_EXTRACT_MAX_BYTES,
+            zipfiles_settings.MEDIA_TREE_ZIPFILES_EXTRACT_MAX_ENTRIES)
+        self.target = self.create_folder('target')
+
+    def tearDown(self):
+        (zipfiles_settings.MEDIA_TREE_ZIPFILES_EXTRACT_MAX_BYTES,
+            zipfiles_settings.MEDIA_TREE_ZIPFILES_EXTRACT_MAX_ENTRIES) = self.original_limits
+        super(ExtractArchiveTest, self).tearDown()
+
+    def create_archive(self, entries):
+        buf = BytesIO()
+        archive = zipfile.ZipFile(buf, 'w')
+        for name, content in entries:
+            archive.writestr(name, content)
+        archive.close()
+        return self.create_file('archive.zip', content=buf.getvalue())
+
+    def get_stored_files(self):
+        stored = []
+        for root, dirs, files in os.walk(self.media_root):
+            stored.extend([os.path.join(root, name) for name in files])
+        return sorted(stored)
+
+    def test_extract(self):
+        archive = self.create_archive([('folder/first.txt', b'a' * 10),
+            ('second.txt', b'b' * 20), ('../outside.txt', b'c')])
+        nodes = extract_archive(archive, self.target)
+        self.assertEqual(sorted([node.name for node in nodes]), ['first.txt', 'folder', 'second.txt'])
+        self.assertEqual(FileNode.objects.get(path='target/folder/first.txt').size, 10)
+        self.assertEqual(self.reload(self.target).get_aggregates(), (30, 2, 0))
+        self.assertTreeIntegrity()
+
+    def test_max_bytes(self):
+        zipfiles_settings.MEDIA_TREE_ZIPFILES_EXTRACT_MAX_BYTES = 25
+        archive = self.create_archive([('first.txt', b'a' * 10), ('second.txt', b'b' * 20)])
+        stored = self.get_stored_files()
+        count = FileNode.objects.count()
+        self.assertRaises(ArchiveTooLargeError, extract_archive, archive, self.target)
+        self.assertEqual(FileNode.objects.count(), count)
+        self.assertEqual(self.get_stored_files(), stored)
+
+    def test_max_entries(self):
+        zipfiles_settings.MEDIA_TREE_ZIPFILES_EXTRACT_MAX_ENTRIES = 1
+        archive = self.create_archive([('first.txt', b'a'), ('second.txt', b'b')])
+        self.assertRaises(ArchiveTooLargeError, extract_archive, archive, self.target)
+        self.assertEqual(self.reload(self.target).get_descendant_count(), 0)
@@ -4,19 +4,55 @@ from django.utils.importlib import import_module
 from django.core.exceptions import ImproperlyConfigured
 from django.core.files.storage import get_storage_class
 from django.utils.html import conditional_escape
+from django.test.signals import setting_changed
 import re
+import threading
 
 
 RE_SPLITEXT = re.compile('^(\.*.*?)((\.[^\.]+)*|\.)$')
 
 
+__storages = {}
+__storages_lock = threading.Lock()
+
 def get_media_storage():
-    klass = get_storage_class(import_path=app_settings.MEDIA_TREE_STORAGE)
-    return klass()
+    """
+    Returns the storage configured by ``MEDIA_TREE_STORAGE``, or Django's
+    default storage. The storage is only instantiated once and shared by all
+    threads of the process, so that storages maintaining connections or
+    clients do not need to set them up again for every operation.
+    """
+    import_path = app_settings.MEDIA_TREE_STORAGE
+    try:
+        return __storages[import_path]
+    except KeyError:
+        with __storages_lock:
+            if not import_path in __storages:
+                klass = get_storage_class(import_path=import_path)
+                __storages[import_path] = klass()
+            return __storages[import_path]
+
+
+def reset_media_storages(**kwargs):
+    """
+    Discards the shared storage instances returned by :func:`get_media_storage`.
+    This is also called whenever a setting is changed using ``override_settings``.
+    """
+    with __storages_lock:
+        __storages.clear()
+
+setting_changed.connect(reset_media_storages)
+
 
+__module_attrs = {}
 
-# TODO: This function should probably cache all imported modules
 def get_module_attr(path):
+    """
+    Imports the module and returns the attribute specified by the dotted
+    ``path``. The result is cached, so that the module is only imported once.
+    """
+    if path in __module_attrs:
+        return __module_attrs[path]
     i = path.rfind('.')
     module_name, attr_name = path[:i], path[i+1:]
     try:
@@ -27,6 +63,7 @@ def get_module_attr(path):
         attr = getattr(module, attr_name)
     except AttributeError:
         raise ImproperlyConfigured('Module "%s" does not define a "%s" callable' % (module_name, attr_name))
+    __module_attrs[path] = attr
     return attr
 
 
@@ -52,6 +89,36 @@ def autodiscover_media_extensions():
                 raise
 
 
+def get_unique_numbered_name(current_name, name, ext, names):
+    """
+    Returns ``current_name`` if it is not contained in ``names``, or otherwise
+    the first name formatted using ``MEDIA_TREE_NAME_UNIQUE_NUMBERED_FORMAT``
+    with ``name``, ``ext`` and a number starting at 2 that is not contained in
+    ``names``. Names are compared case-insensitively, as they are by the unique
+    index on MySQL with its default collation, so ``names`` must contain
+    lowercased names.
+    """
+    number = 1
+    while current_name.lower() in names:
+        number += 1
+        current_name = app_settings.MEDIA_TREE_NAME_UNIQUE_NUMBERED_FORMAT % {
+            'name': name, 'number': number, 'ext': ext}
+    return current_name
+
+
+def get_numbered_name_prefix(name, ext):
+    """
+    Returns the part of the names formatted using
+    ``MEDIA_TREE_NAME_UNIQUE_NUMBERED_FORMAT`` that precedes the number, which
+    all names that may conflict with a numbered name start with.
+    """
+    format = app_settings.MEDIA_TREE_NAME_UNIQUE_NUMBERED_FORMAT
+    index = format.find('%(number)')
+    if index == -1:
+        return ''
+    return format[:index] % {'name': name, 'ext': ext}
+
+
 def multi_splitext(basename):
     """
     Similar to os.path.slittext(), but with special handling for files with multiple extensions,
@@ -0,0 +1,763 @@
+"""
+Utilities for creating, moving, copying and changing many nodes at once.
+
+Saving nodes one by one is slow when many nodes are created, since every
+``save()`` determines a unique name, opens images and makes room in the tree by updating the ``lft`` and ``rght`` values
+of all following nodes. :func:`insert_node_trees` instead computes the tree
+fields of all new nodes in memory and inserts them with one ``INSERT`` per
+batch and tree level, after making room for all of them at once. Likewise,
+:func:`move_node_trees` moves many subtrees with a constant number of
+``UPDATE`` statements, :func:`copy_node_trees` copies them using
+:func:`insert_node_trees`, and :func:`update_metadata` changes the metadata
+of many nodes with a single ``UPDATE`` statement.
+"""
+from media_tree import settings as app_settings
+from media_tree.utils import multi_splitext, get_unique_numbered_name
+from media_tree.utils.db import atomic, quote_name, get_concat_sql, get_char_length_sql, execute_sql
+from media_tree.utils.probe import probe_image
+from media_tree.utils.storage import copy_file, delete_stored_files
+from media_tree.utils.thumbnails import pregenerate_thumbnails
+from mptt.exceptions import InvalidMove
+from django.db import connection
+from django.db.models import FileField
+from django.template.defaultfilters import slugify
+from django.utils import timezone
+from django.utils.translation import ugettext as _
+from multiprocessing.pool import ThreadPool
+from collections import namedtuple
+import bisect
+import os
+import posixpath
+
+BULK_BATCH_SIZE = 500
+
+__SubtreeMove = namedtuple('SubtreeMove', ('node', 'old_tree_id', 'old_left', 'old_right',
+    'offset', 'level_offset', 'temp_tree_id', 'new_tree_id', 'old_path'))
+
+
+def get_unique_name(node, names):
+    """
+    Returns the name of ``node``, numbered using
+    ``MEDIA_TREE_NAME_UNIQUE_NUMBERED_FORMAT`` if it is contained in the set
+    of lowercased ``names``, and adds the returned name to the set.
+    """
+    from media_tree.models import FileNode
+    if node.node_type == FileNode.FOLDER:
+        base, ext = node.name, ''
+    else:
+        split = multi_splitext(node.name)
+        base, ext = split[0], split[1]
+    name = get_unique_numbered_name(node.name, base, ext, names)
+    names.add(name.lower())
+    return name
+
+
+def probe_file(node):
+    """
+    Determines the media type and dimensions of a file node whose file was
+    already stored, the same way ``FileNode.save()`` does, and returns the
+    node. This does not access the database, so it can run in any thread.
+    """
+    from media_tree.models import FileNode
+    node.media_type = None
+    node.width, node.height = (None, None)
+    try:
+        node.pre_save_image()
+    except IOError:
+        pass
+    finally:
+        node.file.close()
+    if not node.media_type:
+        node.media_type = FileNode.mimetype_to_media_type(node.name)
+    return node
+
+
+def probe_path(path):
+    """
+    Determines the size, extension, media type and dimensions of a local file
+    the same way ``FileNode.save()`` does, and returns them as a tuple. Only
+    the header of images is read. This does not access the database, so it
+    can run in worker processes.
+    """
+    from media_tree.models import FileNode
+    name = os.path.basename(path)
+    extension = multi_splitext(name)[2].lstrip('.').lower()
+    media_type, width, height = (None, None, None)
+    fileobj = open(path, 'rb')
+    try:
+        media_type, width, height = probe_image(fileobj, extension)
+    except IOError:
+        pass
+    finally:
+        fileobj.close()
+    if not media_type:
+        media_type = FileNode.mimetype_to_media_type(name)
+    return (os.path.getsize(path), extension, media_type, width, height)
+
+
+def probe_files(nodes, threads=None):
+    """
+    Runs :func:`probe_file` for all ``nodes`` in a pool of
+    ``MEDIA_TREE_PROBE_THREADS`` threads.
+    """
+    nodes = list(nodes)
+    threads = min(len(nodes), threads or app_settings.MEDIA_TREE_PROBE_THREADS)
+    if threads <= 1:
+        return [probe_file(node) for node in nodes]
+    pool = ThreadPool(threads)
+    try:
+        return pool.map(probe_file, nodes)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def __layout_trees(trees, parent, parent_path, left, level, tree_id, names, levels):
+    """
+    Assigns names, paths, tree fields and aggregates to the nodes in ``trees``,
+    which are placed as consecutive siblings starting at ``left``. Appends a
+    ``(node, parent)`` tuple for every node to ``levels[level]``. Returns the
+    next free ``lft`` value and the sum of the aggregates of the nodes.
+    """
+    from media_tree.models import FileNode, get_child_path
+    opts = FileNode._mptt_meta
+    for node, children in trees:
+        node.name = get_unique_name(node, names)
+    aggregates = [0, 0, 0]
+    for node, children in sorted(trees, key=lambda tree: tree[0].name):
+        node.path = get_child_path(parent_path, node.name) if parent is not None else node.name
+        node.slug = slugify(node.name)
+        setattr(node, opts.left_attr, left)
+        setattr(node, opts.level_attr, level)
+        setattr(node, opts.tree_id_attr, tree_id)
+        levels.setdefault(level, []).append((node, parent))
+        if node.node_type == FileNode.FOLDER:
+            node.media_type = FileNode.FOLDER
+            right, node_aggregates = __layout_trees(children, node, node.path,
+                left + 1, level + 1, tree_id, set(), levels)
+            node.total_size, node.file_count, node.missing_metadata_count = node_aggregates
+            node.has_metadata = node.check_minimal_metadata() and not node.missing_metadata_count
+        else:
+            if not node.extension:
+                node.extension = multi_splitext(node.name)[2].lstrip('.').lower()
+            if not node.media_type:
+                node.media_type = FileNode.mimetype_to_media_type(node.name)
+            right = left + 1
+            node.has_metadata = node.check_minimal_metadata()
+            node.total_size, node.file_count, node.missing_metadata_count = (
+                node.size or 0, 1, 0 if node.has_metadata else 1)
+        setattr(node, opts.right_attr, right)
+        for i, value in enumerate(node.get_aggregates()):
+            aggregates[i] += value
+        left = right + 1
+    return left, aggregates
+
+
+def __count_nodes(trees):
+    return sum([1 + __count_nodes(children) for node, children in trees])
+
+
+def __get_insertion_points(siblings, names, end):
+    """
+    Returns the insertion point of a new sibling for each of ``names``, so
+    that siblings remain ordered by name (see ``order_insertion_by``).
+    ``siblings`` is a list of ``(name, position)`` tuples of the existing
+    siblings ordered by position, where the position is their ``lft`` value,
+    or their tree id for root nodes. The insertion point is the position of
+    the first sibling with a greater name, or ``end``.
+    """
+    sibling_names = [name for name, position in siblings]
+    points = []
+    for name in names:
+        index = bisect.bisect_right(sibling_names, name)
+        points.append(siblings[index][1] if index < len(siblings) else end)
+    return points
+
+
+def __allocate_positions(points, sizes):
+    """
+    Returns the positions of new siblings with the given insertion points and
+    sizes (the number of ``lft`` and ``rght`` values, or 1 for root nodes)
+    after all of them were inserted. New siblings with the same insertion
+    point are placed in the order they are passed in. Also returns a list of
+    ``(point, size)`` tuples with the total size inserted at each point,
+    ordered by point, which existing nodes at or after the point need to be
+    shifted by (see :func:`__get_insertion_shift_sql`).
+    """
+    groups = {}
+    for point, size in zip(points, sizes):
+        groups[point] = groups.get(point, 0) + size
+    shifts = sorted(groups.items())
+    offsets = {}
+    total = 0
+    for point, size in shifts:
+        offsets[point] = total
+        total += size
+    positions = []
+    for point, size in zip(points, sizes):
+        positions.append(point + offsets[point])
+        offsets[point] += size
+    return positions, shifts
+
+
+def __get_insertion_shift_sql(column, shifts, condition=''):
+    """
+    Returns an SQL expression for the number that the value of ``column`` is
+    shifted by when new siblings are inserted at the points ``shifts``
+    returned by :func:`__allocate_positions`. ``condition`` restricts the
+    shift to rows matching an SQL condition, e.g. those of a tree.
+    """
+    whens = []
+    total = sum([size for point, size in shifts])
+    for point, size in reversed(shifts):
+        whens.append('WHEN %s%s >= %d THEN %d' % (condition + ' AND ' if condition else '',
+            column, point, total))
+        total -= size
+    return 'CASE %s ELSE 0 END' % ' '.join(whens)
+
+
+def insert_node_trees(parent, trees, user=None, batch_size=BULK_BATCH_SIZE):
+    """
+    Inserts new nodes as children of ``parent``, or as new root nodes
+    if ``parent`` is ``None``. ``trees`` is a list of ``(node, children)``
+    tuples, where ``node`` is an unsaved ``FileNode`` and ``children`` is a
+    list of tuples of the same form. Files need to be stored already, and
+    their ``file``, ``size`` and, if known, ``media_type``, ``width`` and
+    ``height`` fields need to be set (see :func:`probe_files`).
+
+    Names are made unique among siblings, and the paths, tree fields and
+    aggregates of all new nodes are computed in memory. Every new subtree is
+    placed among the existing siblings in the order defined by
+    ``order_insertion_by``, and the existing nodes are shifted to make room
+    for all of them with a single ``UPDATE`` statement. The nodes are then
+    inserted level by level within a single transaction, and their primary
+    keys are assigned. Returns a list of all inserted nodes.
+    """
+    from media_tree.models import FileNode
+    opts = FileNode._mptt_meta
+    columns = dict([(name, quote_name(FileNode._meta.get_field(name).column)) for name in (
+        opts.tree_id_attr, opts.left_attr, opts.right_attr)])
+    table = quote_name(FileNode._meta.db_table)
+    levels = {}
+    with atomic():
+        if parent is not None:
+            # Reload object because tree attributes may be out of date
+            parent = FileNode.objects.get(pk=parent.pk)
+            siblings = list(FileNode.objects.filter(parent=parent).order_by(opts.left_attr).values_list(
+                'name', opts.left_attr))
+            end = getattr(parent, opts.right_attr)
+        else:
+            siblings = list(FileNode.objects.filter(parent=None).order_by(opts.tree_id_attr).values_list(
+                'name', opts.tree_id_attr))
+            end = (FileNode.objects.order_by('-%s' % opts.tree_id_attr).values_list(
+                opts.tree_id_attr, flat=True)[:1] or [0])[0] + 1
+        names = set([name.lower() for name, position in siblings])
+        for node, children in trees:
+            node.name = get_unique_name(node, names)
+        trees = sorted(trees, key=lambda tree: tree[0].name)
+        points = __get_insertion_points(siblings, [node.name for node, children in trees], end)
+
+        aggregates = [0, 0, 0]
+        if parent is not None:
+            tree_id = getattr(parent, opts.tree_id_attr)
+            positions, shifts = __allocate_positions(points, [2 * __count_nodes([tree]) for tree in trees])
+            if shifts:
+                condition = '%s = %d' % (columns[opts.tree_id_attr], tree_id)
+                execute_sql('UPDATE %s SET %s = %s + %s, %s = %s + %s WHERE %s AND %s >= %d' % (
+                    table,
+                    columns[opts.left_attr], columns[opts.left_attr],
+                    __get_insertion_shift_sql(columns[opts.left_attr], shifts, condition),
+                    columns[opts.right_attr], columns[opts.right_attr],
+                    __get_insertion_shift_sql(columns[opts.right_attr], shifts, condition),
+                    condition, columns[opts.right_attr], shifts[0][0]))
+            parent_path = parent.get_path()
+            for tree, left in zip(trees, positions):
+                # Names are unique already
+                next_left, tree_aggregates = __layout_trees([tree], parent, parent_path,
+                    left, getattr(parent, opts.level_attr) + 1, tree_id, set(), levels)
+                for i, value in enumerate(tree_aggregates):
+                    aggregates[i] += value
+        else:
+            positions, shifts = __allocate_positions(points, [1] * len(trees))
+            if shifts and shifts[0][0] < end:
+                execute_sql('UPDATE %s SET %s = %s + %s WHERE %s >= %d' % (
+                    table, columns[opts.tree_id_attr], columns[opts.tree_id_attr],
+                    __get_insertion_shift_sql(columns[opts.tree_id_attr], shifts),
+                    columns[opts.tree_id_attr], shifts[0][0]))
+            for tree, tree_id in zip(trees, positions):
+                __layout_trees([tree], None, '', 1, 0, tree_id, set(), levels)
+
+        inserted = []
+        for level in sorted(levels.keys()):
+            nodes = []
+            for node, node_parent in levels[level]:
+                node.parent_id = node_parent.pk if node_parent is not None else None
+                if user is not None:
+                    node.attach_user(user, change=False)
+                nodes.append(node)
+            FileNode.objects.bulk_create(nodes, batch_size=batch_size)
+            # Primary keys are not returned by bulk inserts, but the new nodes
+            # are identified by their position
+            positions = dict([(((getattr(node, opts.tree_id_attr), getattr(node, opts.left_attr))), node)
+                for node in nodes])
+            tree_ids = [getattr(node, opts.tree_id_attr) for node in nodes]
+            lefts = [getattr(node, opts.left_attr) for node in nodes]
+            for pk, node_tree_id, node_left in FileNode.objects.filter(**{
+                opts.level_attr: level,
+                '%s__gte' % opts.tree_id_attr: min(tree_ids),
+                '%s__lte' % opts.tree_id_attr: max(tree_ids),
+                '%s__gte' % opts.left_attr: min(lefts),
+                '%s__lte' % opts.left_attr: max(lefts),
+            }).values_list('pk', opts.tree_id_attr, opts.left_attr):
+                node = positions.get((node_tree_id, node_left))
+                if node is not None:
+                    node.pk = pk
+                    node.store_saved_values()
+            inserted.extend(nodes)
+
+        if parent is not None and inserted:
+            inserted[0].update_ancestor_aggregates(*aggregates)
+
+    if app_settings.MEDIA_TREE_PREGENERATE_THUMBNAILS:
+        for node in inserted:
+            if node.node_type == FileNode.FILE:
+                pregenerate_thumbnails(node)
+    return inserted
+
+
+def __get_top_level_nodes(nodes):
+    """
+    Reloads ``nodes``, since their tree attributes may be out of date, and
+    returns those that are not descendants of other nodes in ``nodes``,
+    ordered by their position in the tree.
+    """
+    from media_tree.models import FileNode
+    opts = FileNode._mptt_meta
+    roots = []
+    for node in FileNode.objects.filter(pk__in=[node.pk for node in nodes]).order_by(
+            opts.tree_id_attr, opts.left_attr):
+        if roots and getattr(roots[-1], opts.tree_id_attr) == getattr(node, opts.tree_id_attr)  \
+                and getattr(node, opts.left_attr) < getattr(roots[-1], opts.right_attr):
+            continue
+        roots.append(node)
+    return roots
+
+
+def move_node_trees(nodes, target, user=None, batch_size=BULK_BATCH_SIZE):
+    """
+    Moves ``nodes`` with all their descendants into the folder ``target``, or
+    to the top level if ``target`` is ``None``, placing them among the
+    existing siblings in the order defined by ``order_insertion_by``.
+    Selected nodes that are descendants of other selected nodes are moved
+    along with them, and nodes that already are children of ``target`` are
+    left untouched. Names are made unique among the new siblings.
+
+    Moving the subtrees one by one would shift the tree fields of all
+    following nodes once per subtree. Instead, the new tree fields of all
+    affected nodes are computed at once and written with a constant number
+    of ``UPDATE`` statements within a single transaction, and the paths and
+    aggregates are updated accordingly. Raises ``InvalidMove`` if ``target``
+    is one of the nodes or their descendants. Returns the top-level moved
+    nodes, ordered by name.
+    """
+    from media_tree.models import FileNode, PATH_MAX_LENGTH, get_child_path
+    opts = FileNode._mptt_meta
+    tree_id_attr, left_attr, right_attr, level_attr = (
+        opts.tree_id_attr, opts.left_attr, opts.right_attr, opts.level_attr)
+    columns = dict([(name, quote_name(FileNode._meta.get_field(name).column)) for name in (
+        'path', tree_id_attr, left_attr, right_attr, level_attr)])
+    table = quote_name(FileNode._meta.db_table)
+
+    with atomic():
+        roots = __get_top_level_nodes(nodes)
+        if target is not None:
+            # Reload object because tree attributes may be out of date
+            target = FileNode.objects.get(pk=target.pk)
+            for root in roots:
+                if getattr(root, tree_id_attr) == getattr(target, tree_id_attr)  \
+                        and getattr(root, left_attr) <= getattr(target, left_attr)  \
+                        and getattr(root, right_attr) >= getattr(target, right_attr):
+                    raise InvalidMove(_('A node may not be made a child of itself or any of its descendants.'))
+        target_pk = target.pk if target is not None else None
+        roots = [root for root in roots if root.parent_id != target_pk]
+        if not roots:
+            return []
+
+        # Subtrees with the same parent are subtracted from the same ancestors
+        parent_aggregates = {}
+        for root in roots:
+            aggregates = parent_aggregates.setdefault(root.parent_id, [root, 0, 0, 0])
+            for i, value in enumerate(root.get_aggregates()):
+                aggregates[i + 1] -= value
+        for aggregates in parent_aggregates.values():
+            aggregates[0].update_ancestor_aggregates(*aggregates[1:])
+
+        max_tree_id = FileNode.objects.order_by('-%s' % tree_id_attr).values_list(tree_id_attr, flat=True)[0]
+        if target is not None:
+            siblings = list(FileNode.objects.filter(parent=target).order_by(left_attr).values_list(
+                'name', left_attr))
+            end = getattr(target, right_attr)
+        else:
+            siblings = list(FileNode.objects.filter(parent=None).order_by(tree_id_attr).values_list(
+                'name', tree_id_attr))
+            end = max_tree_id + 1
+        names = set([name.lower() for name, position in siblings])
+        old_paths = {}
+        for root in roots:
+            old_paths[root.pk] = root.get_path()
+            root.name = get_unique_name(root, names)
+        roots.sort(key=lambda root: root.name)
+        points = __get_insertion_points(siblings, [root.name for root in roots], end)
+
+        def get_size(root):
+            return getattr(root, right_attr) - getattr(root, left_attr) + 1
+        if target is not None:
+            target_tree_id = getattr(target, tree_id_attr)
+            positions, shifts = __allocate_positions(points, [get_size(root) for root in roots])
+            parent_path = target.get_path()
+            level = getattr(target, level_attr) + 1
+        else:
+            # Existing root nodes following the insertion points are shifted
+            # by the number of new root nodes
+            positions, shifts = __allocate_positions(points, [1] * len(roots))
+
+        # Every subtree is assigned a temporary tree id, which identifies its
+        # nodes while the remaining nodes are renumbered. Temporary tree ids
+        # follow the tree ids of all trees after new trees were inserted.
+        moves = []
+        for i, root in enumerate(roots):
+            temp_tree_id = max_tree_id + len(roots) + 1 + i
+            root.slug = slugify(root.name)
+            if target is None:
+                root.path = root.name
+                new_tree_id, left, level = (positions[i], 1, 0)
+            else:
+                root.path = get_child_path(parent_path, root.name)
+                new_tree_id = target_tree_id
+                # The subtree is placed at its position after the gaps that
+                # the subtrees leave in the target's tree are closed
+                left = positions[i] - sum([get_size(other) for other in roots
+                    if getattr(other, tree_id_attr) == target_tree_id
+                        and getattr(other, right_attr) < points[i]])
+            moves.append(__SubtreeMove(root, getattr(root, tree_id_attr), getattr(root, left_attr),
+                getattr(root, right_attr), left - getattr(root, left_attr), level - getattr(root, level_attr),
+                temp_tree_id, new_tree_id, old_paths[root.pk]))
+
+        execute_sql('UPDATE %s SET %s = CASE %s ELSE %s END WHERE %s' % (
+            table, columns[tree_id_attr],
+            ' '.join(['WHEN %s = %d AND %s BETWEEN %d AND %d THEN %d' % (columns[tree_id_attr], move.old_tree_id,
+                columns[left_attr], move.old_left, move.old_right, move.temp_tree_id) for move in moves]),
+            columns[tree_id_attr],
+            ' OR '.join(['(%s = %d AND %s BETWEEN %d AND %d)' % (columns[tree_id_attr], move.old_tree_id,
+                columns[left_attr], move.old_left, move.old_right) for move in moves])))
+
+        # Close the gaps left by the subtrees and make room for them in the
+        # target's tree, or shift the tree ids of the trees following new
+        # trees. Each expression only refers to the column it assigns and the
+        # tree id, which is assigned last, since MySQL evaluates assignments
+        # from left to right.
+        def get_shift_sql(column):
+            sql = '%s - (%s)' % (column, ' + '.join(['CASE WHEN %s = %d AND %s > %d THEN %d ELSE 0 END' % (
+                columns[tree_id_attr], move.old_tree_id, column, move.old_right, move.old_right - move.old_left + 1)
+                for move in moves]))
+            if target is not None:
+                sql = '%s + %s' % (sql, __get_insertion_shift_sql(column, shifts,
+                    '%s = %d' % (columns[tree_id_attr], target_tree_id)))
+            return sql
+        tree_ids = set([move.old_tree_id for move in moves])
+        if target is not None:
+            tree_ids.add(target_tree_id)
+        sql = 'UPDATE %s SET %s = %s, %s = %s' % (
+            table, columns[left_attr], get_shift_sql(columns[left_attr]),
+            columns[right_attr], get_shift_sql(columns[right_attr]))
+        where = '%s IN (%s)' % (columns[tree_id_attr], ', '.join(['%d' % tree_id for tree_id in tree_ids]))
+        if target is None and shifts[0][0] <= max_tree_id:
+            sql = '%s, %s = %s + %s' % (sql, columns[tree_id_attr], columns[tree_id_attr],
+                __get_insertion_shift_sql(columns[tree_id_attr], shifts))
+            where = '%s OR %s BETWEEN %d AND %d' % (where, columns[tree_id_attr], shifts[0][0], max_tree_id)
+        execute_sql('%s WHERE %s' % (sql, where))
+
+        # Move the subtrees to their new position. The tree id is assigned last
+        # since the other assignments depend on it.
+        for i in range(0, len(moves), batch_size):
+            batch = moves[i:i + batch_size]
+            params = []
+            path_cases = []
+            for move in batch:
+                path_cases.append('WHEN %d THEN %s' % (move.temp_tree_id,
+                    get_concat_sql('%s', 'SUBSTR(%s, %d)' % (columns['path'], len(move.old_path) + 1))))
+                params.append(move.node.path)
+            # Paths that become too long to be stored are set to NULL
+            path_sql = 'CASE %s %s END' % (columns[tree_id_attr], ' '.join(path_cases))
+            path_sql = 'CASE WHEN %s <= %d THEN %s END' % (get_char_length_sql(path_sql), PATH_MAX_LENGTH, path_sql)
+            params = params + params
+            execute_sql('UPDATE %s SET %s = %s, %s = %s + CASE %s %s END, '
+                '%s = %s + CASE %s %s END, %s = %s + CASE %s %s END, %s = CASE %s %s END '
+                'WHERE %s BETWEEN %d AND %d' % (
+                    table,
+                    columns['path'], path_sql,
+                    columns[level_attr], columns[level_attr], columns[tree_id_attr],
+                    ' '.join(['WHEN %d THEN %d' % (move.temp_tree_id, move.level_offset) for move in batch]),
+                    columns[left_attr], columns[left_attr], columns[tree_id_attr],
+                    ' '.join(['WHEN %d THEN %d' % (move.temp_tree_id, move.offset) for move in batch]),
+                    columns[right_attr], columns[right_attr], columns[tree_id_attr],
+                    ' '.join(['WHEN %d THEN %d' % (move.temp_tree_id, move.offset) for move in batch]),
+                    columns[tree_id_attr], columns[tree_id_attr],
+                    ' '.join(['WHEN %d THEN %d' % (move.temp_tree_id, move.new_tree_id) for move in batch]),
+                    columns[tree_id_attr], batch[0].temp_tree_id, batch[-1].temp_tree_id), params)
+
+            # The name is written in the same statement as the parent, since
+            # the old name may conflict with a sibling in the target
+            modified = timezone.now()
+            changes = [('parent', target_pk), ('modified', FileNode._meta.get_field('modified').get_db_prep_save(
+                modified, connection=connection))]
+            if user is not None:
+                changes.append(('modified_by', user.pk))
+            params = [value for name, value in changes]
+            for name in ('name', 'slug'):
+                for move in batch:
+                    params.extend([move.node.pk, getattr(move.node, name)])
+            execute_sql('UPDATE %s SET %s, %s = CASE %s %s END, %s = CASE %s %s END WHERE %s IN (%s)' % (
+                table,
+                ', '.join(['%s = %%s' % quote_name(FileNode._meta.get_field(name).column) for name, value in changes]),
+                quote_name(FileNode._meta.get_field('name').column), quote_name(FileNode._meta.pk.column),
+                ' '.join(['WHEN %s THEN %s'] * len(batch)),
+                quote_name(FileNode._meta.get_field('slug').column), quote_name(FileNode._meta.pk.column),
+                ' '.join(['WHEN %s THEN %s'] * len(batch)),
+                quote_name(FileNode._meta.pk.column), ', '.join(['%s'] * len(batch))),
+                params + [move.node.pk for move in batch])
+            for move in batch:
+                move.node.modified = modified
+
+        for move in moves:
+            root = move.node
+            root.parent = target
+            setattr(root, tree_id_attr, move.new_tree_id)
+            setattr(root, left_attr, move.old_left + move.offset)
+            setattr(root, right_attr, move.old_right + move.offset)
+            setattr(root, level_attr, getattr(root, level_attr) + move.level_offset)
+            if user is not None:
+                root.modified_by = user
+            root.store_saved_values()
+
+        # Paths that were too long to be stored cannot be derived from the
+        # stored paths, but may fit now
+        ranges = ['(%s = %d AND %s BETWEEN %d AND %d)' % (columns[tree_id_attr], getattr(root, tree_id_attr),
+            columns[left_attr], getattr(root, left_attr), getattr(root, right_attr))
+            for root in roots if root.path is not None]
+        if ranges:
+            missing = list(FileNode.objects.filter(path__isnull=True).extra(
+                where=[' OR '.join(ranges)]).values_list(tree_id_attr, left_attr))
+            for root in roots:
+                if root.path is not None and [left for tree_id, left in missing
+                        if tree_id == getattr(root, tree_id_attr)
+                        and getattr(root, left_attr) < left < getattr(root, right_attr)]:
+                    root.rebuild_descendant_paths()
+
+        aggregates = [0, 0, 0]
+        for root in roots:
+            for i, value in enumerate(root.get_aggregates()):
+                aggregates[i] += value
+        # The first subtree is now a child of the target, so its ancestors
+        # include the target
+        roots[0].update_ancestor_aggregates(*aggregates)
+    return roots
+
+
+def copy_node_trees(nodes, target, user=None, batch_size=BULK_BATCH_SIZE, threads=None):
+    """
+    Copies ``nodes`` with all their descendants into the folder ``target``, or
+    to the top level if ``target`` is ``None``.
+    Selected nodes that are descendants of other selected nodes are copied
+    along with them.
+
+    Every subtree is fetched with a single query, and the copies are inserted
+    using :func:`insert_node_trees`. Files are copied beforehand using
+    :func:`~media_tree.utils.storage.copy_file`, which avoids copying their
+    contents where possible, in a pool of ``MEDIA_TREE_COPY_THREADS``
+    threads. If copying a file or inserting the nodes fails, the files that
+    were copied are deleted. Returns all inserted nodes.
+    """
+    from media_tree.models import FileNode
+    opts = FileNode._mptt_meta
+    exclude = (opts.tree_id_attr, opts.left_attr, opts.right_attr, opts.level_attr,
+        'parent', 'created', 'modified', 'created_by', 'modified_by')
+    fields = [field for field in FileNode._meta.fields
+        if not field.primary_key and not field.name in exclude]
+    trees = []
+    jobs = []
+    for root in __get_top_level_nodes(nodes):
+        children = {}
+        for node in root.get_descendants(include_self=True):
+            node_copy = FileNode(**dict([(field.attname, getattr(node, field.attname))
+                for field in fields if not isinstance(field, FileField)]))
+            for field in fields:
+                if isinstance(field, FileField) and getattr(node, field.attname):
+                    jobs.append((node_copy, field, getattr(node, field.attname).name))
+            children[node.pk] = []
+            if node.pk == root.pk:
+                trees.append((node_copy, children[node.pk]))
+            else:
+                children[node.parent_id].append((node_copy, children[node.pk]))
+
+    copies = []
+    def copy_job(job):
+        node_copy, field, name = job
+        copy_name = copy_file(field.storage, name,
+            field.generate_filename(node_copy, posixpath.basename(name)))
+        setattr(node_copy, field.attname, copy_name)
+        if copy_name != name:
+            # Content-addressed files are shared with the source instead
+            copies.append((field.storage, copy_name))
+
+    try:
+        threads = min(len(jobs), threads or app_settings.MEDIA_TREE_COPY_THREADS)
+        if threads <= 1:
+            for job in jobs:
+                copy_job(job)
+        else:
+            pool = ThreadPool(threads)
+            try:
+                pool.map(copy_job, jobs)
+            finally:
+                pool.close()
+                pool.join()
+
+        return insert_node_trees(target, trees, user, batch_size)
+    except:
+        for storage, name in copies:
+            delete_stored_files(storage, [name])
+        raise
+
+
+def update_metadata(nodes, metadata, user=None, recursive=False):
+    """
+    Sets the fields in the dict ``metadata`` to the given values for all
+    ``nodes``, and for all their descendants if ``recursive`` is ``True``.
+    This is done with a single ``UPDATE`` statement, which is scoped to the
+    tree ranges of the top-level nodes and also recomputes ``has_metadata``
+    and sets ``modified`` and ``modified_by``. Only if this changes which
+    files have metadata, the aggregates of the affected folders and their
+    ancestors are updated afterwards. Tree fields cannot be changed. Returns
+    the number of nodes whose values changed.
+    """
+    from media_tree.models import FileNode
+    opts = FileNode._mptt_meta
+    def column(name):
+        return quote_name(FileNode._meta.get_field(name).column)
+
+    values = dict(metadata)
+    values['modified'] = timezone.now()
+    if user is not None:
+        values['modified_by'] = user.pk
+    assignments = []
+    params = []
+    for name, value in values.items():
+        field = FileNode._meta.get_field(name)
+        assignments.append('%s = %%s' % column(name))
+        params.append(field.get_db_prep_save(value, connection=connection))
+
+    # All nodes are updated, but only those whose values differ are counted
+    differs = []
+    differs_params = []
+    for name, value in metadata.items():
+        field = FileNode._meta.get_field(name)
+        if value is None:
+            differs.append('%s IS NOT NULL' % column(name))
+        else:
+            differs.append('(%s IS NULL OR %s <> %%s)' % (column(name), column(name)))
+            differs_params.append(field.get_db_prep_save(value, connection=connection))
+
+    # Columns that are assigned are not referenced, but their new values are
+    # taken into account, since only MySQL evaluates expressions using the
+    # assigned values
+    metadata_fields = ('title', 'description', 'override_alt', 'override_caption')
+    update_has_metadata = [name for name in metadata_fields if name in metadata]
+    if update_has_metadata:
+        if [name for name in update_has_metadata if metadata[name] != '']:
+            condition = None
+        else:
+            conditions = ["(%s IS NULL OR %s <> '')" % (column(name), column(name))
+                for name in metadata_fields if not name in metadata]
+            if app_settings.MEDIA_TREE_METADATA_LESS_MEDIA_TYPES:
+                conditions.insert(0, "(%s IN (%s) AND (%s IS NULL OR %s <> ''))" % (
+                    column('media_type'), ', '.join(['%d' % media_type
+                        for media_type in app_settings.MEDIA_TREE_METADATA_LESS_MEDIA_TYPES]),
+                    column('name'), column('name')))
+            condition = ' OR '.join(conditions) or '1 = 0'
+        folder_condition = '%s <> %d OR %s = 0' % (
+            column('node_type'), FileNode.FOLDER, column('missing_metadata_count'))
+        if condition:
+            has_metadata_sql = '(%s) AND (%s)' % (condition, folder_condition)
+        else:
+            has_metadata_sql = folder_condition
+        assignments.append('%s = CASE WHEN %s THEN %%s ELSE %%s END' % (column('has_metadata'), has_metadata_sql))
+        params.extend((True, False))
+        # The has_metadata flag of folders depends on this column, so it is assigned afterwards
+        assignments.append('%s = CASE WHEN %s = %d THEN %s ELSE %s END' % (
+            column('missing_metadata_count'), column('node_type'), FileNode.FOLDER,
+            column('missing_metadata_count'), '0' if not condition else 'CASE WHEN %s THEN 0 ELSE 1 END' % condition))
+
+    with atomic():
+        if recursive:
+            roots = __get_top_level_nodes(nodes)
+            where = ' OR '.join(['(%s = %d AND %s BETWEEN %d AND %d)' % (
+                column(opts.tree_id_attr), getattr(root, opts.tree_id_attr), column(opts.left_attr),
+                getattr(root, opts.left_attr), getattr(root, opts.right_attr)) for root in roots])
+        else:
+            # Reload objects because aggregates may be out of date
+            roots = list(FileNode.objects.filter(pk__in=[node.pk for node in nodes]))
+            where = '%s IN (%s)' % (column(FileNode._meta.pk.name), ', '.join(['%d' % root.pk for root in roots]))
+        if not roots:
+            return 0
+        if differs:
+            changed_count = FileNode.objects.extra(where=['(%s) AND (%s)' % (where, ' OR '.join(differs))],
+                params=differs_params).count()
+        else:
+            changed_count = 0
+        execute_sql('UPDATE %s SET %s WHERE %s' % (
+            quote_name(FileNode._meta.db_table), ', '.join(assignments), where), params)
+        if not update_has_metadata:
+            return changed_count
+
+        # Count the files without metadata in the updated subtrees
+        rows = FileNode.objects.extra(where=[where]).order_by(opts.tree_id_attr, opts.left_attr).values_list(
+            'pk', 'node_type', opts.tree_id_attr, opts.right_attr, 'missing_metadata_count')
+        counts = {}
+        changed_folders = {}
+        if recursive:
+            stack = []
+            def close_folder():
+                pk, tree_id, right, stored, computed = stack.pop()
+                counts[pk] = computed[0]
+                if stack:
+                    stack[-1][4][0] += computed[0]
+                if computed[0] != stored:
+                    changed_folders.setdefault(computed[0], []).append(pk)
+            for pk, node_type, tree_id, right, missing_metadata_count in rows.iterator():
+                while stack and (stack[-1][1] != tree_id or stack[-1][2] < right):
+                    close_folder()
+                if node_type == FileNode.FOLDER:
+                    stack.append((pk, tree_id, right, missing_metadata_count, [0]))
+                else:
+                    counts[pk] = missing_metadata_count
+                    if stack:
+                        stack[-1][4][0] += missing_metadata_count
+            while stack:
+                close_folder()
+        else:
+            for row in rows:
+                counts[row[0]] = row[4]
+        for count, pks in changed_folders.items():
+            for i in range(0, len(pks), BULK_BATCH_SIZE):
+                FileNode.objects.filter(pk__in=pks[i:i + BULK_BATCH_SIZE]).update(
+                    missing_metadata_count=count, has_metadata=count == 0)
+
+        # Nodes with the same parent have the same ancestors
+        parent_deltas = {}
+        for root in roots:
+            delta = parent_deltas.setdefault(root.parent_id, [root, 0])
+            delta[1] += counts[root.pk] - root.missing_metadata_count
+        for root, delta in parent_deltas.values():
+            root.update_ancestor_aggregates(missing_metadata_count=delta)
+    return changed_count
@@ -0,0 +1,108 @@
+import django
+from django.db import connection, connections, transaction
+from django.db.models import BooleanField
+
+try:
+    # Django >= 1.6
+    from django.db.transaction import atomic
+except ImportError:
+    from django.db.transaction import commit_on_success as atomic
+
+
+def quote_name(name):
+    return connection.ops.quote_name(name)
+
+
+def get_concat_sql(*expressions):
+    """
+    Returns an SQL expression concatenating the given SQL expressions, since
+    MySQL does not support the ``||`` operator.
+    """
+    if connection.vendor == 'mysql':
+        return 'CONCAT(%s)' % ', '.join(expressions)
+    return ' || '.join(expressions)
+
+
+def get_char_length_sql(expression):
+    """
+    Returns an SQL expression for the number of characters of the given SQL
+    expression, since ``LENGTH()`` returns the number of bytes on MySQL.
+    """
+    if connection.vendor == 'mysql':
+        return 'CHAR_LENGTH(%s)' % expression
+    return 'LENGTH(%s)' % expression
+
+
+def execute_sql(sql, params=None):
+    """
+    Executes a raw SQL statement that modifies data and returns the number of
+    affected rows. On Django versions prior to 1.6, the statement is committed
+    unless a transaction is being managed.
+    """
+    cursor = connection.cursor()
+    cursor.execute(sql, params or ())
+    if django.VERSION < (1, 6):
+        transaction.commit_unless_managed()
+    return cursor.rowcount
+
+
+def on_commit(func):
+    """
+    Calls ``func`` once the current transaction is committed, or immediately
+    if no transaction is active. Django versions prior to 1.9 cannot defer
+    the call, so ``func`` is always called immediately.
+    """
+    if hasattr(transaction, 'on_commit'):
+        transaction.on_commit(func)
+    else:
+        func()
+
+
+def discard_connections():
+    """
+    Discards all database connections without closing them. This is used as
+    initializer of forked worker processes, which must not use the connections
+    of the parent process. Closing them would terminate the parent's
+    connections as well.
+    """
+    for connection in connections.all():
+        connection.connection = None
+
+
+def get_common_values(queryset, fields):
+    """
+    Returns a dict mapping the names of ``fields`` to the value that all
+    objects in ``queryset`` have in common, or to ``None`` if their values
+    differ. The values are determined with a single aggregate query, using
+    ``COUNT(DISTINCT ...)`` and ``MIN(...)`` for each field, so that the
+    objects do not need to be loaded.
+    """
+    table = quote_name(queryset.model._meta.db_table)
+    select = {'total_count': 'COUNT(*)'}
+    for i, field in enumerate(fields):
+        column = '%s.%s' % (table, quote_name(field.column))
+        select['count_%i' % i] = 'COUNT(%s)' % column
+        select['distinct_count_%i' % i] = 'COUNT(DISTINCT %s)' % column
+        if isinstance(field, BooleanField):
+            # PostgreSQL does not support MIN() for boolean columns
+            select['min_%i' % i] = 'MIN(CASE WHEN %s THEN 1 ELSE 0 END)' % column
+        else:
+            select['min_%i' % i] = 'MIN(%s)' % column
+    # Empty querysets do not execute a query, so no row may be returned
+    rows = list(queryset.order_by().extra(select=select).values(*select.keys()))
+    row = rows[0] if rows else {'total_count': 0}
+
+    values = {}
+    for i, field in enumerate(fields):
+        value = None
+        # NULL values are not counted, so all values are equal if there is a
+        # single distinct value and no NULL value
+        if row['total_count'] and row['distinct_count_%i' % i] == 1  \
+                and row['count_%i' % i] == row['total_count']:
+            value = row['min_%i' % i]
+            if isinstance(field, BooleanField):
+                value = bool(value)
+            else:
+                value = field.to_python(value)
+        values[field.name] = value
+    return values
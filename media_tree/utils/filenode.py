@@ -7,35 +7,112 @@ except ImportError:
 from django.utils.safestring import mark_safe
 from django.db import models
 from copy import copy
+import itertools
 
-# TODO: There may be some benefits in this function returning a lazily evaluated object, like QuerySets:
-#    https://docs.djangoproject.com/en/dev/ref/models/querysets/#when-querysets-are-evaluated
+LIST_OPEN = 'open'
+""" Marker yielded by :func:`iter_filenode_list` before the child nodes of a folder. """
 
-def __get_filenode_list(nodes, filter_media_types=None, exclude_media_types=None, filter=None, ordering=None, processors=None, list_method='append', max_depth=None, max_nodes=None, _depth=1, _node_count=0):
+LIST_CLOSE = 'close'
+""" Marker yielded by :func:`iter_filenode_list` after the child nodes of a folder. """
+
+ITER_CHUNK_SIZE = 100
+
+def __filter_nodes(nodes, filter_media_types=None, exclude_media_types=None, filter=None):
+    if filter_media_types:
+        nodes = nodes.filter(media_type__in=tuple(filter_media_types)+(media_types.FOLDER,))
+    if exclude_media_types:
+        for exclude_media_type in exclude_media_types:
+            if exclude_media_type != media_types.FOLDER:
+                nodes = nodes.exclude(media_type__exact=exclude_media_type)
+    if filter:
+        nodes = nodes.filter(**filter)
+    return nodes
+
+def __get_ordering_value(node, field_name):
+    value = node
+    for attr in field_name.split('__'):
+        value = getattr(value, attr, None)
+    # None values cannot be compared to other values in Python 3
+    return (value is not None, value)
+
+def __sort_nodes(nodes, ordering):
+    # Sorting is stable, so sorting by each field in reverse order results in
+    # the same order as SQL's ORDER BY
+    for field_name in reversed(ordering):
+        if field_name == '?':
+            continue
+        reverse = field_name.startswith('-')
+        field_name = field_name.lstrip('-')
+        nodes.sort(key=lambda node: __get_ordering_value(node, field_name), reverse=reverse)
+
+def __get_children_by_parent(nodes, filter_media_types=None, exclude_media_types=None, filter=None, ordering=None, max_depth=None):
+    """
+    Fetches the descendants of all folders in ``nodes`` using a single
+    ``tree_id``/``lft``/``rght`` range query, and returns them as a dictionary
+    of lists of child nodes, keyed by the pk of their parent.
+    """
+    children = {}
+    if max_depth is not None and max_depth <= 1:
+        return children
+
+    subtrees = None
+    model = None
+    for node in nodes:
+        if node.node_type != media_types.FOLDER or not node.get_descendant_count() > 0:
+            continue
+        model = node.__class__
+        opts = node._mptt_meta
+        subtree = models.Q(**{
+            opts.tree_id_attr: getattr(node, opts.tree_id_attr),
+            '%s__gt' % opts.left_attr: getattr(node, opts.left_attr),
+            '%s__lt' % opts.right_attr: getattr(node, opts.right_attr),
+        })
+        if max_depth is not None:
+            subtree &= models.Q(**{'%s__lt' % opts.level_attr:
+                getattr(node, opts.level_attr) + max_depth})
+        subtrees = subtree if subtrees is None else subtrees | subtree
+
+    if subtrees is None:
+        return children
+
+    opts = model._mptt_meta
+    descendants = __filter_nodes(model._default_manager.filter(subtrees),
+        filter_media_types=filter_media_types, exclude_media_types=exclude_media_types,
+        filter=filter).order_by(opts.tree_id_attr, opts.left_attr)
+    for node in descendants:
+        children.setdefault(node.parent_id, []).append(node)
+    if ordering:
+        for child_nodes in children.values():
+            __sort_nodes(child_nodes, ordering)
+    return children
+
+def __get_filenode_list(nodes, filter_media_types=None, exclude_media_types=None, filter=None, ordering=None, processors=None, list_method='append', max_depth=None, max_nodes=None, _depth=1, _node_count=0, _children=None):
 
     if isinstance(nodes, models.query.QuerySet):
         # pre-filter() and exclude() on QuerySet for fewer iterations
-        if filter_media_types:
-            nodes = nodes.filter(media_type__in=tuple(filter_media_types)+(media_types.FOLDER,))
-        if exclude_media_types:
-            for exclude_media_type in exclude_media_types:
-                if exclude_media_type != media_types.FOLDER:
-                    nodes = nodes.exclude(media_type__exact=exclude_media_type)
-        if filter:
-            nodes = nodes.filter(**filter)
+        nodes = __filter_nodes(nodes, filter_media_types=filter_media_types,
+            exclude_media_types=exclude_media_types, filter=filter)
         if ordering:
             nodes = nodes.order_by(*ordering)
 
+    if _children is None:
+        # Load all descendants at once instead of querying the children of
+        # each folder while recursing
+        nodes = list(nodes)
+        _children = __get_children_by_parent(nodes, filter_media_types=filter_media_types,
+            exclude_media_types=exclude_media_types, filter=filter, ordering=ordering,
+            max_depth=max_depth)
+
     result_list = []
     if max_depth is None or _depth <= max_depth:
         for node in nodes:
             if max_nodes and _node_count > max_nodes:
                 break
             # recursively get child nodes
-            if node.node_type == media_types.FOLDER and node.get_descendant_count() > 0:
-                child_nodes = __get_filenode_list(node.get_children().all(), filter_media_types=filter_media_types, exclude_media_types=exclude_media_types,
+            if node.node_type == media_types.FOLDER and node.pk in _children:
+                child_nodes = __get_filenode_list(_children[node.pk], filter_media_types=filter_media_types, exclude_media_types=exclude_media_types,
                     filter=filter, ordering=ordering, processors=processors, list_method=list_method, max_depth=max_depth, max_nodes=max_nodes,
-                    _depth=_depth + 1, _node_count=_node_count)
+                    _depth=_depth + 1, _node_count=_node_count, _children=_children)
                 child_count = len(child_nodes)
             else:
                 child_count = 0
@@ -111,6 +188,11 @@ def get_nested_filenode_list(nodes, filter_media_types=None, exclude_media_types
     :param processors: A list of callables to be applied to each node, e.g. ``force_unicode`` if you want the list to contain strings instead of FileNode objects
     :param max_depth: Can be used to limit the recursion depth (unlimited by default)
     :param max_nodes: Can be used to limit the number of items in the resulting list (unlimited by default)
+
+    .. Note::
+       The descendants of all folders in ``nodes`` are retrieved using a single
+       query and assembled in memory, so the number of queries does not depend
+       on the number of folders in the tree.
     """
     return __get_filenode_list(nodes, filter_media_types=filter_media_types, exclude_media_types=exclude_media_types,
         filter=filter, ordering=ordering, processors=processors, list_method='append', max_depth=max_depth, max_nodes=max_nodes)
@@ -133,6 +215,159 @@ def get_merged_filenode_list(nodes, filter_media_types=None, exclude_media_types
     return __get_filenode_list(nodes, filter_media_types=filter_media_types, exclude_media_types=exclude_media_types,
         filter=filter, ordering=ordering, processors=processors, list_method='extend', max_depth=max_depth, max_nodes=max_nodes)
 
+class __OpenFolder(object):
+    __slots__ = ('node', 'depth', 'parent', 'emitted', 'opened')
+
+    def __init__(self, node, depth, parent, emitted):
+        self.node = node
+        self.depth = depth
+        self.parent = parent
+        self.emitted = emitted
+        self.opened = False
+
+def __iter_descendants(node, filter_media_types=None, exclude_media_types=None, filter=None, max_depth=None, chunk_size=ITER_CHUNK_SIZE):
+    """
+    Yields the descendants of ``node`` in tree order, fetching them in chunks of
+    ``chunk_size`` nodes. Each chunk is a separate query continuing after the
+    ``lft`` value of the last node in the previous chunk, so no further queries
+    are executed once the consumer stops iterating.
+    """
+    opts = node._mptt_meta
+    descendants = node.__class__._default_manager.filter(**{
+        opts.tree_id_attr: getattr(node, opts.tree_id_attr),
+        '%s__lt' % opts.right_attr: getattr(node, opts.right_attr),
+    })
+    if max_depth is not None:
+        descendants = descendants.filter(**{'%s__lt' % opts.level_attr:
+            getattr(node, opts.level_attr) + max_depth})
+    descendants = __filter_nodes(descendants, filter_media_types=filter_media_types,
+        exclude_media_types=exclude_media_types, filter=filter).order_by(opts.left_attr)
+    last_left = getattr(node, opts.left_attr)
+    while True:
+        chunk = list(descendants.filter(**{'%s__gt' % opts.left_attr: last_left})[:chunk_size])
+        for descendant in chunk:
+            yield descendant
+        if len(chunk) < chunk_size:
+            break
+        last_left = getattr(chunk[-1], opts.left_attr)
+
+def iter_filenode_list(nodes, filter_media_types=None, exclude_media_types=None, filter=None, processors=None, max_depth=None, max_nodes=None, nested=True, list_markers=False, chunk_size=ITER_CHUNK_SIZE):
+    """
+    A lazily evaluated alternative to :func:`get_nested_filenode_list` and
+    :func:`get_merged_filenode_list`. Instead of returning a list, this generator
+    walks the tree and yields a ``(depth, node)`` tuple for each node, where
+    ``depth`` is ``1`` for the items in ``nodes``, ``2`` for their children, etc.
+
+    Descendants are fetched from the database in chunks while iterating, so
+    large trees are never loaded into memory at once, and no further queries are
+    executed when ``max_nodes`` is reached or the consumer stops iterating.
+
+    If ``nested`` is ``True`` (the default), a folder will be yielded if it
+    matches the filter criteria or contains any descendants that do, like in
+    :func:`get_nested_filenode_list`. Otherwise, folders will only be yielded if
+    they match the filter criteria themselves, like in
+    :func:`get_merged_filenode_list`.
+
+    If ``list_markers`` is ``True``, a ``(depth, LIST_OPEN)`` tuple is yielded
+    before the child nodes of a folder, and a ``(depth, LIST_CLOSE)`` tuple
+    after them. This enables you to render nested lists in templates without
+    building a nested list first::
+
+        {% for depth, link in node_iterator|file_links %}
+            {% if link == "open" %}<ul>{% elif link == "close" %}</ul>{% else %}<li>{{ link }}</li>{% endif %}
+        {% endfor %}
+
+    Apart from ``nested``, ``list_markers`` and ``chunk_size`` (the number of
+    nodes fetched per query), the parameters are the same as the ones of
+    :func:`get_nested_filenode_list`.
+    """
+    if isinstance(nodes, models.query.QuerySet):
+        nodes = __filter_nodes(nodes, filter_media_types=filter_media_types,
+            exclude_media_types=exclude_media_types, filter=filter)
+
+    def matches(node):
+        return (not filter_media_types or node.media_type in filter_media_types)  \
+            and (not exclude_media_types or not node.media_type in exclude_media_types)
+
+    def process(node):
+        if processors:
+            node = copy(node)
+            for processor in processors:
+                node = processor(node)
+        return node
+
+    def emit(node, depth, parent):
+        node = process(node)
+        if node is None:
+            return
+        if list_markers and parent and not parent.opened:
+            parent.opened = True
+            yield (depth, LIST_OPEN)
+        yield (depth, node)
+
+    def close(folder):
+        if list_markers and folder.opened:
+            yield (folder.depth + 1, LIST_CLOSE)
+
+    def walk(root):
+        stack = []
+        opts = root._mptt_meta
+        root_level = getattr(root, opts.level_attr)
+        if root.node_type == media_types.FOLDER and getattr(root, opts.right_attr) - getattr(root, opts.left_attr) > 1  \
+            and (max_depth is None or max_depth > 1):
+                descendants = __iter_descendants(root, filter_media_types=filter_media_types,
+                    exclude_media_types=exclude_media_types, filter=filter, max_depth=max_depth,
+                    chunk_size=chunk_size)
+        else:
+            descendants = ()
+        for node in itertools.chain((root,), descendants):
+            if node is not root:
+                while stack and getattr(stack[-1].node, opts.right_attr) < getattr(node, opts.left_attr):
+                    for item in close(stack.pop()):
+                        yield item
+                if not stack or stack[-1].node.pk != node.parent_id:
+                    # an ancestor was excluded by the filter criteria
+                    continue
+            parent = stack[-1] if stack else None
+            depth = getattr(node, opts.level_attr) - root_level + 1
+            is_match = matches(node)
+            if is_match:
+                if nested:
+                    # emit ancestors that were not emitted yet since they are not matching
+                    pending = []
+                    folder = parent
+                    while folder and not folder.emitted:
+                        pending.insert(0, folder)
+                        folder = folder.parent
+                    for folder in pending:
+                        folder.emitted = True
+                        for item in emit(folder.node, folder.depth, folder.parent):
+                            yield item
+                for item in emit(node, depth, parent if nested else None):
+                    yield item
+            if node.node_type == media_types.FOLDER and (max_depth is None or depth < max_depth):
+                stack.append(__OpenFolder(node, depth, parent, is_match))
+        while stack:
+            for item in close(stack.pop()):
+                yield item
+
+    node_count = 0
+    open_lists = []
+    for root in nodes:
+        for item in walk(root):
+            if item[1] == LIST_OPEN:
+                open_lists.append(item[0])
+            elif item[1] == LIST_CLOSE:
+                open_lists.pop()
+            elif max_nodes:
+                if node_count >= max_nodes:
+                    # close any lists that are still open and stop fetching
+                    while open_lists:
+                        yield (open_lists.pop(), LIST_CLOSE)
+                    return
+                node_count += 1
+            yield item
+
 # TODO: This would be better as a template filter, but its params are to complicated
 def get_file_link(node, use_metadata=False, include_size=False, include_extension=False, include_icon=False, href=None, extra_class='', extra=''):
     """
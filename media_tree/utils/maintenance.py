@@ -2,54 +2,317 @@ from media_tree.utils import get_media_storage
 from media_tree.media_backends import get_media_backend
 from media_tree.models import FileNode
 from media_tree import settings as app_settings
+from django.db.models import F, Q
+try:
+    from django.utils.encoding import force_unicode
+except ImportError:
+    from django.utils.encoding import force_text as force_unicode
 from unicodedata import normalize
-import os
+import posixpath
+import time
 
+SCAN_CHUNK_SIZE = 2000
 
-def get_cache_files():
-    storage = get_media_storage()
-    cache_files = []
+EVICTION_RESOLUTION = 3600
 
-    for cache_dir in get_media_backend().get_cache_paths():
+def iter_cache_files():
+    """
+    Recursively walks the cache directories of the media backend and yields
+    the storage names of all cache files.
+    """
+    storage = get_media_storage()
+    media_backend = get_media_backend()
+    if not media_backend:
+        return
+    for cache_dir in media_backend.get_cache_paths():
         if storage.exists(cache_dir):
-            files_in_dir = [storage.path(os.path.join(cache_dir, filename))  \
-                for filename in storage.listdir(cache_dir)[1]]
-            for file_path in files_in_dir:
-                # need to normalize unicode path due to https://code.djangoproject.com/ticket/16315
-                file_path = normalize('NFC', file_path)
-                storage_name = os.path.join(cache_dir, os.path.basename(file_path))
-                cache_files.append(storage_name)
+            for storage_name in iter_storage_files(storage, cache_dir):
+                yield storage_name
+
+
+def get_cache_files():
+    return list(iter_cache_files())
+
+
+def get_access_timestamp(storage, storage_name):
+    """
+    Returns the time the file was last accessed as a timestamp, or the time it
+    was last modified if the storage does not support access times.
+    """
+    for method in ('accessed_time', 'modified_time'):
+        try:
+            return time.mktime(getattr(storage, method)(storage_name).timetuple())
+        except (AttributeError, NotImplementedError, OSError):
+            pass
+    return None
+
+
+def iter_evicted_cache_files(max_bytes=None, older_than=None, resolution=EVICTION_RESOLUTION,
+    iter_files=iter_cache_files, storage=None):
+    """
+    Yields a ``(storage_name, size)`` tuple for every cache file that should be
+    evicted in order to keep the total size of the cache under ``max_bytes``,
+    evicting the least recently used files first, and for every cache file that
+    was not accessed for ``older_than`` seconds.
+
+    Cache directories are walked twice, and no list of all files is kept in
+    memory: The first pass only builds a histogram of the bytes accessed within
+    each ``resolution`` seconds, which is used to determine the point in time
+    before which all files need to be evicted. If only a part of the files in
+    the last of these intervals needs to be evicted, the directories are walked
+    once more to determine the exact access time up to which files are evicted,
+    keeping only the files in that interval in memory. The last pass yields the
+    evicted files.
+
+    Other caches can be evicted by passing a callable returning an iterator of
+    their storage names as ``iter_files``, and the storage they are stored in.
+    """
+    if storage is None:
+        storage = get_media_storage()
+    cutoff = None
+    if older_than is not None:
+        cutoff = time.time() - older_than
+    evict_until = None
+
+    if max_bytes is not None:
+        histogram = {}
+        total_size = 0
+        for storage_name in iter_files():
+            timestamp = get_access_timestamp(storage, storage_name)
+            if timestamp is None or cutoff is not None and timestamp < cutoff:
+                continue
+            size = storage.size(storage_name)
+            bucket = int(timestamp // resolution)
+            histogram[bucket] = histogram.get(bucket, 0) + size
+            total_size += size
+        for bucket in sorted(histogram.keys()):
+            if total_size <= max_bytes:
+                break
+            if total_size - histogram[bucket] < max_bytes:
+                # Only the least recently used files of this interval need
+                # to be evicted
+                evict_until = __get_eviction_time(storage, iter_files, bucket, resolution,
+                    cutoff, total_size - max_bytes)
+                break
+            total_size -= histogram[bucket]
+            if cutoff is None or cutoff < (bucket + 1) * resolution:
+                cutoff = (bucket + 1) * resolution
+
+    if cutoff is None and evict_until is None:
+        return
+    for storage_name in iter_files():
+        timestamp = get_access_timestamp(storage, storage_name)
+        if timestamp is None:
+            continue
+        if cutoff is not None and timestamp < cutoff  \
+            or evict_until is not None and timestamp <= evict_until:
+                yield (storage_name, storage.size(storage_name))
+
+
+def __get_eviction_time(storage, iter_files, bucket, resolution, cutoff, excess_bytes):
+    """
+    Returns the access time up to which the files accessed within the
+    histogram interval ``bucket`` need to be evicted to free ``excess_bytes``.
+    """
+    files = []
+    for storage_name in iter_files():
+        timestamp = get_access_timestamp(storage, storage_name)
+        if timestamp is None or cutoff is not None and timestamp < cutoff  \
+            or int(timestamp // resolution) != bucket:
+                continue
+        files.append((timestamp, storage.size(storage_name)))
+    files.sort()
+    evicted_size = 0
+    for timestamp, size in files:
+        evicted_size += size
+        if evicted_size >= excess_bytes:
+            return timestamp
+    if files:
+        return files[-1][0]
+
+
+def normalize_name(name):
+    # need to normalize unicode path due to https://code.djangoproject.com/ticket/16315
+    return normalize('NFC', force_unicode(name))
+
+
+def iter_storage_files(storage, path, exclude_dirs=(), start_after=None):
+    """
+    Recursively walks the storage directory ``path`` and yields the storage
+    names of all files, excluding the directories in ``exclude_dirs``. Only one
+    directory listing per level is held in memory at a time.
 
-    return cache_files
+    Files are yielded in the order of their path components, so the walk can
+    be resumed after the storage name ``start_after``, skipping all
+    directories that only contain files preceding it.
+    """
+    start = tuple(start_after.split('/')) if start_after else None
+    dirs, files = storage.listdir(path)
+    entries = sorted([(name, False) for name in files] + [(name, True) for name in dirs])
+    for name, is_dir in entries:
+        storage_name = posixpath.join(path, name)
+        key = tuple(storage_name.split('/'))
+        if is_dir:
+            if storage_name in exclude_dirs:
+                continue
+            if start and key < start[:len(key)]:
+                continue
+            subdir_start = start_after if start and key == start[:len(key)] else None
+            for subdir_name in iter_storage_files(storage, storage_name, exclude_dirs, subdir_start):
+                yield subdir_name
+        elif not start or key > start:
+            yield storage_name
+
+
+def get_media_dirs():
+    """
+    Returns the storage directories containing media files, i.e.
+    ``MEDIA_TREE_UPLOAD_SUBDIR`` and ``MEDIA_TREE_PREVIEW_SUBDIR``, omitting
+    directories that are contained in another one.
+    """
+    dirs = [app_settings.MEDIA_TREE_UPLOAD_SUBDIR.strip('/'),
+        app_settings.MEDIA_TREE_PREVIEW_SUBDIR.strip('/')]
+    return [path for path in dirs if not [other for other in dirs
+        if other != path and path.startswith(other + '/')]]
+
+
+def get_file_names_in_db(chunk_size=SCAN_CHUNK_SIZE):
+    """
+    Returns a set containing the normalized storage names of all media files
+    and preview files referenced in the database. Only the names are fetched,
+    in chunks of ``chunk_size`` rows.
+    """
+    names = set()
+    last_pk = 0
+    while True:
+        rows = list(FileNode.objects.filter(pk__gt=last_pk).order_by('pk').values_list(
+            'pk', 'file', 'preview_file')[:chunk_size])
+        for pk, file_name, preview_name in rows:
+            if file_name:
+                names.add(normalize_name(file_name))
+            if preview_name:
+                names.add(normalize_name(preview_name))
+        if len(rows) < chunk_size:
+            return names
+        last_pk = rows[-1][0]
+
+
+def iter_orphaned_files(file_names_in_db=None, start_after=None):
+    """
+    Walks the media directories recursively and yields the storage names of all
+    files that are not referenced in the database. Cache directories of the
+    media backend are excluded.
+
+    If a set of normalized names as returned by :func:`get_file_names_in_db`
+    is passed, the names of all files found in storage are removed from it, so
+    that it only contains the names of missing files when the iteration is
+    complete.
+
+    Files are yielded in a stable order, so a scan can be resumed by passing
+    the last storage name that was processed as ``start_after``.
+    """
+    storage = get_media_storage()
+    if file_names_in_db is None:
+        file_names_in_db = get_file_names_in_db()
+    media_backend = get_media_backend()
+    exclude_dirs = set([path.strip('/') for path in media_backend.get_cache_paths()]  \
+        if media_backend else ())
+    start = tuple(start_after.split('/')) if start_after else None
+    for media_dir in sorted(get_media_dirs()):
+        key = tuple(media_dir.split('/'))
+        if start and key < start[:len(key)] or not storage.exists(media_dir):
+            continue
+        dir_start = start_after if start and key == start[:len(key)] else None
+        for storage_name in iter_storage_files(storage, media_dir, exclude_dirs, dir_start):
+            name = normalize_name(storage_name)
+            if name in file_names_in_db:
+                file_names_in_db.discard(name)
+            else:
+                yield storage_name
 
 
 def get_broken_media():
+    """
+    Returns a list containing a list of all nodes whose files or preview files
+    do not exist in storage, and a list of the storage names of all orphaned
+    files, i.e. files existing in storage that are not in the database.
+
+    Existence is derived from a single recursive listing of the media
+    directories. Only files outside of these directories are checked
+    individually.
+    """
     storage = get_media_storage()
-    media_subdir = app_settings.MEDIA_TREE_UPLOAD_SUBDIR
+    missing_names = get_file_names_in_db()
+    orphaned_files = list(iter_orphaned_files(missing_names))
+
+    media_dirs = get_media_dirs()
+    for name in list(missing_names):
+        if not [path for path in media_dirs if name.startswith(path + '/')]  \
+            and storage.exists(name):
+                missing_names.discard(name)
+
     broken_nodes = []
-    orphaned_files = []
-
-    files_in_db = []
-    for node in FileNode.objects.filter(node_type=FileNode.FILE):
-        path = node.file.path
-        # need to normalize unicode path due to https://code.djangoproject.com/ticket/16315
-        path = normalize('NFC', path)
-        files_in_db.append(path)
-        if not storage.exists(node.file):
-            broken_nodes.append(node)
-
-    files_in_storage = [storage.path(os.path.join(media_subdir, filename))  \
-        for filename in storage.listdir(media_subdir)[1]]
-
-    for file_path in files_in_storage:
-        # need to normalize unicode path due to https://code.djangoproject.com/ticket/16315
-        file_path = normalize('NFC', file_path)
-        if not file_path in files_in_db:
-            storage_name = os.path.join(media_subdir, os.path.basename(file_path))
-            orphaned_files.append(storage_name)
+    missing_names = list(missing_names)
+    for i in range(0, len(missing_names), SCAN_CHUNK_SIZE):
+        chunk = missing_names[i:i + SCAN_CHUNK_SIZE]
+        broken_nodes.extend(FileNode.objects.filter(
+            Q(file__in=chunk) | Q(preview_file__in=chunk)))
 
     return [broken_nodes, orphaned_files]
 
 
 def get_orphaned_files():
-    return get_broken_media()[1]
+    return list(iter_orphaned_files())
+
+
+def update_aggregates():
+    """
+    Recomputes the aggregate fields (``total_size``, ``file_count`` and
+    ``missing_metadata_count``) as well as the ``has_metadata`` flag of all
+    folders, and the aggregate fields of all files. This is useful if nodes
+    were changed without their ``save()`` or ``delete()`` methods being called,
+    for instance by bulk operations on QuerySets.
+
+    The whole tree is read in a single query, and only rows with outdated values
+    are updated. Returns the number of folders that were updated.
+    """
+    files = FileNode.objects.filter(node_type=FileNode.FILE)
+    files.filter(size__isnull=False).update(total_size=F('size'), file_count=1)
+    files.filter(size__isnull=True).update(total_size=0, file_count=1)
+    files.filter(has_metadata=True).update(missing_metadata_count=0)
+    files.filter(has_metadata=False).update(missing_metadata_count=1)
+
+    opts = FileNode._mptt_meta
+    nodes = FileNode.objects.order_by(opts.tree_id_attr, opts.left_attr).values_list(
+        'pk', 'node_type', opts.tree_id_attr, opts.right_attr, 'size', 'has_metadata',
+        'total_size', 'file_count', 'missing_metadata_count')
+    updated_count = [0]
+    stack = []
+
+    def close_folder():
+        folder = stack.pop()
+        pk, stored, computed = folder[0], folder[3], folder[4]
+        if stack:
+            for i in range(3):
+                stack[-1][4][i] += computed[i]
+        if tuple(computed) + (computed[2] == 0,) != stored:
+            FileNode.objects.filter(pk=pk).update(total_size=computed[0],
+                file_count=computed[1], missing_metadata_count=computed[2],
+                has_metadata=computed[2] == 0)
+            updated_count[0] += 1
+
+    for pk, node_type, tree_id, right, size, has_metadata, total_size, file_count, missing_metadata_count in nodes.iterator():
+        while stack and (stack[-1][1] != tree_id or stack[-1][2] < right):
+            close_folder()
+        if node_type == FileNode.FOLDER:
+            stack.append((pk, tree_id, right,
+                (total_size, file_count, missing_metadata_count, has_metadata), [0, 0, 0]))
+        elif stack:
+            aggregates = stack[-1][4]
+            aggregates[0] += size or 0
+            aggregates[1] += 1
+            aggregates[2] += 0 if has_metadata else 1
+    while stack:
+        close_folder()
+
+    return updated_count[0]
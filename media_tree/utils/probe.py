@@ -0,0 +1,313 @@
+"""
+Utilities for determining the format and dimensions of images by parsing only
+their headers.
+
+Opening an image with PIL in order to read its dimensions requires the file to
+be a seekable file object, which for some storages means that the whole file
+is downloaded. The parsers in this module only read the file sequentially in
+chunks of ``PROBE_CHUNK_SIZE`` bytes until the dimensions are found, which is
+usually within the first chunk. SVG images are supported by parsing the
+attributes of their root element, and images whose dimensions exceed
+``MEDIA_TREE_MAX_IMAGE_PIXELS`` are rejected before they are ever decoded.
+
+Only files whose extension is handled as an image (see
+:func:`is_image_extension`) are probed, so that other files are never
+classified as images because of their first bytes.
+"""
+from media_tree import settings as app_settings, media_types
+from media_tree.utils import get_module_attr
+from PIL import Image
+import re
+import struct
+
+PROBE_CHUNK_SIZE = 4096
+# JPEG dimensions may follow large metadata segments, such as EXIF thumbnails
+PROBE_MAX_SIZE = 512 * 1024
+SVG_PROBE_MAX_SIZE = 64 * 1024
+
+JPEG_SOF_MARKERS = (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF)
+JPEG_STANDALONE_MARKERS = (0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8)
+
+RE_SVG_COMMENT = re.compile(r'<!--.*?-->|<!DOCTYPE[^\[>]*(\[.*?\])?\s*>', re.DOTALL)
+RE_SVG_ROOT = re.compile(r'<(?:\w+:)?svg\b([^>]*)>', re.DOTALL)
+RE_SVG_ATTR = re.compile(r'([\w:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+RE_SVG_LENGTH = re.compile(r'^\s*([0-9]*\.?[0-9]+(?:[eE][+-]?[0-9]+)?)\s*(px|pt|pc|mm|cm|in)?\s*$')
+SVG_UNITS = {None: 1.0, 'px': 1.0, 'pt': 96 / 72.0, 'pc': 16.0, 'mm': 96 / 25.4, 'cm': 96 / 2.54, 'in': 96.0}
+
+# Sizes of the BITMAPCOREHEADER, BITMAPINFOHEADER and its later versions
+BMP_DIB_HEADER_SIZES = (12, 40, 52, 56, 64, 108, 124)
+BMP_BIT_COUNTS = (0, 1, 2, 4, 8, 16, 24, 32, 64)
+
+__pil_extensions = None
+
+
+class DecompressionBombError(IOError):
+    """
+    Raised if the dimensions of an image exceed ``MEDIA_TREE_MAX_IMAGE_PIXELS``.
+    """
+    pass
+
+
+class __Header(object):
+    """
+    Reads a file sequentially and keeps the bytes read so far, so that
+    parsers can access the header at any offset.
+    """
+
+    def __init__(self, fileobj, max_size=PROBE_MAX_SIZE):
+        self.fileobj = fileobj
+        self.max_size = max_size
+        self.data = b''
+        self.complete = False
+
+    def read(self, offset, size):
+        while len(self.data) < offset + size and not self.complete:
+            if len(self.data) >= self.max_size:
+                break
+            chunk = self.fileobj.read(PROBE_CHUNK_SIZE)
+            if not chunk:
+                self.complete = True
+            self.data += chunk
+        if len(self.data) < offset + size:
+            raise IOError('Image header could not be parsed')
+        return self.data[offset:offset + size]
+
+    def unpack(self, format, offset):
+        return struct.unpack(format, self.read(offset, struct.calcsize(format)))
+
+
+def __get_jpeg_size(header):
+    offset = 2
+    while True:
+        if header.read(offset, 1) != b'\xff':
+            return None
+        while header.read(offset, 1) == b'\xff':
+            offset += 1
+        marker = header.unpack('B', offset)[0]
+        offset += 1
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (0xD9, 0xDA):
+            # End of image or start of scan before any frame header
+            return None
+        length = header.unpack('>H', offset)[0]
+        if marker in JPEG_SOF_MARKERS:
+            height, width = header.unpack('>HH', offset + 3)
+            return (width, height)
+        offset += length
+
+
+def __get_tiff_size(header, byte_order):
+    ifd_offset = header.unpack(byte_order + 'I', 4)[0]
+    entry_count = header.unpack(byte_order + 'H', ifd_offset)[0]
+    size = {}
+    for i in range(entry_count):
+        tag, field_type = header.unpack(byte_order + 'HH', ifd_offset + 2 + i * 12)
+        if tag in (256, 257):
+            if field_type == 3:
+                size[tag] = header.unpack(byte_order + 'H', ifd_offset + 10 + i * 12)[0]
+            elif field_type == 4:
+                size[tag] = header.unpack(byte_order + 'I', ifd_offset + 10 + i * 12)[0]
+            if len(size) == 2:
+                return (size[256], size[257])
+    return None
+
+
+def __get_webp_size(header):
+    chunk_type = header.read(12, 4)
+    if chunk_type == b'VP8 ':
+        if header.read(23, 3) != b'\x9d\x01\x2a':
+            return None
+        width, height = header.unpack('<HH', 26)
+        return (width & 0x3fff, height & 0x3fff)
+    if chunk_type == b'VP8L':
+        if header.read(20, 1) != b'\x2f':
+            return None
+        bits = header.unpack('<I', 21)[0]
+        return ((bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1)
+    if chunk_type == b'VP8X':
+        data = header.read(24, 6)
+        width = struct.unpack('<I', data[0:3] + b'\x00')[0]
+        height = struct.unpack('<I', data[3:6] + b'\x00')[0]
+        return (width + 1, height + 1)
+    return None
+
+
+def __get_bmp_size(header):
+    dib_header_size = header.unpack('<I', 14)[0]
+    if dib_header_size == 12:
+        width, height, planes, bit_count = header.unpack('<HHHH', 18)
+    elif dib_header_size in BMP_DIB_HEADER_SIZES:
+        width, height, planes, bit_count = header.unpack('<iiHH', 18)
+    else:
+        return None
+    if planes != 1 or not bit_count in BMP_BIT_COUNTS or width <= 0 or height == 0:
+        return None
+    # Height is negative for top-down bitmaps
+    return (width, abs(height))
+
+
+def get_image_size(fileobj):
+    """
+    Returns a ``(format, width, height)`` tuple for a JPEG, PNG, GIF, WebP,
+    BMP or TIFF image by parsing its header, or ``None`` if the file is not
+    in one of these formats or its header could not be parsed.
+    """
+    header = __Header(fileobj)
+    try:
+        signature = header.read(0, 2)
+        if signature == b'\xff\xd8':
+            image_format, size = ('JPEG', __get_jpeg_size(header))
+        elif signature == b'\x89P' and header.read(0, 8) == b'\x89PNG\r\n\x1a\n':
+            image_format, size = ('PNG', header.unpack('>II', 16))
+        elif signature == b'GI' and header.read(0, 6) in (b'GIF87a', b'GIF89a'):
+            image_format, size = ('GIF', header.unpack('<HH', 6))
+        elif signature == b'RI' and header.read(0, 4) == b'RIFF' and header.read(8, 4) == b'WEBP':
+            image_format, size = ('WEBP', __get_webp_size(header))
+        elif signature == b'BM':
+            image_format, size = ('BMP', __get_bmp_size(header))
+        elif header.read(0, 4) == b'II*\x00':
+            image_format, size = ('TIFF', __get_tiff_size(header, '<'))
+        elif header.read(0, 4) == b'MM\x00*':
+            image_format, size = ('TIFF', __get_tiff_size(header, '>'))
+        else:
+            return None
+    except (IOError, struct.error):
+        return None
+    if not size:
+        return None
+    return (image_format, int(size[0]), int(size[1]))
+
+
+def __parse_svg_length(value):
+    match = RE_SVG_LENGTH.match(value or '')
+    if match:
+        return float(match.group(1)) * SVG_UNITS[match.group(2)]
+    return None
+
+
+def get_vector_image_size(fileobj):
+    """
+    Returns a ``(width, height)`` tuple for an SVG image, determined from the
+    ``width``, ``height`` and ``viewBox`` attributes of its root element, or
+    ``(None, None)`` if the dimensions could not be determined. Relative units
+    such as percentages are not supported.
+    """
+    header = __Header(fileobj, SVG_PROBE_MAX_SIZE)
+    match = None
+    offset = 0
+    try:
+        while not match:
+            header.read(offset, PROBE_CHUNK_SIZE)
+            offset += PROBE_CHUNK_SIZE
+            text = RE_SVG_COMMENT.sub('', header.data.decode('utf-8', 'replace'))
+            match = RE_SVG_ROOT.search(text)
+    except IOError:
+        text = RE_SVG_COMMENT.sub('', header.data.decode('utf-8', 'replace'))
+        match = RE_SVG_ROOT.search(text)
+    if not match:
+        return (None, None)
+
+    attrs = {}
+    for name, double_quoted, single_quoted in RE_SVG_ATTR.findall(match.group(1)):
+        attrs[name] = double_quoted or single_quoted
+    width = __parse_svg_length(attrs.get('width'))
+    height = __parse_svg_length(attrs.get('height'))
+    view_box = [value for value in re.split(r'[\s,]+', attrs.get('viewBox', '').strip()) if value]
+    if (width is None or height is None) and len(view_box) == 4:
+        try:
+            view_box_width, view_box_height = float(view_box[2]), float(view_box[3])
+        except ValueError:
+            view_box_width = view_box_height = 0
+        if view_box_width > 0 and view_box_height > 0:
+            if width is None and height is None:
+                width, height = view_box_width, view_box_height
+            elif width is None:
+                width = height * view_box_width / view_box_height
+            else:
+                height = width * view_box_height / view_box_width
+    if width is None or height is None:
+        return (None, None)
+    return (int(round(width)), int(round(height)))
+
+
+def __get_pil_extensions():
+    global __pil_extensions
+    if __pil_extensions is None:
+        Image.init()
+        __pil_extensions = frozenset([extension.lstrip('.').lower() for extension in Image.EXTENSION])
+    return __pil_extensions
+
+
+def is_image_extension(extension):
+    """
+    Returns ``True`` if files with the given extension are handled as images:
+    Vector images (see ``MEDIA_TREE_VECTOR_EXTENSIONS``), and bitmap images
+    that a configured media backend supporting web images handles, which are
+    the extensions listed in its ``SUPPORTED_FILE_EXTENSIONS``, or the ones
+    known to PIL if it does not list any. If there is no such backend, the
+    extensions known to PIL are handled as images.
+    """
+    extension = (extension or '').lower()
+    if extension in app_settings.MEDIA_TREE_VECTOR_EXTENSIONS:
+        return True
+    found_backend = False
+    for path in app_settings.MEDIA_TREE_MEDIA_BACKENDS:
+        backend = get_module_attr(path)
+        if backend.handles_media_types((media_types.SUPPORTED_IMAGE,)):
+            found_backend = True
+            if backend.SUPPORTED_FILE_EXTENSIONS:
+                if extension in backend.SUPPORTED_FILE_EXTENSIONS:
+                    return True
+            elif extension in __get_pil_extensions():
+                return True
+    return not found_backend and extension in __get_pil_extensions()
+
+
+def check_image_size(width, height):
+    """
+    Raises :class:`DecompressionBombError` if an image with the given
+    dimensions exceeds ``MEDIA_TREE_MAX_IMAGE_PIXELS``.
+    """
+    max_pixels = app_settings.MEDIA_TREE_MAX_IMAGE_PIXELS
+    if max_pixels and width * height > max_pixels:
+        raise DecompressionBombError('Image dimensions %ix%i exceed the limit of %i pixels' % (
+            width, height, max_pixels))
+
+
+def probe_image(fileobj, extension):
+    """
+    Returns a ``(media_type, width, height)`` tuple for an image file. Vector
+    images (see ``MEDIA_TREE_VECTOR_EXTENSIONS``) are always recognized, even
+    if their dimensions cannot be determined. Bitmap images in formats that
+    are not parsed by this module are opened with PIL, which also only reads
+    their header. Raises ``IOError`` if the extension is not handled as an
+    image (see :func:`is_image_extension`) or the file is not a supported
+    image, and :class:`DecompressionBombError` if its dimensions are too large.
+    """
+    if not is_image_extension(extension):
+        raise IOError('Files with the extension %s are not handled as images' % extension)
+    try:
+        fileobj.seek(0)
+    except (AttributeError, IOError, ValueError):
+        pass
+    try:
+        if extension in app_settings.MEDIA_TREE_VECTOR_EXTENSIONS:
+            width, height = get_vector_image_size(fileobj)
+            return (media_types.VECTOR_IMAGE, width, height)
+        info = get_image_size(fileobj)
+        if info:
+            width, height = info[1:]
+        else:
+            try:
+                fileobj.seek(0)
+            except (AttributeError, ValueError):
+                raise IOError('Image header could not be parsed')
+            width, height = Image.open(fileobj).size
+        check_image_size(width, height)
+        return (media_types.SUPPORTED_IMAGE, width, height)
+    finally:
+        try:
+            fileobj.seek(0)
+        except (AttributeError, IOError, ValueError):
+            pass
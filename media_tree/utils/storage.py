@@ -0,0 +1,219 @@
+"""
+Utilities for content hashing, content-addressed storage and copying of media
+files.
+
+If ``MEDIA_TREE_CONTENT_ADDRESSED_STORAGE`` is enabled, files are stored under
+a name derived from the SHA-256 digest of their contents, for instance
+``upload/3a/7b/3a7bd3e2...jpg``, so that identical uploads reference a single
+file in storage. The file is only deleted when the last node referencing it
+is deleted.
+"""
+from media_tree import settings as app_settings
+from media_tree.utils import multi_splitext
+from django.core.files import File
+from django.db.models import Q
+import errno
+import hashlib
+import os
+import posixpath
+import re
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+COPY_NAME_ATTEMPTS = 3
+
+# ioctl request for cloning a file on Linux, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+RE_CONTENT_NAME = re.compile(r'(^|/)([0-9a-f]{2})/([0-9a-f]{2})/\2\3[0-9a-f]{60}(\.[^/]*)?$')
+
+
+def get_sha256(fileobj):
+    """
+    Returns the hexadecimal SHA-256 digest of a file, which is read in chunks.
+    """
+    digest = hashlib.sha256()
+    try:
+        fileobj.seek(0)
+    except (AttributeError, IOError, ValueError):
+        pass
+    while True:
+        data = fileobj.read(HASH_CHUNK_SIZE)
+        if not data:
+            break
+        digest.update(data)
+    try:
+        fileobj.seek(0)
+    except (AttributeError, IOError, ValueError):
+        pass
+    return digest.hexdigest()
+
+
+def get_content_name(sha256, extension, directory=None):
+    """
+    Returns the content-addressed storage name for a file with the given
+    digest and extension.
+    """
+    if directory is None:
+        directory = app_settings.MEDIA_TREE_UPLOAD_SUBDIR
+    name = '%s.%s' % (sha256, extension) if extension else sha256
+    return posixpath.join(directory.strip('/'), sha256[:2], sha256[2:4], name)
+
+
+def is_content_name(name):
+    return bool(name and RE_CONTENT_NAME.search(name))
+
+
+def store_content(storage, fileobj, sha256, extension):
+    """
+    Stores ``fileobj`` under its content-addressed name, unless a file with
+    the same contents is already stored, and returns the name.
+    """
+    name = get_content_name(sha256, extension)
+    if not storage.exists(name):
+        saved_name = storage.save(name, fileobj)
+        if saved_name != name:
+            # The same contents were stored concurrently
+            storage.delete(saved_name)
+    return name
+
+
+def release_content(storage, name, exclude_pk=None):
+    """
+    Deletes a content-addressed file from storage if it is not referenced by
+    any node (except the node with the primary key ``exclude_pk``). Files that
+    are not stored under a content-addressed name are left untouched. Returns
+    ``True`` if the file was deleted.
+    """
+    from media_tree.models import FileNode
+    if not is_content_name(name):
+        return False
+    references = FileNode.objects.filter(Q(file=name) | Q(preview_file=name))
+    if exclude_pk is not None:
+        references = references.exclude(pk=exclude_pk)
+    if references.exists():
+        return False
+    storage.delete(name)
+    return True
+
+
+def get_storage_path(storage, name):
+    """
+    Returns the local filesystem path of the file ``name`` in ``storage``, or
+    ``name`` itself if the storage does not store files locally.
+    """
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return name
+
+
+def delete_stored_files(storage, names):
+    """
+    Deletes files that were stored for nodes that could not be saved. Files
+    stored under a content-addressed name are only deleted if they are not
+    referenced by any node (see :func:`release_content`).
+    """
+    for name in set(names):
+        if is_content_name(name):
+            release_content(storage, name)
+        else:
+            storage.delete(name)
+
+
+def save_node_file(node, fileobj, name):
+    """
+    Stores the contents of ``fileobj`` as the file of ``node``, which is not
+    saved, and sets its ``file`` and ``sha256`` fields. The file is stored
+    under a content-addressed name if ``MEDIA_TREE_CONTENT_ADDRESSED_STORAGE``
+    is enabled, or under ``name`` in ``MEDIA_TREE_UPLOAD_SUBDIR`` otherwise.
+    This is used when creating nodes without calling their ``save()`` method.
+    """
+    from media_tree.models import FileNode
+    file_field = FileNode._meta.get_field('file')
+    node.sha256 = get_sha256(fileobj)
+    if app_settings.MEDIA_TREE_CONTENT_ADDRESSED_STORAGE:
+        extension = multi_splitext(name)[2].lstrip('.').lower()
+        node.file = store_content(file_field.storage, File(fileobj), node.sha256, extension)
+    else:
+        node.file = file_field.storage.save(file_field.generate_filename(node, name), File(fileobj))
+    return node.file.name
+
+
+def __link_file(source_path, target_path):
+    """
+    Creates ``target_path`` as a copy-on-write clone of ``source_path`` if the
+    file system supports it (such as Btrfs or XFS), or as a hard link
+    otherwise. Neither copies the contents of the file. Raises ``OSError``
+    if neither is supported.
+    """
+    if fcntl is not None:
+        fd = os.open(target_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        cloned = False
+        try:
+            source = open(source_path, 'rb')
+            try:
+                fcntl.ioctl(fd, FICLONE, source.fileno())
+                cloned = True
+            except (IOError, OSError):
+                pass
+            finally:
+                source.close()
+        finally:
+            os.close(fd)
+        if cloned:
+            return
+        os.remove(target_path)
+    if not hasattr(os, 'link'):
+        raise OSError(errno.EPERM, 'Hard links are not supported')
+    os.link(source_path, target_path)
+
+
+def copy_file(storage, name, target_name):
+    """
+    Copies the file ``name`` to an available name based on ``target_name``
+    within ``storage``, and returns the name of the copy. The file is copied
+    using the cheapest method available:
+
+    * Content-addressed files (see ``MEDIA_TREE_CONTENT_ADDRESSED_STORAGE``)
+      are not copied at all, but ``name`` is returned, since identical files
+      reference the same file in storage.
+    * Storages can provide a ``copy(name, target_name)`` method, for instance
+      to copy files on the server side of cloud storages.
+    * Files in local storage are cloned or hard linked (see
+      :func:`__link_file`) if supported by the file system.
+    * Otherwise, the file is copied in chunks.
+    """
+    if app_settings.MEDIA_TREE_CONTENT_ADDRESSED_STORAGE and is_content_name(name):
+        return name
+    if hasattr(storage, 'copy'):
+        target_name = storage.get_available_name(target_name)
+        storage.copy(name, target_name)
+        return target_name
+    try:
+        source_path = storage.path(name)
+    except NotImplementedError:
+        source_path = None
+    if source_path:
+        for attempt in range(COPY_NAME_ATTEMPTS):
+            available_name = storage.get_available_name(target_name)
+            target_path = storage.path(available_name)
+            directory = os.path.dirname(target_path)
+            try:
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                __link_file(source_path, target_path)
+                return available_name
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    break
+                # A file with the same name was created concurrently
+    source = storage.open(name, 'rb')
+    try:
+        return storage.save(target_name, File(source))
+    finally:
+        source.close()
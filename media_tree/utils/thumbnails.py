@@ -0,0 +1,330 @@
+"""
+Utilities for retrieving and generating thumbnails through the configured media
+backend.
+
+The thumbnail manifest is a database table storing the URL and dimensions of
+every thumbnail that was generated, so that thumbnails can be displayed without
+accessing the storage. Entries are keyed by the name of the source file, a
+version identifying the content of the source file (see
+:func:`get_source_version`) and a hash of the normalized thumbnail options.
+Since the media backend is not part of the key, the manifest should be cleared
+using ``manage.py mediacache --delete`` when the backend configuration changes.
+
+Thumbnails can also be generated eagerly, so that they do not need to be
+generated while rendering the first page that displays an image after it was
+uploaded. :func:`generate_thumbnails` only receives the storage name of the
+source file, so it never accesses the ``FileNode`` table and can be executed in
+worker processes, which is what ``manage.py mediathumbs --warm`` does. Web
+processes do not fork, so thumbnails of uploaded files are generated in a pool
+of background threads instead (see :func:`pregenerate_thumbnails`).
+"""
+from media_tree import settings as app_settings, media_types
+from media_tree.media_backends import get_media_backend, ThumbnailError
+from media_tree.utils.db import atomic, on_commit
+from django.db import connections, IntegrityError
+from multiprocessing.pool import ThreadPool
+import hashlib
+import logging
+import threading
+
+MANIFEST_CHUNK_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+__pool = None
+__pool_lock = threading.Lock()
+
+
+def get_options_hash(options):
+    """
+    Returns a SHA-1 hash of the given thumbnail options, merged with
+    ``MEDIA_TREE_GLOBAL_THUMBNAIL_OPTIONS``. The options are normalized, so
+    that for instance ``{'size': (100, 100)}`` and ``{'size': [100, 100]}``
+    result in the same hash.
+    """
+    opts = {}
+    opts.update(app_settings.MEDIA_TREE_GLOBAL_THUMBNAIL_OPTIONS or {})
+    opts.update(options)
+    items = []
+    for key, value in opts.items():
+        if key == 'size' and isinstance(value, (list, tuple)):
+            value = 'x'.join([str(int(dimension)) for dimension in value])
+        items.append('%s=%s' % (key, value))
+    return hashlib.sha1('&'.join(sorted(items)).encode('utf-8')).hexdigest()
+
+
+def get_source_version(source):
+    """
+    Returns a string identifying the content of a source file. This is the
+    SHA-256 hash of the file if ``source`` is the ``file`` of a ``FileNode``
+    whose hash is known. Other sources, such as preview files, are identified
+    by their storage name alone, which the storage does not reuse while the
+    file exists, and an empty string is returned for them. The manifest
+    entries of deleted files are removed by :func:`clear_manifest`. Changing
+    other fields of a node does not change the version of its file, and the
+    storage is never accessed.
+    """
+    field_name = getattr(getattr(source, 'field', None), 'name', None)
+    sha256 = getattr(getattr(source, 'instance', None), 'sha256', None)
+    if field_name == 'file' and sha256:
+        return sha256
+    return ''
+
+
+def prefetch_thumbnails(sources, options):
+    """
+    Loads the manifest entries for all ``sources`` with the given options in a
+    single query (per ``MANIFEST_CHUNK_SIZE`` sources), and returns a dict
+    that can be passed to :func:`get_thumbnail` as ``prefetched``, so that it
+    does not need to query the database for these sources. The caller is
+    responsible for discarding the dict when it may be out of date, e.g. by
+    keeping it only for the current request.
+    """
+    from media_tree.models import CachedThumbnail
+    options_hash = get_options_hash(options)
+    sources = [source for source in sources if getattr(source, 'name', None)]
+    names = list(set([source.name for source in sources]))
+    entries = {}
+    for i in range(0, len(names), MANIFEST_CHUNK_SIZE):
+        for entry in CachedThumbnail.objects.filter(options_hash=options_hash,
+            source_name__in=names[i:i + MANIFEST_CHUNK_SIZE]):
+                entries[entry.source_name] = entry
+    prefetched = {}
+    for source in sources:
+        prefetched[(source.name, options_hash)] = entries.get(source.name)
+    return prefetched
+
+
+def __get_manifest_values(thumbnail):
+    return {
+        'url': thumbnail.url,
+        'width': getattr(thumbnail, 'width', None),
+        'height': getattr(thumbnail, 'height', None),
+    }
+
+
+def __store_manifest_entry(source_name, options_hash, source_version, values):
+    from media_tree.models import CachedThumbnail
+    entries = CachedThumbnail.objects.filter(source_name=source_name, options_hash=options_hash)
+    if not entries.update(source_version=source_version, **values):
+        try:
+            with atomic():
+                CachedThumbnail.objects.create(source_name=source_name,
+                    options_hash=options_hash, source_version=source_version, **values)
+        except IntegrityError:
+            # created concurrently
+            pass
+
+
+def get_thumbnail(source, options, backend=None, prefetched=None):
+    """
+    Returns a thumbnail of ``source`` with the given options. If the thumbnail
+    is found in the manifest, the manifest entry is returned, which has the
+    ``url``, ``width`` and ``height`` attributes of a thumbnail file. Otherwise,
+    the thumbnail is retrieved from (and possibly generated by) ``backend``, or
+    the configured media backend supporting thumbnails, and stored in the
+    manifest. ``prefetched`` is an optional dict returned by
+    :func:`prefetch_thumbnails`.
+    """
+    from media_tree.models import CachedThumbnail
+    if backend is None:
+        backend = get_media_backend(fail_silently=False, supports_thumbnails=True)
+    source_name = getattr(source, 'name', None)
+    if not source_name:
+        return backend.get_thumbnail(source, dict(options))
+
+    options_hash = get_options_hash(options)
+    source_version = get_source_version(source)
+    if prefetched and (source_name, options_hash) in prefetched:
+        entry = prefetched[(source_name, options_hash)]
+    else:
+        try:
+            entry = CachedThumbnail.objects.get(source_name=source_name, options_hash=options_hash)
+        except CachedThumbnail.DoesNotExist:
+            entry = None
+    if entry is not None and entry.source_version == source_version:
+        return entry
+
+    thumbnail = backend.get_thumbnail(source, dict(options))
+    if thumbnail:
+        __store_manifest_entry(source_name, options_hash, source_version,
+            __get_manifest_values(thumbnail))
+    return thumbnail
+
+
+def get_thumbnails(sources, options, backend=None):
+    """
+    Returns a list of thumbnails of all ``sources`` with the given options, in
+    the same order as ``sources``. This works like :func:`get_thumbnail`, but
+    all sources are looked up in the manifest using :func:`prefetch_thumbnails`,
+    and missing thumbnails are generated concurrently in a pool of
+    ``MEDIA_TREE_THUMBNAIL_THREADS`` threads. If the thumbnail of a source
+    cannot be generated, the error is logged and the list contains ``None``
+    for that source.
+    """
+    if backend is None:
+        backend = get_media_backend(fail_silently=False, supports_thumbnails=True)
+    sources = list(sources)
+    options_hash = get_options_hash(options)
+    prefetched = prefetch_thumbnails(sources, options)
+
+    versions = [get_source_version(source) for source in sources]
+    thumbnails = [None] * len(sources)
+    missing = []
+    for index, source in enumerate(sources):
+        entry = prefetched.get((getattr(source, 'name', None), options_hash))
+        if entry is not None and entry.source_version == versions[index]:
+            thumbnails[index] = entry
+        else:
+            missing.append(index)
+    if not missing:
+        return thumbnails
+
+    def generate(index):
+        try:
+            thumbnail = backend.get_thumbnail(sources[index], dict(options))
+            # Dimensions are determined here since this may require reading the
+            # thumbnail file from storage
+            return (thumbnail, __get_manifest_values(thumbnail) if thumbnail else None)
+        except (ThumbnailError, IOError, OSError):
+            # A broken source does not prevent the other thumbnails
+            logger.exception('Thumbnail of %s could not be generated',
+                getattr(sources[index], 'name', sources[index]))
+            return (None, None)
+
+    def generate_in_thread(index):
+        try:
+            return generate(index)
+        finally:
+            # Threads open their own database connections, e.g. if the backend
+            # keeps track of thumbnails in the database
+            for connection in connections.all():
+                connection.close()
+
+    if len(missing) > 1 and app_settings.MEDIA_TREE_THUMBNAIL_THREADS > 1:
+        pool = ThreadPool(min(len(missing), app_settings.MEDIA_TREE_THUMBNAIL_THREADS))
+        try:
+            results = pool.map(generate_in_thread, missing)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [generate(index) for index in missing]
+
+    for index, (thumbnail, values) in zip(missing, results):
+        thumbnails[index] = thumbnail
+        source_name = getattr(sources[index], 'name', None)
+        if thumbnail and source_name:
+            __store_manifest_entry(source_name, options_hash, versions[index], values)
+    return thumbnails
+
+
+def clear_manifest(source_names=None, urls=None):
+    """
+    Deletes the manifest entries for the given source names, or for thumbnails
+    with the given URLs, or all entries if neither is given. This needs to be
+    called when source or thumbnail files are deleted.
+    """
+    from media_tree.models import CachedThumbnail
+    if source_names is None and urls is None:
+        CachedThumbnail.objects.all().delete()
+        return
+    for field_name, values in (('source_name', source_names), ('url', urls)):
+        values = list(values or ())
+        for i in range(0, len(values), MANIFEST_CHUNK_SIZE):
+            CachedThumbnail.objects.filter(**{
+                '%s__in' % field_name: values[i:i + MANIFEST_CHUNK_SIZE]}).delete()
+
+
+def get_pregenerated_sizes():
+    """
+    Returns a list of all thumbnail sizes defined by ``MEDIA_TREE_ADMIN_THUMBNAIL_SIZES``
+    and ``MEDIA_TREE_THUMBNAIL_SIZES``, excluding sizes that mean "original size".
+    """
+    sizes = []
+    for size in list(app_settings.MEDIA_TREE_ADMIN_THUMBNAIL_SIZES.values())  \
+        + list(app_settings.MEDIA_TREE_THUMBNAIL_SIZES.values()):
+            if size and not size in sizes:
+                sizes.append(size)
+    return sizes
+
+
+def get_thumbnail_source(node):
+    """
+    Returns a ``(field_name, storage_name, source_version)`` tuple for the file
+    that thumbnails are generated from for ``node``, or ``None`` if there are
+    no thumbnails for the node.
+    """
+    if node.preview_file:
+        return ('preview_file', node.preview_file.name, get_source_version(node.preview_file))
+    if node.media_type == media_types.SUPPORTED_IMAGE and node.file:
+        return ('file', node.file.name, get_source_version(node.file))
+
+
+def generate_thumbnails(source, sizes=None):
+    """
+    Generates thumbnails in all pre-generated sizes for a source as returned by
+    :func:`get_thumbnail_source`, stores them in the manifest, and returns the
+    number of thumbnails that were generated. Thumbnails that are already in
+    the manifest are skipped. If the source cannot be read, the error is logged
+    and no further thumbnails are generated for it.
+    """
+    from media_tree.models import FileNode, CachedThumbnail
+    backend = get_media_backend(handles_media_types=(media_types.SUPPORTED_IMAGE,),
+        supports_thumbnails=True)
+    if not backend:
+        return 0
+    field_name, name, source_version = source
+    source_file = getattr(FileNode(**{field_name: name}), field_name)
+    existing = set(CachedThumbnail.objects.filter(source_name=name,
+        source_version=source_version).values_list('options_hash', flat=True))
+    count = 0
+    for size in sizes or get_pregenerated_sizes():
+        options = {'size': size}
+        options_hash = get_options_hash(options)
+        if options_hash in existing:
+            continue
+        try:
+            thumbnail = backend.get_thumbnail(source_file, dict(options))
+            if thumbnail:
+                __store_manifest_entry(name, options_hash, source_version,
+                    __get_manifest_values(thumbnail))
+        except (ThumbnailError, IOError, OSError):
+            logger.exception('Thumbnails of %s could not be generated', name)
+            break
+        if thumbnail:
+            count += 1
+    return count
+
+
+def __generate_in_background(source):
+    try:
+        generate_thumbnails(source)
+    except Exception:
+        # The pool would discard the exception
+        logger.exception('Thumbnails of %s could not be generated', source[1])
+    finally:
+        # The thread opens its own database connections for the manifest
+        for connection in connections.all():
+            connection.close()
+
+
+def __queue_thumbnails(source):
+    global __pool
+    with __pool_lock:
+        if __pool is None:
+            __pool = ThreadPool(app_settings.MEDIA_TREE_PREGENERATE_THREADS)
+    __pool.apply_async(__generate_in_background, (source,))
+
+
+def pregenerate_thumbnails(node):
+    """
+    Queues the generation of all thumbnails for ``node`` using
+    :func:`generate_thumbnails` in a pool of background threads that is shared
+    by the current process, and returns immediately. The thumbnails are queued
+    once the current transaction is committed. This is called when a file is
+    saved if ``MEDIA_TREE_PREGENERATE_THUMBNAILS`` is enabled.
+    """
+    source = get_thumbnail_source(node)
+    if source:
+        on_commit(lambda: __queue_thumbnails(source))